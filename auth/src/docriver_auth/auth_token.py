@@ -1,9 +1,29 @@
+import base64
+import collections
 import datetime
+import hashlib
+import json
+import threading
+import time
 import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa, ec, ed25519, ed448
 
 from docriver_auth.exceptions import AuthorizationException
 
-def issue(private_key, signer_cn, subject, audience, expires, resource, permissions):
+def algorithm_for(key):
+    # The signing algorithm follows from the key type (private or public), so the verifier never takes the algorithm from the token
+    if isinstance(key, (rsa.RSAPrivateKey, rsa.RSAPublicKey)):
+        return 'RS256'
+    if isinstance(key, (ec.EllipticCurvePrivateKey, ec.EllipticCurvePublicKey)):
+        algorithms = {'secp256r1': 'ES256', 'secp384r1': 'ES384', 'secp521r1': 'ES512'}
+        if key.curve.name not in algorithms:
+            raise AuthorizationException('Unsupported curve: {}'.format(key.curve.name))
+        return algorithms[key.curve.name]
+    if isinstance(key, (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey, ed448.Ed448PrivateKey, ed448.Ed448PublicKey)):
+        return 'EdDSA'
+    raise AuthorizationException('Unsupported key type: {}'.format(type(key).__name__))
+
+def issue(private_key, signer_cn, subject, audience, expires, resource, permissions, kid=None, claims=None):
     ts = datetime.datetime.utcnow()
     perms = {}
     if isinstance(permissions, list):
@@ -24,16 +44,94 @@ def issue(private_key, signer_cn, subject, audience, expires, resource, permissi
         'resource': resource,
         'permissions': perms
     }
-    encoded = jwt.encode(payload, private_key, algorithm="RS256")
+    if claims:
+        # Claims set by the issuer itself, never taken from the request
+        payload.update(claims)
+    # The kid lets the verifiers pick the key out of the issuer's key set (JWKS) when keys are rotated
+    encoded = jwt.encode(payload, private_key, algorithm=algorithm_for(private_key), headers={'kid': kid} if kid else None)
     return encoded,payload
 
+class TokenCache:
+    # Bounded LRU cache of verified claims, keyed by the digest of the token (and the audience it was verified for). An entry is used until the token expires. listener(event, count), if given, is told about the hits, misses and evictions (for metrics)
+    def __init__(self, max_entries, listener=None):
+        self.max_entries = max_entries
+        self.listener = listener
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'hit': 0, 'miss': 0, 'eviction': 0}
+
+    def count(self, event, count=1):
+        self.stats[event] = self.stats[event] + count
+        if self.listener:
+            self.listener(event, count)
+
+    def key(self, token, audience):
+        return hashlib.sha256('{}\0{}'.format(audience, token).encode('utf-8')).digest()
+
+    def get(self, key, public_keys):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry:
+                expires, claims, issuer, kid, public_key = entry
+                # The issuer's key may have been rotated or removed since the token was verified
+                if expires > time.time() and find_key(public_keys, issuer, kid, refresh=False) is public_key:
+                    self.entries.move_to_end(key)
+                    self.count('hit')
+                    return claims, issuer
+                del self.entries[key]
+                self.count('eviction')
+            self.count('miss')
+            return None
+
+    def put(self, key, claims, issuer, kid, public_key):
+        if 'exp' not in claims:
+            # Tokens without an expiry are verified every time
+            return
+        with self.lock:
+            self.entries[key] = (claims['exp'], claims, issuer, kid, public_key)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.count('eviction')
+
+token_cache = None
+
+def init_token_cache(max_entries, listener=None):
+    global token_cache
+    token_cache = TokenCache(max_entries, listener) if max_entries > 0 else None
+    return token_cache
+
+def decode_segment(segment):
+    return json.loads(base64.urlsafe_b64decode(segment + '=' * (-len(segment) % 4)))
+
+def unverified_issuer(token):
+    # Reads "kid" from the header and "iss" from the payload segment, without going through a second JWT decode. The signature check that follows makes sure they can be trusted
+    try:
+        segments = token.split('.')
+        return decode_segment(segments[0]).get('kid'), decode_segment(segments[1])['iss']
+    except (IndexError, ValueError, KeyError, TypeError, AttributeError):
+        raise AuthorizationException('Invalid token')
+
+def find_key(public_keys, issuer, kid, refresh=True):
+    # public_keys is either {issuer: public key} (keystore) or a key set that selects the key by kid (see docriver_auth.jwks). Returns None if not found
+    if hasattr(public_keys, 'find_key'):
+        return public_keys.find_key(issuer, kid, refresh)
+    return public_keys.get(issuer)
+
 def decode(public_keys, token, audience):
-    # Read the payload without verification in order to get the issuer information
-    payload = jwt.decode(token, options={"verify_signature": False})
-    issuer = payload['iss']
-    if issuer not in public_keys:
+    key = token_cache.key(token, audience) if token_cache else None
+    if key:
+        cached = token_cache.get(key, public_keys)
+        if cached:
+            return cached
+
+    kid, issuer = unverified_issuer(token)
+    public_key = find_key(public_keys, issuer, kid)
+    if public_key is None:
         raise AuthorizationException('Issuer not found')
-    public_key = public_keys[issuer]
 
-    # Verify signature to ensure that the issuer matches
-    return jwt.decode(token, public_key, algorithms=["RS256"], audience=audience), issuer
\ No newline at end of file
+    # Verify signature to ensure that the issuer matches. Only the algorithm of the issuer's key is accepted
+    claims = jwt.decode(token, public_key, algorithms=[algorithm_for(public_key)], audience=audience)
+    if key:
+        token_cache.put(key, claims, issuer, kid, public_key)
+    return claims, issuer
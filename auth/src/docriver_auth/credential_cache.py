@@ -0,0 +1,41 @@
+import collections
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+class CredentialCache:
+    # Bounded LRU cache of the credentials that passed the (deliberately slow) password check, for ttl seconds. The entries are keyed by an HMAC of the credentials with a random per-process key, so that the cache does not hold the passwords or hashes that could be attacked offline. Failed checks are not cached
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.secret = os.urandom(32)
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'hit': 0, 'miss': 0}
+
+    def key(self, credentials):
+        return hmac.new(self.secret, credentials.encode('utf-8'), hashlib.sha256).digest()
+
+    def verified(self, credentials):
+        # Returns the subject the credentials were verified for, or None
+        key = self.key(credentials)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > time.time():
+                self.entries.move_to_end(key)
+                self.stats['hit'] = self.stats['hit'] + 1
+                return entry[1]
+            if entry:
+                del self.entries[key]
+            self.stats['miss'] = self.stats['miss'] + 1
+            return None
+
+    def add(self, credentials, subject):
+        key = self.key(credentials)
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, subject)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
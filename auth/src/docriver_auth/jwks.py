@@ -0,0 +1,138 @@
+import base64
+import hashlib
+import json
+import logging
+import threading
+import time
+import urllib.request
+
+import jwt
+from jwt.algorithms import RSAAlgorithm, ECAlgorithm, OKPAlgorithm
+from cryptography.hazmat.primitives.asymmetric import rsa, ec
+
+# JSON Web Key Sets (RFC 7517): publishing the verification keys of an issuer (see the token server) and fetching them on the verifier side
+
+# Members of the RFC 7638 thumbprint, by key type
+THUMBPRINT_MEMBERS = {'RSA': ['e', 'kty', 'n'], 'EC': ['crv', 'kty', 'x', 'y'], 'OKP': ['crv', 'kty', 'x']}
+
+def to_jwk(public_key, kid=None):
+    if isinstance(public_key, rsa.RSAPublicKey):
+        jwk = RSAAlgorithm.to_jwk(public_key, as_dict=True)
+    elif isinstance(public_key, ec.EllipticCurvePublicKey):
+        jwk = ECAlgorithm.to_jwk(public_key, as_dict=True)
+    else:
+        jwk = OKPAlgorithm.to_jwk(public_key, as_dict=True)
+    jwk['kid'] = kid if kid else thumbprint(jwk)
+    jwk['use'] = 'sig'
+    return jwk
+
+def thumbprint(jwk):
+    # RFC 7638: a kid derived from the key, so a new key gets a new kid without configuration
+    canonical = json.dumps({member: jwk[member] for member in THUMBPRINT_MEMBERS[jwk['kty']]}, separators=(',', ':'), sort_keys=True)
+    return base64.urlsafe_b64encode(hashlib.sha256(canonical.encode('utf-8')).digest()).decode('utf-8').rstrip('=')
+
+def key_id(public_key):
+    return to_jwk(public_key)['kid']
+
+def to_jwks(public_keys):
+    return {'keys': [to_jwk(public_key) for public_key in public_keys]}
+
+def parse_jwks(jwks):
+    # {kid: public key}. Keys that cannot be used for signatures are skipped
+    keys = {}
+    for jwk in jwks.get('keys', []):
+        if jwk.get('use', 'sig') != 'sig' or 'kid' not in jwk:
+            continue
+        try:
+            keys[jwk['kid']] = jwt.PyJWK(jwk).key
+        except Exception as e:
+            logging.warning("Skipping key: {}. Exception: {}".format(jwk.get('kid'), e))
+    return keys
+
+def fetch_jwks(url, timeout):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return json.loads(response.read())
+
+class JwksKeySet:
+    # Verification keys of the issuers, by issuer and kid: fetched from each issuer's JWKS URL and refreshed in the background every refresh_interval seconds. A token with a kid that is not known yet triggers a refresh (at most every min_refresh_interval seconds), so that a rotated key is picked up right away. The keys of a keystore ({issuer: public key}) can be added as a fallback for the issuers without a JWKS URL.
+    # Used in place of the {issuer: public key} dictionary by docriver_auth.auth_token.decode
+    def __init__(self, sources, static_keys=None, refresh_interval=300, min_refresh_interval=30, timeout=5):
+        self.sources = sources
+        self.static_keys = static_keys if static_keys else {}
+        self.refresh_interval = refresh_interval
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.keys = {issuer: {} for issuer in sources}
+        self.refreshed_at = {issuer: 0 for issuer in sources}
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.stats = {'refresh': 0, 'failure': 0}
+
+    def __bool__(self):
+        return bool(self.sources) or bool(self.static_keys)
+
+    def __contains__(self, issuer):
+        return issuer in self.sources or issuer in self.static_keys
+
+    def refresh(self, issuer):
+        with self.lock:
+            self.refreshed_at[issuer] = time.time()
+        try:
+            keys = parse_jwks(fetch_jwks(self.sources[issuer], self.timeout))
+        except Exception as e:
+            # Keep the keys fetched last
+            self.stats['failure'] = self.stats['failure'] + 1
+            logging.warning("Unable to fetch the keys of issuer: {} from {}. Exception: {}".format(issuer, self.sources[issuer], e))
+            return False
+        with self.lock:
+            # Unchanged keys keep their identity, so that the verified tokens cached for them stay valid (see TokenCache)
+            previous = self.keys[issuer]
+            self.keys[issuer] = {kid: previous[kid] if kid in previous and previous[kid] == key else key for kid, key in keys.items()}
+        self.stats['refresh'] = self.stats['refresh'] + 1
+        logging.info("Fetched the keys of issuer: {}. kids: {}".format(issuer, list(keys.keys())))
+        return True
+
+    def refresh_all(self):
+        for issuer in self.sources:
+            self.refresh(issuer)
+
+    def find_key(self, issuer, kid, refresh=True):
+        if issuer not in self.sources:
+            return self.static_keys.get(issuer)
+        key = self.lookup(issuer, kid)
+        if key is None and refresh and self.refresh_due(issuer):
+            self.refresh(issuer)
+            key = self.lookup(issuer, kid)
+        return key
+
+    def refresh_due(self, issuer):
+        # Unknown kids (possibly forged) do not cause more than one fetch per min_refresh_interval, however many requests carry them
+        with self.lock:
+            now = time.time()
+            if now - self.refreshed_at[issuer] < self.min_refresh_interval:
+                return False
+            self.refreshed_at[issuer] = now
+            return True
+
+    def lookup(self, issuer, kid):
+        keys = self.keys[issuer]
+        if kid:
+            return keys.get(kid)
+        # Tokens without a kid are accepted while the issuer has a single key
+        return next(iter(keys.values())) if len(keys) == 1 else None
+
+    def run(self):
+        while not self.stop_event.wait(self.refresh_interval):
+            self.refresh_all()
+
+    def start(self):
+        self.refresh_all()
+        self.thread = threading.Thread(target=self.run, name='jwks-refresh', daemon=True)
+        self.thread.start()
+        return self
+
+    def shutdown(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
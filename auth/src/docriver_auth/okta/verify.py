@@ -1,17 +1,46 @@
-import asyncio
-from okta_jwt_verifier import BaseJWTVerifier
-from okta_jwt_verifier.exceptions import JWTValidationException
+import jwt
+
+from docriver_auth.exceptions import AuthorizationException
+from docriver_auth.auth_token import TokenCache, algorithm_for, unverified_issuer
+from docriver_auth.jwks import JwksKeySet
 
 class OktaTokenValidator:
-    def __init__(self, okta_url, okta_aud) -> None:
+    # Verifies the OKTA access tokens locally, against the keys of the authorization server (JWKS), which are fetched at start, refreshed in the background and on an unknown kid (see docriver_auth.jwks). The verified claims are cached until the token expires. There is no event loop or other per-request state, so the validator can be shared by the request threads
+    def __init__(self, okta_url, okta_aud, jwks_url=None, refresh_interval=300, cache_size=10000, leeway=120):
         self.okta_url = okta_url
         self.okta_aud = okta_aud
-        self.loop = asyncio.get_event_loop()
-        self.jwt_verifier = BaseJWTVerifier(issuer=okta_url, audience=okta_aud)
+        # Allowed clock skew (in seconds) with the authorization server
+        self.leeway = leeway
+        # The keys of an OKTA authorization server are published at {issuer}/v1/keys
+        self.key_set = JwksKeySet({okta_url: jwks_url if jwks_url else '{}/v1/keys'.format(okta_url.rstrip('/'))}, refresh_interval=refresh_interval)
+        self.cache = TokenCache(cache_size) if cache_size > 0 else None
+
+    def start(self):
+        self.key_set.start()
+        return self
 
-    async def verify_sync(self, token):
-        await self.jwt_verifier.verify_access_token(token)
+    def shutdown(self):
+        self.key_set.shutdown()
 
     def verify(self, token):
-        self.loop.run_until_complete(self.verify_sync(token))
-        return self.jwt_verifier.parse_token(token)
\ No newline at end of file
+        # Returns the claims of the token
+        key = self.cache.key(token, self.okta_aud) if self.cache else None
+        if key:
+            cached = self.cache.get(key, self.key_set)
+            if cached:
+                return cached[0]
+
+        kid, issuer = unverified_issuer(token)
+        if issuer != self.okta_url:
+            raise AuthorizationException('Issuer mismatch')
+        public_key = self.key_set.find_key(issuer, kid)
+        if public_key is None:
+            raise AuthorizationException('Signing key not found')
+        try:
+            claims = jwt.decode(token, public_key, algorithms=[algorithm_for(public_key)], audience=self.okta_aud,
+                                issuer=self.okta_url, leeway=self.leeway, options={'require': ['exp', 'iat', 'sub']})
+        except jwt.PyJWTError as e:
+            raise AuthorizationException('Invalid token: {}'.format(e))
+        if key:
+            self.cache.put(key, claims, issuer, kid, public_key)
+        return claims
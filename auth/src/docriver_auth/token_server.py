@@ -5,18 +5,27 @@ import sys
 import base64
 import uuid
 import json
+import time
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from flask_accept import accept
+import jwt
 from passlib.apache import HtpasswdFile
 from okta.verify import OktaTokenValidator
 
-from exceptions import AuthorizationException
+from docriver_auth.exceptions import AuthorizationException
 from keystore import get_entries
-from auth_token import issue
+from auth_token import issue, algorithm_for, unverified_issuer
+from jwks import to_jwks, key_id
+from credential_cache import CredentialCache
 
 app = Flask(__name__)
 
+# Audience of the session tokens: they are only accepted here, by /token, and never by a gateway
+SESSION_AUDIENCE = 'docriver-session'
+# Set on the session tokens only (by /session), so that an access token issued by /token can never pass as a session
+SESSION_CLAIMS = {'token_use': 'session'}
+
 class ValidationException(Exception):
     def __init__(self, message="Validation exception"):
         self.message = message
@@ -30,16 +39,34 @@ def parse_args(args):
                         help='A PKCS12 keystore file')
     parser.add_argument('--password', default=None,
                         help='Keystore password')
+    parser.add_argument('--keystoreReloadInterval', type=int, default=60,
+                        help='How often (in seconds) the keystore is checked for a new signing key. The key type decides the algorithm: RSA - RS256, EC P-256 - ES256, Ed25519 - EdDSA')
+    parser.add_argument('--jwksKeystores', default=None,
+                        help='Comma separated PKCS12 keystores (same password) whose keys are published on the JWKS endpoint along with the signing key, such as the previous key while the tokens it signed are still valid')
     
     parser.add_argument('--oktaUrl', default=None,
                         help='OKTA token URL')
     parser.add_argument('--oktaAud', default=None,
                         help='OKTA token audience')
+    parser.add_argument('--oktaJwksUrl', default=None,
+                        help='URL of the OKTA signing keys (JWKS). Default: {oktaUrl}/v1/keys')
+    parser.add_argument('--oktaJwksRefreshInterval', type=int, default=300,
+                        help='How often (in seconds) the OKTA signing keys are fetched in the background')
+    parser.add_argument('--oktaTokenCacheSize', type=int, default=10000,
+                        help='Maximum number of verified OKTA tokens kept in memory until they expire. 0 to disable')
  
     parser.add_argument('--users', default=None,
                         help="A file containing all users/roles/etc. Used for basic authorization")
     parser.add_argument('--passwords', default=None,
                         help="A file containing htpasswords. Used for basic authentication")
+    parser.add_argument('--usersReloadInterval', type=int, default=60,
+                        help="How often (in seconds) the users and passwords files are checked for changes. A removed user or changed permissions take effect on the sessions after this")
+    parser.add_argument('--credentialCacheSize', type=int, default=1000,
+                        help="Maximum number of verified basic auth credentials kept in memory, so that the password hash is not checked on every request. 0 to disable")
+    parser.add_argument('--credentialCacheTtl', type=int, default=300,
+                        help="How long (in seconds) verified basic auth credentials are cached. A password change or removed user takes effect after this")
+    parser.add_argument('--sessionExpiry', type=int, default=900,
+                        help="Expiry (in seconds) of the session tokens issued by /session. A client holding one gets access tokens from /token without sending the password again")
     
     parser.add_argument('--permissions', required=True,
                         help="A file containing all the grants/permissions for various roles")
@@ -92,31 +119,116 @@ def authorize_request(assigned_permissions, requested_permissions):
     if requested_permissions['txType'] == 'submit':
         authorize_resource(assigned_permissions, requested_permissions['resourceType'])
 
+def load_keys(keystore, password, jwks_keystores):
+    global private_key, signer_cn, signer_cert, kid, jwks, session_keys, keystore_modified
+    keystore_modified = os.stat(keystore).st_mtime
+    private_key, public_key, signer_cert, signer_cn, public_keys = get_entries(keystore, password)
+    # The kid is the RFC 7638 thumbprint of the key: a new key gets a new kid
+    kid = key_id(public_key)
+    published = [public_key]
+    for filename in jwks_keystores.split(',') if jwks_keystores else []:
+        published.append(get_entries(filename, password)[1])
+    jwks = to_jwks(published)
+    # The session tokens signed with any of the published keys stay valid across a key rotation
+    session_keys = {key_id(key): key for key in published}
+    logging.info("Signing key: {}, published keys: {}".format(kid, [key['kid'] for key in jwks['keys']]))
+
+def check_keys():
+    # Picks up a replaced keystore without a restart
+    global keys_checked_at
+    now = time.time()
+    if now - keys_checked_at < args.keystoreReloadInterval:
+        return
+    keys_checked_at = now
+    try:
+        if os.stat(args.keystore).st_mtime != keystore_modified:
+            load_keys(args.keystore, args.password, args.jwksKeystores)
+    except Exception as e:
+        logging.error("Unable to reload the keystore, signing with the current key. Exception: {}".format(e))
+
+def load_users(users_file, passwords_file):
+    global users, passwords, users_modified
+    users_modified = os.stat(users_file).st_mtime
+    with open(users_file, 'r') as file:
+        users = json.loads(file.read())
+    passwords = HtpasswdFile(passwords_file)
+
+def check_users():
+    # Picks up a changed users or passwords file without a restart
+    global users_checked_at
+    if not args.users:
+        return
+    now = time.time()
+    if now - users_checked_at < args.usersReloadInterval:
+        return
+    users_checked_at = now
+    try:
+        if os.stat(args.users).st_mtime != users_modified:
+            load_users(args.users, args.passwords)
+        else:
+            passwords.load_if_changed()
+    except Exception as e:
+        logging.error("Unable to reload the users, using the current ones. Exception: {}".format(e))
+
+@app.route('/.well-known/jwks.json', methods=['GET'])
+def get_jwks():
+    # The verification keys of this issuer, for the gateways (see docriver_auth.jwks)
+    check_keys()
+    return jsonify(jwks), 200, {'Content-Type': 'application/json', 'Cache-Control': 'max-age={}'.format(args.keystoreReloadInterval)}
+
 @app.route('/health', methods=['GET'])
 def health():
     return jsonify({'system': 'UP'}), 200, {'Content-Type': 'application/json'}
 
+def authenticate(payload, session=True):
+    # Returns the subject, the permissions assigned to it and when the authentication expires (None for basic authentication). A session token (see /session) is accepted in place of the credentials if session is True
+    check_users()
+    authorization = payload['authorization'] if 'authorization' in payload else request.headers.get('Authorization') if 'Authorization' in request.headers else request.cookies['auth'] if 'auth' in request.cookies else None
+    if not authorization:
+        raise ValidationException('Authorization not found')
+    splits = authorization.split()
+    if len(splits) != 2:
+        raise ValidationException('Unsupported authorization method')
+    if splits[0].lower() == 'basic':
+        return get_sub_and_perms_from_db(splits[1])
+    elif splits[0].lower() == 'bearer':
+        if unverified_issuer(splits[1])[1] == signer_cn:
+            if not session:
+                raise AuthorizationException('A session token cannot be used to get a session')
+            return get_sub_and_perms_from_session(splits[1])
+        return get_sub_and_perms_from_token(splits[1])
+    else:
+        raise ValidationException('Unsupported authorization method')
+
+@app.route('/session', methods=['POST'])
+def get_session():
+    # Authenticates once (basic or OKTA) and returns a session token that /token accepts, for clients that need many access tokens (one per transaction). For basic authentication, /token looks up the permissions currently assigned to the subject. An OKTA session carries the permissions of the OKTA token and does not outlive it, since they cannot be looked up again
+    payload = request.json if request.is_json else {}
+    subject,assigned_permissions,expires = authenticate(payload, session=False)
+
+    check_keys()
+    expiry = args.sessionExpiry
+    if expires:
+        expiry = min(expiry, int(expires - time.time()))
+        encoded, payload = issue(private_key, signer_cn, subject, SESSION_AUDIENCE, expiry, 'session', assigned_permissions, kid, {**SESSION_CLAIMS, 'auth': 'okta'})
+    else:
+        encoded, payload = issue(private_key, signer_cn, subject, SESSION_AUDIENCE, expiry, 'session', {}, kid, {**SESSION_CLAIMS, 'auth': 'basic'})
+
+    logging.info("Session issued to {}".format(subject))
+    return jsonify({'session': 'Bearer ' + encoded, 'expires': payload['exp']}), 200, {'Content-Type': 'application/json'}
+
 @app.route('/token', methods=['POST'])
 def get_token():
     payload = request.json
 
-    subject = None
-    assigned_permissions = None
-    authorization = payload['authorization'] if 'authorization' in payload else request.headers.get('Authorization') if 'Authorization' in request.headers else request.cookies['auth'] if 'auth' in request.cookies else None
-    if authorization:
-        splits = authorization.split()
-        if splits[0].lower() == 'basic':
-            subject,assigned_permissions = get_sub_and_perms_from_db(splits[1])
-        elif splits[0].lower() == 'bearer':
-            subject,assigned_permissions = get_sub_and_perms_from_token(splits[1])
-        else:
-            raise ValidationException('Unsupported authorization method')
-    else:
-        raise ValidationException('Authorization not found')
+    check_keys()
+    subject,assigned_permissions,expires = authenticate(payload)
 
     if 'audience' not in payload:
         raise ValidationException('audience is required')
     audience = payload['audience']
+    if audience == SESSION_AUDIENCE:
+        raise AuthorizationException('Sessions are only issued by /session')
 
     if 'permissions' not in payload:
         raise ValidationException('permissions is required')
@@ -133,8 +245,10 @@ def get_token():
     expires = 60
 
     resource = payload['resource'] if 'resource' in payload else 'document'
+    if resource == 'session':
+        raise AuthorizationException('Sessions are only issued by /session')
 
-    encoded, payload = issue(private_key, signer_cn, subject, audience, expires, resource, requested_permissions)
+    encoded, payload = issue(private_key, signer_cn, subject, audience, expires, resource, requested_permissions, kid)
 
     logging.info("Token issued to {}".format(subject))
     return jsonify({'authorization': 'Bearer ' + encoded, 'token': payload}), 200, {'Content-Type': 'application/json'}
@@ -143,23 +257,48 @@ def get_sub_and_perms_from_db(token):
     if not users:
         raise ValidationException('Basic Auth token validator is not configured')
     user_passwd = base64.b64decode(bytes(token, 'utf-8')).decode("utf-8")
-    splits = user_passwd.split(':')
+    splits = user_passwd.split(':', 1)
+    if len(splits) != 2:
+        raise ValidationException('Invalid basic authorization')
     subject = splits[0]
     passwd = splits[1]
     # Validate password
     if subject not in users:
         raise AuthorizationException(f"Authentication failed - user: {subject} not found")
-    # TODO Introduce AuthenticationException
-    if not passwords.check_password(subject, passwd):
-        raise AuthorizationException("Authentication failed - password mismatch")
+    # The password hash (bcrypt, apr1) is slow by design: the credentials that passed are remembered for a while
+    if not credential_cache or credential_cache.verified(user_passwd) != subject:
+        # TODO Introduce AuthenticationException
+        if not passwords.check_password(subject, passwd):
+            raise AuthorizationException("Authentication failed - password mismatch")
+        if credential_cache:
+            credential_cache.add(user_passwd, subject)
     assigned_permissions = users[subject]
     # logging.info(assigned_permissions)
-    return subject,assigned_permissions
+    return subject,assigned_permissions,None
+
+def get_sub_and_perms_from_session(token):
+    session_kid = unverified_issuer(token)[0]
+    if session_kid not in session_keys:
+        raise AuthorizationException('Session key not found')
+    key = session_keys[session_kid]
+    try:
+        claims = jwt.decode(token, key, algorithms=[algorithm_for(key)], audience=SESSION_AUDIENCE)
+    except jwt.PyJWTError as e:
+        raise AuthorizationException("Invalid session: {}".format(e))
+    if claims.get('token_use') != SESSION_CLAIMS['token_use'] or claims.get('resource') != 'session':
+        raise AuthorizationException('Not a session token')
+    subject = claims['sub']
+    if claims.get('auth') == 'okta':
+        return subject,claims['permissions'],claims['exp']
+    # The current assignment, so that a removed user or reduced permissions take effect before the session expires
+    if not users or subject not in users or not passwords.get_hash(subject):
+        raise AuthorizationException(f"Session revoked - user: {subject} not found")
+    return subject,users[subject],claims['exp']
 
 def get_sub_and_perms_from_token(token):
     if not okta_token_validator:
         raise ValidationException('Bearer token validator is not configured. Currently, only OKTA is supported for authorization tokens')
-    headers, claims, signing_inputs, signature = okta_token_validator.verify(token)
+    claims = okta_token_validator.verify(token)
     subject = claims['sub']
     permissions = claims['docriverPermissions'] if 'docriverPermissions' in claims else None
     
@@ -169,7 +308,7 @@ def get_sub_and_perms_from_token(token):
     assigned_permissions = None
     try:
         assigned_permissions = json.loads(permissions)
-        return subject,assigned_permissions
+        return subject,assigned_permissions,claims['exp']
     except(json.decoder.JSONDecodeError):
         raise ValidationException("Assigned permissions not in JSON format")
     
@@ -187,32 +326,38 @@ def handle_internal_error(e):
     logging.error(e, exc_info=True)
     return jsonify({'error': str(e)}), 500, {'Content-Type': 'application/json'}
 
-if __name__ == '__main__':
-    global private_key, signer_cn, signer_cert, okta_token_validator, permissions, users, passwords
-    
-    args = parse_args(sys.argv[1:])
-    logging.basicConfig(level=args.log)
+def init(parsed_args):
+    global args, okta_token_validator, permissions, users, passwords, credential_cache, keys_checked_at, users_checked_at
+    args = parsed_args
 
     file_content = None
     with open(args.permissions, 'r') as file:
         file_content = file.read()
     permissions = json.loads(file_content)
 
+    users = None
+    credential_cache = None
     if args.users:
-        file_content = None
-        with open(args.users, 'r') as file:
-            file_content = file.read()
-        users = json.loads(file_content)
-        passwords = HtpasswdFile(args.passwords)
+        load_users(args.users, args.passwords)
+        users_checked_at = time.time()
+        if args.credentialCacheSize > 0:
+            credential_cache = CredentialCache(args.credentialCacheSize, args.credentialCacheTtl)
         
-    private_key, public_key, signer_cert, signer_cn, public_keys = get_entries(args.keystore, args.password)
+    load_keys(args.keystore, args.password, args.jwksKeystores)
+    keys_checked_at = time.time()
     
     okta_token_validator = None
     if args.oktaUrl:
-        okta_token_validator = OktaTokenValidator(args.oktaUrl, args.oktaAud)
+        okta_token_validator = OktaTokenValidator(args.oktaUrl, args.oktaAud, args.oktaJwksUrl,
+                                                  args.oktaJwksRefreshInterval, args.oktaTokenCacheSize).start()
+    return app
 
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    logging.basicConfig(level=args.log)
+    init(args)
     CORS(app, resources={r"/*": {"origins": "*"}})
-    
+
     if args.tlsKey:
         logging.info("Starting server in TLS mode - cert: {}, key: {}".format(args.tlsCert, args.tlsKey))
         app.run(host="0.0.0.0", ssl_context=(args.tlsCert, args.tlsKey), port=args.httpPort, debug=args.debug)
@@ -0,0 +1,53 @@
+import json
+import datetime
+import pytest
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.serialization import pkcs12
+from passlib.apache import HtpasswdFile
+
+import token_server
+
+SIGNER_CN = 'docriver'
+KEYSTORE_PASSWORD = 'docriver'
+PERMISSIONS = {'reader': ['get-document'], 'submitter': ['submit', 'get-document']}
+USERS = {'alice': {'realms': ['r1'], 'roles': ['reader'], 'resources': ['claim']},
+         'bob': {'realms': ['r1', 'r2'], 'roles': ['submitter'], 'resources': ['claim']}}
+PASSWORDS = {'alice': 'alice-secret', 'bob': 'bob-secret'}
+
+def write_keystore(filename, cn):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, cn)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(private_key.public_key()) \
+        .serial_number(x509.random_serial_number()).not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1)) \
+        .sign(private_key, hashes.SHA256())
+    with open(filename, 'wb') as file:
+        file.write(pkcs12.serialize_key_and_certificates(cn.encode('utf-8'), private_key, cert, None,
+            serialization.BestAvailableEncryption(KEYSTORE_PASSWORD.encode('utf-8'))))
+    return str(filename)
+
+def write_json(filename, content):
+    with open(filename, 'w') as file:
+        json.dump(content, file)
+    return str(filename)
+
+@pytest.fixture()
+def token_server_config(tmp_path):
+    htpasswd = HtpasswdFile(str(tmp_path / 'htpasswd'), new=True)
+    for user, password in PASSWORDS.items():
+        htpasswd.set_password(user, password)
+    htpasswd.save()
+    return ['--keystore', write_keystore(tmp_path / 'docriver.p12', SIGNER_CN),
+            '--password', KEYSTORE_PASSWORD,
+            '--permissions', write_json(tmp_path / 'permissions.json', PERMISSIONS),
+            '--users', write_json(tmp_path / 'users.json', USERS),
+            '--passwords', str(tmp_path / 'htpasswd')]
+
+@pytest.fixture()
+def token_client(token_server_config):
+    app = token_server.init(token_server.parse_args(token_server_config))
+    with app.test_client() as client:
+        yield client
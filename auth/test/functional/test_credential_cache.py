@@ -0,0 +1,31 @@
+from credential_cache import CredentialCache
+
+def test_credential_cache():
+    cache = CredentialCache(2, 300)
+    assert cache.verified('alice:secret') is None
+    cache.add('alice:secret', 'alice')
+    assert 'alice' == cache.verified('alice:secret')
+    assert cache.verified('alice:other') is None
+    assert {'hit': 1, 'miss': 2} == cache.stats
+    # Neither the credentials nor the password are kept
+    assert all(['secret' not in str(key) for key in cache.entries.keys()])
+
+def test_credential_cache_bounded():
+    cache = CredentialCache(2, 300)
+    cache.add('a:1', 'a')
+    cache.add('b:1', 'b')
+    assert 'a' == cache.verified('a:1')
+    cache.add('c:1', 'c')
+    # b was the least recently used
+    assert cache.verified('b:1') is None
+    assert 'a' == cache.verified('a:1') and 'c' == cache.verified('c:1')
+
+def test_credential_cache_expiry():
+    cache = CredentialCache(2, 0)
+    cache.add('a:1', 'a')
+    assert cache.verified('a:1') is None
+    assert 0 == len(cache.entries)
+
+def test_credential_cache_key():
+    # Keyed with a secret of the process: the same credentials map to different keys in another process
+    assert CredentialCache(1, 1).key('a:1') != CredentialCache(1, 1).key('a:1')
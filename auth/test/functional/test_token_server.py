@@ -0,0 +1,88 @@
+import jwt
+import token_server
+from test.functional.fixture import token_server_config, token_client, write_keystore, write_json, SIGNER_CN, KEYSTORE_PASSWORD, USERS
+from test.functional.util import basic, get_token, get_session
+
+READ_R1 = {'txType': 'get-document', 'realm': 'r1'}
+SUBMIT_R2 = {'txType': 'submit', 'realm': 'r2', 'resourceType': 'claim'}
+
+def test_basic_token(token_client):
+    response = get_token(token_client, basic('alice', 'alice-secret'), dict(READ_R1))
+    assert 200 == response.status_code
+    assert 'alice' == response.json['token']['sub']
+    assert 403 == get_token(token_client, basic('alice', 'wrong'), dict(READ_R1)).status_code
+    assert 403 == get_token(token_client, basic('alice', 'alice-secret'), dict(SUBMIT_R2)).status_code
+
+def test_basic_token_credential_cache(token_client):
+    for i in range(3):
+        assert 200 == get_token(token_client, basic('alice', 'alice-secret'), dict(READ_R1)).status_code
+    assert 2 == token_server.credential_cache.stats['hit']
+    # A wrong password is checked every time, and does not replace the verified one
+    for i in range(2):
+        assert 403 == get_token(token_client, basic('alice', 'wrong'), dict(READ_R1)).status_code
+    assert 200 == get_token(token_client, basic('alice', 'alice-secret'), dict(READ_R1)).status_code
+    assert 3 == token_server.credential_cache.stats['hit']
+
+def test_session(token_client):
+    response = get_session(token_client, basic('bob', 'bob-secret'))
+    assert 200 == response.status_code
+    session = response.json['session']
+    claims = jwt.decode(session.split()[1], options={'verify_signature': False})
+    assert 'session' == claims['token_use'] and [token_server.SESSION_AUDIENCE] == claims['aud']
+
+    response = get_token(token_client, session, dict(SUBMIT_R2))
+    assert 200 == response.status_code
+    assert 'bob' == response.json['token']['sub']
+    # Authorized against the permissions assigned to the subject, and no more
+    assert 403 == get_token(token_client, session, {'txType': 'submit', 'realm': 'r3', 'resourceType': 'claim'}).status_code
+    # A session cannot be used to get another one
+    assert 403 == get_session(token_client, session).status_code
+    assert 403 == get_session(token_client, basic('bob', 'wrong')).status_code
+
+def test_session_expired(token_server_config):
+    app = token_server.init(token_server.parse_args(token_server_config + ['--sessionExpiry', '-60']))
+    with app.test_client() as client:
+        session = get_session(client, basic('bob', 'bob-secret')).json['session']
+        assert 403 == get_token(client, session, dict(SUBMIT_R2)).status_code
+
+def test_session_forged_with_token(token_client):
+    # An access token must not pass as a session, whatever the audience, resource and permissions requested
+    forged = {'realms': ['r9'], 'roles': ['submitter'], 'resources': ['x'], 'txType': 'get-document', 'realm': 'r1'}
+    assert 403 == get_token(token_client, basic('alice', 'alice-secret'), dict(forged), audience=token_server.SESSION_AUDIENCE, resource='session').status_code
+    assert 403 == get_token(token_client, basic('alice', 'alice-secret'), dict(forged), audience=token_server.SESSION_AUDIENCE).status_code
+    assert 403 == get_token(token_client, basic('alice', 'alice-secret'), dict(forged), resource='session').status_code
+
+    token = get_token(token_client, basic('alice', 'alice-secret'), dict(forged)).json['authorization']
+    assert 403 == get_token(token_client, token, {'txType': 'submit', 'realm': 'r9', 'resourceType': 'x'}).status_code
+
+def test_session_key_rotation(token_server_config, tmp_path):
+    app = token_server.init(token_server.parse_args(token_server_config + ['--keystoreReloadInterval', '0']))
+    with app.test_client() as client:
+        session = get_session(client, basic('bob', 'bob-secret')).json['session']
+        assert 200 == get_token(client, session, dict(SUBMIT_R2)).status_code
+
+        # Replaced signing key: the sessions it signed are no longer accepted
+        keystore = token_server_config[token_server_config.index('--keystore') + 1]
+        write_keystore(tmp_path / 'new.p12', SIGNER_CN)
+        (tmp_path / 'new.p12').replace(keystore)
+        token_server.keystore_modified = 0
+        assert 403 == get_token(client, session, dict(SUBMIT_R2)).status_code
+        assert 200 == get_token(client, get_session(client, basic('bob', 'bob-secret')).json['session'], dict(SUBMIT_R2)).status_code
+
+def test_session_current_permissions(token_server_config):
+    app = token_server.init(token_server.parse_args(token_server_config + ['--usersReloadInterval', '0']))
+    with app.test_client() as client:
+        session = get_session(client, basic('bob', 'bob-secret')).json['session']
+        assert 200 == get_token(client, session, dict(SUBMIT_R2)).status_code
+
+        users_file = token_server_config[token_server_config.index('--users') + 1]
+        # Permissions reduced: the session no longer gets what it was issued with
+        write_json(users_file, {**USERS, 'bob': {**USERS['bob'], 'realms': ['r1']}})
+        token_server.users_modified = 0
+        assert 403 == get_token(client, session, dict(SUBMIT_R2)).status_code
+        assert 200 == get_token(client, session, {'txType': 'submit', 'realm': 'r1', 'resourceType': 'claim'}).status_code
+
+        # User removed
+        write_json(users_file, {'alice': USERS['alice']})
+        token_server.users_modified = 0
+        assert 403 == get_token(client, session, {'txType': 'submit', 'realm': 'r1', 'resourceType': 'claim'}).status_code
@@ -0,0 +1,13 @@
+import base64
+
+def basic(user, password):
+    return 'Basic ' + base64.b64encode('{}:{}'.format(user, password).encode('utf-8')).decode('utf-8')
+
+def get_token(client, authorization, permissions, audience='docriver', resource=None):
+    payload = {'audience': audience, 'permissions': permissions}
+    if resource:
+        payload['resource'] = resource
+    return client.post('/token', json=payload, headers={'Authorization': authorization})
+
+def get_session(client, authorization):
+    return client.post('/session', json={}, headers={'Authorization': authorization})
@@ -17,7 +17,6 @@ import urllib3
 import base64
 import shutil
 import paramiko
-from requests.auth import HTTPBasicAuth
 
 from contextlib import contextmanager
 from opentelemetry import trace
@@ -30,6 +29,7 @@ from opentelemetry.trace import Status, StatusCode
 
 from docriver_auth.auth_token import issue
 from docriver_auth.keystore import get_entries
+from docriver_client.session import get_server_token
 
 tracer = None
 
@@ -61,6 +61,8 @@ def parse_toplevel_args():
                         help='Token Server URL')
     parser.add_argument('--tokenServerSecret', default=None,
                         help='Token server secret')
+    parser.add_argument('--tokenSessionDir', default=os.path.expanduser('~/.docriver'),
+                        help='Directory where the token server session is kept between runs, so that the secret is only checked once per session. Empty to send the secret with every token request')
 
     parser.add_argument('--audience', default='docriver',
                         help='Target application')
@@ -93,15 +95,10 @@ def parse_toplevel_args():
 
 def get_token(global_args, permissions):
     if global_args.tokenServerUrl:
-        with requests.post(f"{global_args.tokenServerUrl}/token",    
-            headers={'Accept': 'application/json'}, 
-                json={'audience': global_args.audience, 'permissions': permissions}, 
-                verify=not global_args.noverify, 
-                auth=HTTPBasicAuth(global_args.subject, global_args.tokenServerSecret)) as response:
-            response.raise_for_status()
-            json_response = response.json()
-            auth = json_response['authorization']
-            payload = json_response['token']
+        json_response = get_server_token(global_args.tokenServerUrl, global_args.subject, global_args.tokenServerSecret,
+                                         global_args.audience, permissions, not global_args.noverify, global_args.tokenSessionDir)
+        auth = json_response['authorization']
+        payload = json_response['token']
     else:
         private_key, public_key, signer_cert, signer_cn, public_keys = get_entries(
             global_args.keystore, global_args.keystorePassword)
@@ -12,9 +12,9 @@ import json
 import urllib3
 from PIL import Image
 from datetime import datetime
-from requests.auth import HTTPBasicAuth
 
 from docriver_auth.keystore import get_entries
+from docriver_client.session import get_server_token
 from docriver_auth.auth_token import issue
 
 def parse_args():
@@ -47,6 +47,8 @@ def parse_args():
                         help='Token Server URL')
     parser.add_argument('--tokenServerSecret', default=None,
                         help='Token server secret')
+    parser.add_argument('--tokenSessionDir', default=os.path.expanduser('~/.docriver'),
+                        help='Directory where the token server session is kept between runs, so that the secret is only checked once per session. Empty to send the secret with every token request')
     
     parser.add_argument("--realm", help="Realm to submit document to")
 
@@ -77,15 +79,10 @@ def pretty_print(req):
 
 def get_token(args, permissions):
     if args.tokenServerUrl:
-        with requests.post(f"{args.tokenServerUrl}/token",    
-            headers={'Accept': 'application/json'}, 
-                json={'audience': args.audience, 'permissions': permissions}, 
-                verify=not args.noverify, 
-                auth=HTTPBasicAuth(args.subject, args.tokenServerSecret)) as response:
-            response.raise_for_status()
-            json_response = response.json()
-            auth = json_response['authorization']
-            payload = json_response['token']
+        json_response = get_server_token(args.tokenServerUrl, args.subject, args.tokenServerSecret,
+                                         args.audience, permissions, not args.noverify, args.tokenSessionDir)
+        auth = json_response['authorization']
+        payload = json_response['token']
     else:
         private_key, public_key, signer_cert, signer_cn, public_keys = get_entries(
             args.keystore, args.keystorePassword)
@@ -0,0 +1,81 @@
+import hashlib
+import json
+import logging
+import os
+import time
+import requests
+from requests.auth import HTTPBasicAuth
+
+# Tokens from the token server through a session: the password is sent (and checked) once per session instead of once per transaction. The session token is kept in a file (readable by the owner only) so that it is reused by the next runs of the CLI until it is about to expire
+
+# A session this close (in seconds) to its expiry is not used any more
+EXPIRY_MARGIN = 30
+
+def session_file(session_dir, token_server_url, subject):
+    name = hashlib.sha256('{}\0{}'.format(token_server_url, subject).encode('utf-8')).hexdigest()[:32]
+    return os.path.join(session_dir, 'session-{}.json'.format(name))
+
+def load_session(filename):
+    try:
+        with open(filename, 'r') as file:
+            session = json.load(file)
+        return session['session'] if session['expires'] - EXPIRY_MARGIN > time.time() else None
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def save_session(filename, session):
+    os.makedirs(os.path.dirname(filename), mode=0o700, exist_ok=True)
+    tmp = filename + '.tmp'
+    with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as file:
+        json.dump(session, file)
+    os.replace(tmp, filename)
+
+def remove_session(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+def new_session(token_server_url, subject, secret, verify):
+    # None if the token server does not issue sessions
+    with requests.post(f"{token_server_url}/session",
+            headers={'Accept': 'application/json'},
+            json={},
+            verify=verify,
+            auth=HTTPBasicAuth(subject, secret)) as response:
+        if response.status_code in (404, 405):
+            return None
+        response.raise_for_status()
+        return response.json()
+
+def request_token(token_server_url, audience, permissions, verify, auth=None, session=None):
+    headers = {'Accept': 'application/json'}
+    if session:
+        headers['Authorization'] = session
+    return requests.post(f"{token_server_url}/token",
+            headers=headers,
+            json={'audience': audience, 'permissions': permissions},
+            verify=verify,
+            auth=auth)
+
+def get_server_token(token_server_url, subject, secret, audience, permissions, verify, session_dir):
+    # Returns the token server's response ({'authorization': ..., 'token': ...}). Without a session_dir, the credentials are sent with every request
+    if session_dir:
+        filename = session_file(session_dir, token_server_url, subject)
+        session = load_session(filename)
+        if not session:
+            created = new_session(token_server_url, subject, secret, verify)
+            if created:
+                save_session(filename, created)
+                session = created['session']
+        if session:
+            with request_token(token_server_url, audience, permissions, verify, session=session) as response:
+                if response.status_code != 403:
+                    response.raise_for_status()
+                    return response.json()
+            # The session was revoked (key rotated, permissions changed, etc.): authenticate again with the credentials
+            logging.info("Session rejected by the token server, authenticating again")
+            remove_session(filename)
+    with request_token(token_server_url, audience, permissions, verify, auth=HTTPBasicAuth(subject, secret)) as response:
+        response.raise_for_status()
+        return response.json()
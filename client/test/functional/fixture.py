@@ -0,0 +1,46 @@
+import json
+import time
+import threading
+import http.server
+import pytest
+
+@pytest.fixture()
+def token_server():
+    # A stand-in for the token server. .sessions holds the sessions it accepts (clear it to revoke them), .calls counts the requests by (path, authorization method)
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            authorization = self.headers.get('Authorization', '')
+            method = authorization.split()[0].lower() if authorization else None
+            server.calls[(self.path, method)] = server.calls.get((self.path, method), 0) + 1
+            if self.path == '/session' and server.session_supported and method == 'basic':
+                session = 'Bearer session-{}'.format(len(server.sessions))
+                server.sessions.add(session)
+                self.reply(200, {'session': session, 'expires': time.time() + server.session_expiry})
+            elif self.path == '/token' and (method == 'basic' or authorization in server.sessions):
+                self.reply(200, {'authorization': 'Bearer token', 'token': {'sub': 'alice'}})
+            elif self.path == '/token':
+                self.reply(403, {'error': 'Authorizaton failed'})
+            else:
+                self.reply(404, {'error': 'Not found'})
+
+        def reply(self, status, body):
+            body = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    server.sessions = set()
+    server.calls = {}
+    server.session_supported = True
+    server.session_expiry = 900
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
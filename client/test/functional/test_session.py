@@ -0,0 +1,41 @@
+import os
+import stat
+from docriver_client.session import get_server_token, session_file
+from test.functional.fixture import token_server
+
+PERMISSIONS = {'txType': 'get-document'}
+
+def get_token(server, session_dir):
+    return get_server_token(server.url, 'alice', 'secret', 'docriver', PERMISSIONS, True, session_dir)
+
+def test_session_reused(token_server, tmp_path):
+    for i in range(3):
+        assert 'Bearer token' == get_token(token_server, str(tmp_path))['authorization']
+    assert {('/session', 'basic'): 1, ('/token', 'bearer'): 3} == token_server.calls
+    filename = session_file(str(tmp_path), token_server.url, 'alice')
+    assert 0o600 == stat.S_IMODE(os.stat(filename).st_mode)
+
+def test_session_expired(token_server, tmp_path):
+    # Sessions about to expire are replaced
+    token_server.session_expiry = 10
+    get_token(token_server, str(tmp_path))
+    get_token(token_server, str(tmp_path))
+    assert 2 == token_server.calls[('/session', 'basic')]
+
+def test_session_rejected(token_server, tmp_path):
+    get_token(token_server, str(tmp_path))
+    # Revoked, e.g. the signing key was rotated: the credentials are sent once, and a new session is created on the next call
+    token_server.sessions.clear()
+    assert 'Bearer token' == get_token(token_server, str(tmp_path))['authorization']
+    assert 1 == token_server.calls[('/token', 'basic')]
+    assert not os.path.exists(session_file(str(tmp_path), token_server.url, 'alice'))
+    get_token(token_server, str(tmp_path))
+    assert 2 == token_server.calls[('/session', 'basic')]
+    assert 1 == token_server.calls[('/token', 'basic')]
+
+def test_session_not_supported(token_server, tmp_path):
+    token_server.session_supported = False
+    get_token(token_server, str(tmp_path))
+    get_token(token_server, None)
+    assert 2 == token_server.calls[('/token', 'basic')]
+    assert ('/token', 'bearer') not in token_server.calls
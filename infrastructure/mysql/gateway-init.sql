@@ -25,8 +25,9 @@ CREATE TABLE IF NOT EXISTS TX (
     KEY(REALM)
 );
 
+-- The event tables are partitioned by month of EVENT_TIME (see "admin.py rollover", which adds the partitions ahead of time and optionally drops the old ones). MySQL does not support foreign keys on partitioned tables, so the event rows are deleted explicitly along with the rows they refer to
 CREATE TABLE IF NOT EXISTS TX_EVENT (
-    ID BIGINT UNSIGNED NOT NULL PRIMARY KEY AUTO_INCREMENT,
+    ID BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
     EVENT VARCHAR(50) NOT NULL,
     EVENT_TIME DATETIME NOT NULL DEFAULT NOW(),
     -- Ingested: I, Processing in progress: P, Processing completed: C, Processing failed: F, Transaction deleted: D, Transaction replaced: R,  etc.
@@ -36,8 +37,14 @@ CREATE TABLE IF NOT EXISTS TX_EVENT (
     TX_ID BIGINT UNSIGNED NOT NULL,
 
     CREATED_AT TIMESTAMP(6) DEFAULT CURRENT_TIMESTAMP(6),
+    -- The partitioning column has to be part of the primary key
+    PRIMARY KEY (ID, EVENT_TIME),
     KEY(EVENT_TIME),
-    FOREIGN KEY (TX_ID) REFERENCES TX(ID) ON DELETE CASCADE
+    KEY(TX_ID)
+)
+PARTITION BY RANGE (TO_DAYS(EVENT_TIME)) (
+    PARTITION p_start VALUES LESS THAN (TO_DAYS('2024-01-01')),
+    PARTITION p_future VALUES LESS THAN MAXVALUE
 );
 
 -- Although the DOC tables are loosely coupled with TX at this time (ON DELETE SET NULL), we should not really delete TX entries without also deleting DOC entries 
@@ -47,25 +54,58 @@ CREATE TABLE IF NOT EXISTS DOC (
     REALM VARCHAR(50) NOT NULL,
     DOCUMENT VARCHAR(250) NOT NULL,
 
+    -- Current state of the document, maintained in the same database transaction as the DOC_VERSION and DOC_EVENT inserts (see refresh_docs in dao/document.py). Use "admin.py backfill" to populate these columns for pre-existing data
+    VERSION_ID BIGINT UNSIGNED NULL,
+    EVENT_ID BIGINT UNSIGNED NULL,
+    STATUS CHAR(1) NULL,
+    LOCATION_URL VARCHAR(250),
+    MIME_TYPE VARCHAR(50),
+    -- Optional ("expiresAt" in the manifest). Expired documents are not served and are removed by "admin.py purge"
+    EXPIRES_AT DATETIME NULL,
+
     KEY(REALM),
+    KEY(EXPIRES_AT),
     CREATED_AT TIMESTAMP(6) DEFAULT CURRENT_TIMESTAMP(6),
     UNIQUE (REALM, DOCUMENT)
 );
 
+-- Content addressable storage. Identical content (and object metadata) within a realm is stored once. REF_COUNT is the number of DOC_VERSION rows pointing to it
+CREATE TABLE IF NOT EXISTS DOC_CONTENT (
+    ID BIGINT UNSIGNED NOT NULL PRIMARY KEY AUTO_INCREMENT,
+
+    REALM VARCHAR(50) NOT NULL,
+    -- SHA-256 of the content
+    DIGEST CHAR(64) NOT NULL,
+    -- SHA-256 of the mime type, tags and properties stored along with the object
+    METADATA_DIGEST CHAR(64) NOT NULL,
+    LOCATION_URL VARCHAR(250) NOT NULL,
+    SIZE BIGINT UNSIGNED,
+    REF_COUNT INT UNSIGNED NOT NULL DEFAULT 0,
+
+    CREATED_AT TIMESTAMP(6) DEFAULT CURRENT_TIMESTAMP(6),
+    UNIQUE (REALM, DIGEST, METADATA_DIGEST),
+    UNIQUE (LOCATION_URL)
+);
+
 CREATE TABLE IF NOT EXISTS DOC_VERSION (
     ID BIGINT UNSIGNED NOT NULL PRIMARY KEY AUTO_INCREMENT,
 
     DOC_ID BIGINT UNSIGNED NOT NULL,
     TX_ID BIGINT UNSIGNED NULL,
+    CONTENT_ID BIGINT UNSIGNED NULL,
 
     TYPE VARCHAR(25) NOT NULL,
     MIME_TYPE VARCHAR(50),
+    -- Multiple versions may share the same location (see DOC_CONTENT)
     LOCATION_URL VARCHAR(250),
+    -- Set when the object of a deleted/replaced document or of a superseded version has been reclaimed (see model/reclaimer.py)
+    RECLAIMED_AT DATETIME NULL,
 
     CREATED_AT TIMESTAMP(6) DEFAULT CURRENT_TIMESTAMP(6),
-    UNIQUE (LOCATION_URL),
+    KEY (LOCATION_URL),
     FOREIGN KEY (TX_ID) REFERENCES TX(ID) ON DELETE SET NULL,
-    FOREIGN KEY (DOC_ID) REFERENCES DOC(ID) ON DELETE CASCADE
+    FOREIGN KEY (DOC_ID) REFERENCES DOC(ID) ON DELETE CASCADE,
+    FOREIGN KEY (CONTENT_ID) REFERENCES DOC_CONTENT(ID) ON DELETE SET NULL
 );
 
 CREATE TABLE IF NOT EXISTS DOC_REF (
@@ -75,12 +115,15 @@ CREATE TABLE IF NOT EXISTS DOC_REF (
     DESCRIPTION VARCHAR(1000),
 
     DOC_VERSION_ID BIGINT UNSIGNED NOT NULL,
+    -- The transaction that added the reference
+    TX_ID BIGINT UNSIGNED NULL,
 
     CREATED_AT TIMESTAMP(6) DEFAULT CURRENT_TIMESTAMP(6),
     -- UNIQUE (DOC_VERSION_ID, RESOURCE_ID),
     KEY(RESOURCE_TYPE),
     KEY(RESOURCE_ID),
-    FOREIGN KEY (DOC_VERSION_ID) REFERENCES DOC_VERSION(ID) ON DELETE CASCADE
+    FOREIGN KEY (DOC_VERSION_ID) REFERENCES DOC_VERSION(ID) ON DELETE CASCADE,
+    FOREIGN KEY (TX_ID) REFERENCES TX(ID) ON DELETE SET NULL
 );
 
 CREATE TABLE IF NOT EXISTS DOC_REF_PROPERTY (
@@ -97,7 +140,7 @@ CREATE TABLE IF NOT EXISTS DOC_REF_PROPERTY (
 );
 
 CREATE TABLE IF NOT EXISTS DOC_EVENT (
-    ID BIGINT UNSIGNED NOT NULL PRIMARY KEY AUTO_INCREMENT,
+    ID BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
     EVENT_TIME DATETIME NOT NULL DEFAULT NOW(),
     -- Ingested: I, Referenced: J, Processing in progress: P, Processing completed: C, Processing failed: F, Document deleted: D, Document replaced: R, New version: V, etc.
     STATUS CHAR(1) NOT NULL,
@@ -107,12 +150,19 @@ CREATE TABLE IF NOT EXISTS DOC_EVENT (
     REF_TX_ID BIGINT UNSIGNED NULL,
 
     DOC_ID BIGINT UNSIGNED NOT NULL,
+    -- The version the event refers to: the new version for I/V, otherwise the current version at the time of the event. Use "admin.py backfill" to populate it for pre-existing data
+    DOC_VERSION_ID BIGINT UNSIGNED NULL,
 
     CREATED_AT TIMESTAMP(6) DEFAULT CURRENT_TIMESTAMP(6),
-    KEY(EVENT_TIME),
-    FOREIGN KEY (DOC_ID) REFERENCES DOC(ID) ON DELETE CASCADE,
-    FOREIGN KEY (REF_DOC_ID) REFERENCES DOC(ID) ON DELETE SET NULL,
-    FOREIGN KEY (REF_TX_ID) REFERENCES TX(ID) ON DELETE SET NULL
+    PRIMARY KEY (ID, EVENT_TIME),
+    -- Keyset pagination of the event feed (see get_events in dao/tx.py)
+    KEY(EVENT_TIME, ID),
+    KEY(DOC_ID),
+    KEY(REF_TX_ID)
+)
+PARTITION BY RANGE (TO_DAYS(EVENT_TIME)) (
+    PARTITION p_start VALUES LESS THAN (TO_DAYS('2024-01-01')),
+    PARTITION p_future VALUES LESS THAN MAXVALUE
 );
 
 
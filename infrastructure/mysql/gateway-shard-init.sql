@@ -0,0 +1,4 @@
+-- A second metadata schema on the same server, used as the target shard by the realm move tests (see server/test/functional/test_realm_mover.py). The tests create its tables like those of the docriver schema
+CREATE DATABASE IF NOT EXISTS docriver_shard;
+GRANT ALL ON docriver_shard.* TO 'docriver'@'%';
+FLUSH PRIVILEGES;
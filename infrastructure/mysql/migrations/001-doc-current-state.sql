@@ -0,0 +1,65 @@
+-- Upgrades a database created with an earlier gateway-init.sql to the current columns and keys. Run it once, with the gateways stopped, before starting the new version:
+--   mysql -u docriver -p < $DOCRIVER_GW_HOME/infrastructure/mysql/migrations/001-doc-current-state.sql
+-- The migrations are not in the parent directory because the MySQL container runs every script found there when it initializes a new database, which is created with the current schema already
+USE docriver;
+
+-- Content addressable storage (see gateway-init.sql)
+CREATE TABLE IF NOT EXISTS DOC_CONTENT (
+    ID BIGINT UNSIGNED NOT NULL PRIMARY KEY AUTO_INCREMENT,
+
+    REALM VARCHAR(50) NOT NULL,
+    DIGEST CHAR(64) NOT NULL,
+    METADATA_DIGEST CHAR(64) NOT NULL,
+    LOCATION_URL VARCHAR(250) NOT NULL,
+    SIZE BIGINT UNSIGNED,
+    REF_COUNT INT UNSIGNED NOT NULL DEFAULT 0,
+
+    CREATED_AT TIMESTAMP(6) DEFAULT CURRENT_TIMESTAMP(6),
+    UNIQUE (REALM, DIGEST, METADATA_DIGEST),
+    UNIQUE (LOCATION_URL)
+);
+
+-- Current state and expiry of the documents
+ALTER TABLE DOC
+    ADD COLUMN VERSION_ID BIGINT UNSIGNED NULL AFTER DOCUMENT,
+    ADD COLUMN EVENT_ID BIGINT UNSIGNED NULL AFTER VERSION_ID,
+    ADD COLUMN STATUS CHAR(1) NULL AFTER EVENT_ID,
+    ADD COLUMN LOCATION_URL VARCHAR(250) AFTER STATUS,
+    ADD COLUMN MIME_TYPE VARCHAR(50) AFTER LOCATION_URL,
+    ADD COLUMN EXPIRES_AT DATETIME NULL AFTER MIME_TYPE,
+    ADD KEY (EXPIRES_AT);
+
+-- Versions share the location of identical content, and keep their row after the object is reclaimed
+ALTER TABLE DOC_VERSION
+    ADD COLUMN CONTENT_ID BIGINT UNSIGNED NULL AFTER TX_ID,
+    ADD COLUMN RECLAIMED_AT DATETIME NULL AFTER LOCATION_URL,
+    DROP INDEX LOCATION_URL,
+    ADD KEY (LOCATION_URL),
+    ADD FOREIGN KEY (CONTENT_ID) REFERENCES DOC_CONTENT(ID) ON DELETE SET NULL;
+
+-- The transaction that added the reference
+ALTER TABLE DOC_REF
+    ADD COLUMN TX_ID BIGINT UNSIGNED NULL AFTER DOC_VERSION_ID,
+    ADD FOREIGN KEY (TX_ID) REFERENCES TX(ID) ON DELETE SET NULL;
+
+-- The version an event refers to, and the key of the keyset pagination of the event feed
+ALTER TABLE DOC_EVENT
+    ADD COLUMN DOC_VERSION_ID BIGINT UNSIGNED NULL AFTER DOC_ID,
+    DROP INDEX EVENT_TIME,
+    ADD KEY (EVENT_TIME, ID);
+
+-- Backfill the new columns of the existing documents in one database transaction per statement (the same as refresh_docs and attribute_doc_events in dao/document.py). On a large database, stop here and run "admin.py backfill" instead: it does the same in batches of document IDs, committing each batch
+UPDATE DOC d
+    JOIN (SELECT DOC_ID, MAX(ID) AS ID FROM DOC_VERSION GROUP BY DOC_ID) lv ON lv.DOC_ID = d.ID
+    JOIN DOC_VERSION v ON v.ID = lv.ID
+    JOIN (SELECT DOC_ID, MAX(ID) AS ID FROM DOC_EVENT GROUP BY DOC_ID) le ON le.DOC_ID = d.ID
+    JOIN DOC_EVENT e ON e.ID = le.ID
+SET d.VERSION_ID = v.ID,
+    d.LOCATION_URL = v.LOCATION_URL,
+    d.MIME_TYPE = v.MIME_TYPE,
+    d.EVENT_ID = e.ID,
+    d.STATUS = e.STATUS;
+
+UPDATE DOC_EVENT e
+SET e.DOC_VERSION_ID = (SELECT MAX(v.ID) FROM DOC_VERSION v WHERE v.DOC_ID = e.DOC_ID AND v.CREATED_AT <= e.CREATED_AT)
+WHERE e.DOC_VERSION_ID IS NULL;
@@ -0,0 +1,27 @@
+-- Partitions the event tables of a database created with an earlier gateway-init.sql by month of EVENT_TIME (see "admin.py rollover"). Run it once, after 001-doc-current-state.sql and with the gateways stopped:
+--   mysql -u docriver -p < $DOCRIVER_GW_HOME/infrastructure/mysql/migrations/002-partition-events.sql
+-- Each ALTER TABLE copies the table. The existing events land in p_future; the first "admin.py rollover" moves them into the monthly partitions, which copies them again
+USE docriver;
+
+-- MySQL does not support foreign keys on partitioned tables. These are the names MySQL gives to the unnamed foreign keys of the earlier gateway-init.sql (check with SHOW CREATE TABLE if the tables were created otherwise). The indexes created for the foreign keys are kept
+ALTER TABLE TX_EVENT DROP FOREIGN KEY TX_EVENT_ibfk_1;
+ALTER TABLE DOC_EVENT
+    DROP FOREIGN KEY DOC_EVENT_ibfk_1,
+    DROP FOREIGN KEY DOC_EVENT_ibfk_2,
+    DROP FOREIGN KEY DOC_EVENT_ibfk_3;
+
+-- The partitioning column has to be part of the primary key
+ALTER TABLE TX_EVENT DROP PRIMARY KEY, ADD PRIMARY KEY (ID, EVENT_TIME);
+ALTER TABLE DOC_EVENT DROP PRIMARY KEY, ADD PRIMARY KEY (ID, EVENT_TIME);
+
+ALTER TABLE TX_EVENT
+PARTITION BY RANGE (TO_DAYS(EVENT_TIME)) (
+    PARTITION p_start VALUES LESS THAN (TO_DAYS('2024-01-01')),
+    PARTITION p_future VALUES LESS THAN MAXVALUE
+);
+
+ALTER TABLE DOC_EVENT
+PARTITION BY RANGE (TO_DAYS(EVENT_TIME)) (
+    PARTITION p_start VALUES LESS THAN (TO_DAYS('2024-01-01')),
+    PARTITION p_future VALUES LESS THAN MAXVALUE
+);
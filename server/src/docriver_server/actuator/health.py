@@ -1,12 +1,25 @@
+from db_router import DbRouter
+from shard_router import ShardRouter
+
 def get_health(bucket, connection_pool, minio, scanner):
+    shards = connection_pool.pools if isinstance(connection_pool, ShardRouter) else {}
+    shards_healthy = {name: shard_healthcheck(pool) for name, pool in shards.items()}
     db_healthy = db_healthcheck(connection_pool)
     minio_healthy = minio.bucket_exists(bucket)
     scanner_healthy = scanner.ping() == "PONG"
     healthy_overall = db_healthy and minio_healthy and scanner_healthy
-    return {'system': health_status(healthy_overall), 
+    health = {'system': health_status(healthy_overall), 
             'db': health_status(db_healthy), 
             'minio': health_status(minio_healthy), 
             'scanner': health_status(scanner_healthy)}
+    if shards:
+        health['dbShards'] = {name: health_status(healthy) for name, healthy in shards_healthy.items()}
+    default_pool = connection_pool.default_pool if isinstance(connection_pool, ShardRouter) else connection_pool
+    replica_healthy = default_pool.replica_status() if isinstance(default_pool, DbRouter) else None
+    if replica_healthy is not None:
+        # Informational: the reads fall back to the primary when the replica is down or lagging
+        health['dbReplica'] = health_status(replica_healthy)
+    return health
 
 def db_healthcheck(connection_pool):
     connection = connection_pool.get_connection()
@@ -21,5 +34,12 @@ def db_healthcheck(connection_pool):
         cursor.close()
         connection.close()
 
+def shard_healthcheck(connection_pool):
+    # Informational: an unreachable shard makes the realms that live in it unavailable, not the gateway
+    try:
+        return db_healthcheck(connection_pool)
+    except Exception:
+        return False
+
 def health_status(up):
     return "UP" if up else "DOWN"
\ No newline at end of file
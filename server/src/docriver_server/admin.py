@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+import argparse
+import logging
+import sys
+
+import mysql.connector
+from minio import Minio
+
+from dao.document import refresh_docs, attribute_doc_events, get_doc_id_range
+from model.retention import rollover_partitions, purge_expired
+from model.realm_mover import move_realm
+from shard_router import DEFAULT_SHARD, load_shard_map
+from job_util import RateLimiter, run_periodically
+
+def connect(args):
+    return mysql.connector.connect(user=args.dbUser, password=args.dbPassword,
+            host=args.dbHost,
+            port=args.dbPort,
+            database=args.dbDatabase)
+
+def backfill(args):
+    # Populate the current state columns of DOC and the version of each DOC_EVENT for data that was written before the columns existed. Each batch is committed separately so that the locks are held briefly
+    connection = connect(args)
+    cursor = connection.cursor()
+    try:
+        min_id, max_id = get_doc_id_range(cursor)
+        if min_id is None:
+            logging.info("No documents found")
+            return
+        updated = 0
+        for start in range(min_id, max_id + 1, args.batchSize):
+            end = min(start + args.batchSize - 1, max_id)
+            updated = updated + refresh_docs(cursor, min_id=start, max_id=end)
+            attribute_doc_events(cursor, start, end)
+            connection.commit()
+            logging.info("Backfilled documents {} - {}".format(start, end))
+        logging.info("Backfill complete. Documents updated: {}".format(updated))
+    except Exception as e:
+        connection.rollback()
+        raise e
+    finally:
+        cursor.close()
+        connection.close()
+
+def rollover(args):
+    # Meant to be run regularly (for example daily from cron); adding partitions that exist already is a no-op
+    connection = connect(args)
+    try:
+        rollover_partitions(connection, args.monthsAhead, args.retainMonths)
+    finally:
+        connection.close()
+
+def purge(args):
+    connection = connect(args)
+    # TODO fix the secure=False
+    minio = Minio(args.objUrl, secure=False, access_key=args.objAccessKey, secret_key=args.objSecretKey)
+    limiter = RateLimiter(args.rate)
+    try:
+        def run():
+            docs, objects = purge_expired(connection, minio, args.batchSize, limiter)
+            logging.info("Purge complete. Documents: {}, objects: {}".format(docs, objects))
+        run_periodically(run, args.interval)
+    finally:
+        connection.close()
+
+def move(args):
+    shards = load_shard_map(args.shardMap).get('shards', {})
+    def connect_shard(shard):
+        if shard == DEFAULT_SHARD:
+            return connect(args)
+        config = shards[shard]
+        return mysql.connector.connect(user=config.get('user', args.dbUser), password=config.get('password', args.dbPassword),
+            host=config['host'],
+            port=config.get('port', args.dbPort),
+            database=config.get('database', args.dbDatabase))
+    copied = move_realm(args.shardMap, args.realm, args.to, connect_shard, args.wait, args.batchSize)
+    logging.info("Move complete. Rows: {}".format(copied))
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description="Docriver administration tasks")
+    parser.add_argument("--dbHost", help="Database host name", default='127.0.0.1')
+    parser.add_argument("--dbPort", type=int, help="Database port number", default=3306)
+    parser.add_argument("--dbUser", help="Database user name", default='docriver')
+    parser.add_argument("--dbPassword", help="Database password", default='docriver')
+    parser.add_argument("--dbDatabase", help="Database name", default='docriver')
+    parser.add_argument("--log", help="log level (valid values are INFO, WARNING, ERROR, NONE", default='INFO')
+    parser.add_argument("--objUrl", help="URL of the object store", default='localhost:9000')
+    parser.add_argument("--objAccessKey", help="Access key of the object store", default='docriver-key')
+    parser.add_argument("--objSecretKey", help="Secret key for the object store", default='docriver-secret')
+
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    backfill_parser = commands.add_parser('backfill', help="Populate the current version/status/location columns of DOC from DOC_VERSION and DOC_EVENT, and the version referred to by DOC_EVENT")
+    backfill_parser.add_argument("--batchSize", type=int, help="Number of document IDs processed per database transaction", default=1000)
+    backfill_parser.set_defaults(func=backfill)
+
+    rollover_parser = commands.add_parser('rollover', help="Add the monthly partitions of the event tables ahead of time and optionally drop the old ones")
+    rollover_parser.add_argument("--monthsAhead", type=int, help="Number of months ahead of the current one to create partitions for", default=3)
+    rollover_parser.add_argument("--retainMonths", type=int, help="Drop the event partitions older than this many months. The event history is lost; the current state of the documents is kept. 0 keeps everything", default=0)
+    rollover_parser.set_defaults(func=rollover)
+
+    purge_parser = commands.add_parser('purge', help="Remove the expired documents from the database and the object store")
+    purge_parser.add_argument("--batchSize", type=int, help="Number of documents removed per database transaction", default=100)
+    purge_parser.add_argument("--rate", type=float, help="Maximum number of documents removed per second, so that the purge does not compete with ingest. 0 removes the limit", default=50)
+    purge_parser.add_argument("--interval", type=int, help="Run the purge every so many seconds. 0 runs it once", default=0)
+    purge_parser.set_defaults(func=purge)
+
+    move_parser = commands.add_parser('move-realm', help="Move the metadata of a realm to another shard while the gateways keep running. The realm is read-only (writes get 503) during the copy. The change feed cursors of the realm are invalidated. The database options are those of the default shard")
+    move_parser.add_argument("--shardMap", help="Shard map file of the gateways (--dbShardMap). It is updated by the move", required=True)
+    move_parser.add_argument("--realm", help="Realm to move", required=True)
+    move_parser.add_argument("--to", help="Target shard, as named in the shard map ('default' for the default database)", required=True)
+    move_parser.add_argument("--wait", type=int, help="Seconds to wait for the gateways to pick up a change of the shard map: their --dbShardReloadInterval plus the longest write transaction", default=30)
+    move_parser.add_argument("--batchSize", type=int, help="Number of rows copied or deleted per database transaction", default=1000)
+    move_parser.set_defaults(func=move)
+
+    return parser.parse_args(args)
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    logging.basicConfig(level=args.log)
+    args.func(args)
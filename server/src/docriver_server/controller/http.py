@@ -1,32 +1,94 @@
-from flask import Flask, Blueprint, jsonify, request, send_from_directory
+from flask import Flask, Blueprint, Response, jsonify, request, send_from_directory
 from flask_cors import CORS
 from flask_accept import accept
+from mysql.connector.errors import PoolError
 import logging
 import os
 import time
 
-from exceptions import ValidationException, DocumentException
+from exceptions import ValidationException, DocumentException, UnavailableException
 from docriver_auth.exceptions import AuthorizationException
 from model.tx_submit_service import submit_docs_tx
 from model.tx_delete_service import delete_docs_tx
-from model.tx_get_service import get_events
+from model.tx_get_service import get_events, get_tx
+from model.feed_service import get_feed, stream_feed
 from actuator.health import get_health
 from controller.html_utils import to_html
 from model.document_service import stream_document
 from trace_util import new_span
+from db_router import DbRouter, read_pool, primary_read
+from shard_router import realm_pool
+from werkzeug.http import dump_cookie
 
 gw = Blueprint('docriver-http', __name__)
 
+MAX_WAIT_SECONDS = 60
+
+# Time of the client's last write, for read-your-writes when the reads are routed to a replica (possibly by another gateway instance)
+WRITTEN_AT_COOKIE = 'drWrittenAt'
+
+def client_written_at():
+    written_at = request.cookies.get(WRITTEN_AT_COOKIE)
+    try:
+        return float(written_at) if written_at else None
+    except ValueError:
+        return None
+
+def reader(realm):
+    return read_pool(realm_pool(connection_pool, realm), realm, client_written_at())
+
+def writer(realm):
+    # Fails with 503 while the realm is moved to another shard
+    return realm_pool(connection_pool, realm, write=True)
+
+def set_written_at(headers, pool):
+    if isinstance(pool, DbRouter) and pool.replica:
+        headers['Set-Cookie'] = dump_cookie(WRITTEN_AT_COOKIE, str(time.time()), max_age=pool.consistency_window(), httponly=True, samesite='Lax')
+    return headers
+
+def wait_timeout():
+    # Seconds to wait for the long-polls ("timeout"), capped at MAX_WAIT_SECONDS
+    try:
+        timeout = int(request.args.get('timeout', 0))
+    except ValueError:
+        raise ValidationException('timeout must be a number of seconds')
+    if timeout < 0:
+        raise ValidationException('timeout must be a number of seconds')
+    return min(timeout, MAX_WAIT_SECONDS)
+
+def page_limit():
+    # Number of events per page ("limit"); None when not paginated. The range is checked by get_events
+    if 'limit' not in request.args:
+        return None
+    try:
+        return int(request.args.get('limit'))
+    except ValueError:
+        raise ValidationException('limit must be a number')
+
+def respond_async_requested():
+    # Opt-in with either "?async=true" or the RFC 7240 "Prefer: respond-async" header
+    return request.args.get('async', default='false').lower() == 'true' \
+        or 'respond-async' in request.headers.get('Prefer', default='')
+
 @gw.route('/tx/<realm>', methods=['POST'])
 def process_submit_tx(realm):
     with new_span("submit_tx") as span:
-        result = submit_docs_tx(untrusted_fs_mount, raw_fs_mount, scanner_fs_mount, bucket, connection_pool, minio, scanner, auth_public_keys, auth_audience, realm, request)
+        pool = writer(realm)
+        result = submit_docs_tx(untrusted_fs_mount, raw_fs_mount, scanner_fs_mount, bucket, pool, minio, scanner, auth_public_keys, auth_audience, realm, request, streaming_ingest, uploader, respond_async_requested(), tx_processor)
+        status = 200
+        headers = set_written_at({}, pool)
+        if result['dr:status'] == 'accepted':
+            status = 202
+            headers['Location'] = '/tx/{}/{}'.format(realm, result['tx'])
+            headers['Preference-Applied'] = 'respond-async'
         if request.headers.get('Accept', default='text/html') == 'application/json':
-            return jsonify(result), {'Content-Type': 'application/json'}
+            headers['Content-Type'] = 'application/json'
+            return jsonify(result), status, headers
         else:
             # TODO use a jinja template
             # return '<pre>{}</pre>'.format(pprint.pformat(result)), 'text/html'
-            return to_html(result, indent=1), 200, {'Content-Type': 'text/html'}
+            headers['Content-Type'] = 'text/html'
+            return to_html(result, indent=1), status, headers
 
 @gw.route('/tx/<realm>', methods=['DELETE'])
 @accept('application/json')
@@ -34,23 +96,71 @@ def process_delete_tx(realm):
     with new_span("delete_tx") as span:
         payload = request.json
         token = payload['authorization'] if 'authorization' in payload else request.headers.get('Authorization')
-        result = delete_docs_tx(token, realm, payload, connection_pool, auth_public_keys, auth_audience)
-        return jsonify(result), {'Content-Type': 'application/json'}
+        pool = writer(realm)
+        result = delete_docs_tx(token, realm, payload, pool, auth_public_keys, auth_audience)
+        return jsonify(result), set_written_at({'Content-Type': 'application/json'}, pool)
 
-@gw.route('/tx/<realm>', methods=['GET'])
-@accept('application/json')
-def process_get_tx_events(realm):
+def get_tx_events(realm, ndjson):
     with new_span("get_tx_events") as span:
         end = int(request.args.get('to', time.time()))
         start = int(request.args.get('from')) if 'from' in request.args else end - 24*60*60
+        # Pagination: "limit" events per page, starting after the "after" cursor
+        limit = page_limit()
         token = request.args.get('authorization') if 'authorization' in request.args else request.headers.get('Authorization')
-        return get_events(realm, start, end, connection_pool, token, auth_public_keys, auth_audience)
+        events = get_events(realm, start, end, reader(realm), token, auth_public_keys, auth_audience, request.args.get('after'), limit, ndjson)
+        return Response(events, 200, mimetype='application/x-ndjson' if ndjson else 'application/json')
+
+@gw.route('/tx/<realm>', methods=['GET'])
+@accept('application/json')
+def process_get_tx_events(realm):
+    return get_tx_events(realm, False)
+
+@process_get_tx_events.support('application/x-ndjson')
+def process_get_tx_events_ndjson(realm):
+    return get_tx_events(realm, True)
+
+@gw.route('/tx/<realm>/<tx>', methods=['GET'])
+@accept('application/json')
+def process_get_tx(realm, tx):
+    with new_span("get_tx") as span:
+        token = request.args.get('authorization') if 'authorization' in request.args else request.headers.get('Authorization')
+        # Long-poll: with "waitFor" (comma separated statuses) and/or If-None-Match, wait up to "timeout" seconds for the transaction to change
+        wait_for = request.args.get('waitFor').split(',') if 'waitFor' in request.args else None
+        timeout = wait_timeout()
+        etag, result = get_tx(realm, tx, reader(realm), token, auth_public_keys, auth_audience, request.if_none_match, wait_for, timeout)
+        headers = {'ETag': '"{}"'.format(etag), 'Cache-Control': 'no-cache'}
+        if not result:
+            return '', 304, headers
+        headers['Content-Type'] = 'application/json'
+        return jsonify(result), 200, headers
+
+@gw.route('/feed/<realm>', methods=['GET'])
+@accept('application/json')
+def process_get_feed(realm):
+    # Long-poll fallback of the change feed: waits up to "timeout" seconds for events after the "after" cursor
+    with new_span("get_feed") as span:
+        token = request.args.get('authorization') if 'authorization' in request.args else request.headers.get('Authorization')
+        timeout = wait_timeout()
+        result = get_feed(realm, realm_pool(connection_pool, realm), token, auth_public_keys, auth_audience, request.args.get('after'), timeout)
+        return jsonify(result), 200, {'Content-Type': 'application/json', 'Cache-Control': 'no-cache'}
+
+@process_get_feed.support('text/event-stream')
+def process_stream_feed(realm):
+    with new_span("stream_feed") as span:
+        token = request.args.get('authorization') if 'authorization' in request.args else request.headers.get('Authorization')
+        # EventSource reconnections resume from the id of the last message received
+        cursor = request.headers.get('Last-Event-ID', default=request.args.get('after'))
+        events = stream_feed(realm, realm_pool(connection_pool, realm), token, auth_public_keys, auth_audience, cursor)
+        # X-Accel-Buffering: nginx must pass the messages on as they are written
+        return Response(events, 200, {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}, mimetype='text/event-stream')
 
 @gw.route('/document/<realm>/<path:document>', methods=['GET'])
 def process_document_get(realm, document):
     with new_span("document_get", attributes={'realm': realm, 'document': document} ) as span:
         token = request.args.get('authorization') if request.args.get('authorization') else request.headers.get('Authorization')
-        return stream_document(connection_pool, minio, bucket, realm, document, auth_public_keys, auth_audience, token)
+        pool = realm_pool(connection_pool, realm)
+        read = read_pool(pool, realm, client_written_at())
+        return stream_document(read, minio, bucket, realm, document, auth_public_keys, auth_audience, token, request, delivery, primary_read(pool, read))
 
 @gw.route('/favicon.ico')
 def favicon():
@@ -85,6 +195,16 @@ def handle_document_error(e):
 def handle_authorization_error(e):
     return str(e), 401
 
+@gw.errorhandler(UnavailableException)
+def handle_unavailable_error(e):
+    return str(e), 503, {'Retry-After': '10'}
+
+@gw.errorhandler(PoolError)
+def handle_pool_error(e):
+    # All the database connections are busy and the wait queue is full (or the wait timed out)
+    logging.warning(e)
+    return str(e), 503, {'Retry-After': '1'}
+
 @gw.errorhandler(Exception)
 def handle_internal_error(e):
     logging.error(e, exc_info=True)
@@ -96,7 +216,7 @@ def init_app():
     app.register_blueprint(gw)
     return app
 
-def init_params(_connection_pool, _minio, _scanner, _bucket, _untrusted_fs_mount, _raw_fs_mount, _scanner_fs_mount, _auth_private_key, _auth_public_key, _auth_signer_cert, _auth_signer_cn, _auth_public_keys, _auth_audience):
+def init_params(_connection_pool, _minio, _scanner, _bucket, _untrusted_fs_mount, _raw_fs_mount, _scanner_fs_mount, _auth_private_key, _auth_public_key, _auth_signer_cert, _auth_signer_cn, _auth_public_keys, _auth_audience, _streaming_ingest=False, _uploader=None, _tx_processor=None, _delivery=None):
     # TODO this is getting ugly fast. Fixit
     global minio
     global connection_pool
@@ -111,6 +231,10 @@ def init_params(_connection_pool, _minio, _scanner, _bucket, _untrusted_fs_mount
     global auth_signer_cn
     global auth_public_keys
     global auth_audience
+    global streaming_ingest
+    global uploader
+    global tx_processor
+    global delivery
     
     minio = _minio
     connection_pool = _connection_pool
@@ -124,4 +248,8 @@ def init_params(_connection_pool, _minio, _scanner, _bucket, _untrusted_fs_mount
     auth_signer_cert = _auth_signer_cert
     auth_signer_cn = _auth_signer_cn
     auth_public_keys = _auth_public_keys
-    auth_audience = _auth_audience
\ No newline at end of file
+    auth_audience = _auth_audience
+    streaming_ingest = _streaming_ingest
+    uploader = _uploader
+    tx_processor = _tx_processor
+    delivery = _delivery
\ No newline at end of file
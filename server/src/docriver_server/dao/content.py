@@ -0,0 +1,48 @@
+def acquire_contents(cursor, realm, contents):
+    # contents is a list of (digest, metadata_digest, location_url, size). Registers one more reference for each entry. When the content is already known in the realm, the existing object is shared instead of the new location. Returns a dictionary of (digest, metadata_digest) -> (content_id, location_url)
+    cursor.executemany(("""
+                    INSERT INTO DOC_CONTENT (REALM, DIGEST, METADATA_DIGEST, LOCATION_URL, SIZE, REF_COUNT)
+                    VALUES(%s, %s, %s, %s, %s, 1)
+                    ON DUPLICATE KEY UPDATE REF_COUNT = REF_COUNT + 1
+                    """),
+                    [(realm, digest, metadata_digest, location_url, size) for digest, metadata_digest, location_url, size in contents])
+    keys = list(set([(digest, metadata_digest) for digest, metadata_digest, location_url, size in contents]))
+    cursor.execute("""
+                   SELECT ID, DIGEST, METADATA_DIGEST, LOCATION_URL FROM DOC_CONTENT
+                   WHERE REALM = %s AND (DIGEST, METADATA_DIGEST) IN ({})
+                   """.format(', '.join(['(%s, %s)'] * len(keys))),
+                   [realm] + [value for key in keys for value in key])
+    return {(row[1], row[2]): (row[0], row[3]) for row in cursor.fetchall()}
+
+def release_content(cursor, content_id):
+    # Drops one reference to the content and returns the remaining reference count along with the location of the object
+    cursor.execute("SELECT REF_COUNT, LOCATION_URL FROM DOC_CONTENT WHERE ID = %s FOR UPDATE", (content_id,))
+    row = cursor.fetchone()
+    if not row:
+        return 0, None
+    ref_count = max(row[0] - 1, 0)
+    cursor.execute("UPDATE DOC_CONTENT SET REF_COUNT = %s WHERE ID = %s", (ref_count, content_id))
+    return ref_count, row[1]
+
+def release_contents(cursor, content_ids):
+    # Drops one reference per occurrence of the content IDs in the list. The contents that are no longer referenced are deleted; their (location, size) are returned so that the objects can be removed once the transaction commits
+    counts = {}
+    for content_id in content_ids:
+        counts[content_id] = counts.get(content_id, 0) + 1
+    if not counts:
+        return []
+    cursor.executemany("UPDATE DOC_CONTENT SET REF_COUNT = GREATEST(CAST(REF_COUNT AS SIGNED) - %s, 0) WHERE ID = %s", 
+                       [(count, content_id) for content_id, count in counts.items()])
+    ids = list(counts.keys())
+    cursor.execute("SELECT ID, LOCATION_URL, SIZE FROM DOC_CONTENT WHERE REF_COUNT = 0 AND ID IN ({})".format(', '.join(['%s'] * len(ids))), ids)
+    released = cursor.fetchall()
+    if released:
+        cursor.execute("DELETE FROM DOC_CONTENT WHERE ID IN ({})".format(', '.join(['%s'] * len(released))), [row[0] for row in released])
+    return [(row[1], row[2]) for row in released]
+
+def get_content_locations(cursor, locations):
+    # The locations (of the given ones) that are registered as content
+    if not locations:
+        return set()
+    cursor.execute("SELECT LOCATION_URL FROM DOC_CONTENT WHERE LOCATION_URL IN ({})".format(', '.join(['%s'] * len(locations))), locations)
+    return set([row[0] for row in cursor.fetchall()])
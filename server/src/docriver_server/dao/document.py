@@ -1,87 +1,203 @@
-def create_references(cursor, references, version_id):
-    for reference in references:
-        cursor.execute(("""
+def in_clause(values):
+    return ', '.join(['%s'] * len(values))
+
+def create_references(cursor, tx_id, references):
+    # references is a list of (version_id, reference)
+    if not references:
+        return
+    cursor.executemany(("""
             INSERT INTO DOC_REF 
-                (RESOURCE_TYPE, RESOURCE_ID, DESCRIPTION, DOC_VERSION_ID) 
-            VALUES(%s, %s, %s, %s) 
+                (RESOURCE_TYPE, RESOURCE_ID, DESCRIPTION, DOC_VERSION_ID, TX_ID) 
+            VALUES(%s, %s, %s, %s, %s) 
             """), 
-            (reference['resourceType'], 
+            [(reference['resourceType'], 
             reference ['resourceId'],
             reference['description'] if 'description' in reference else None, 
-            version_id))
-        ref_id = cursor.lastrowid
-        if 'properties' in reference:
-            for k,v in reference['properties'].items():
-                cursor.execute( ("""
-                        INSERT INTO DOC_REF_PROPERTY 
-                            (REF_ID, KEY_NAME, VALUE) 
-                        VALUES(%s, %s, %s)
-                        """), 
-                        (ref_id, k, v))
-    return ref_id
-
-def create_doc(cursor, document, realm):
-    cursor.execute(("""
+            version_id, tx_id) for version_id, reference in references])
+
+    properties = []
+    if any(['properties' in reference for version_id, reference in references]):
+        # The IDs of a multi-row insert are allocated in the order of the rows
+        cursor.execute("SELECT ID FROM DOC_REF WHERE TX_ID = %s ORDER BY ID", (tx_id,))
+        ref_ids = [row[0] for row in cursor.fetchall()]
+        for ref_id, (version_id, reference) in zip(ref_ids, references):
+            if 'properties' in reference:
+                properties.extend([(ref_id, k, v) for k,v in reference['properties'].items()])
+
+    if properties:
+        cursor.executemany( ("""
+                INSERT INTO DOC_REF_PROPERTY 
+                    (REF_ID, KEY_NAME, VALUE) 
+                VALUES(%s, %s, %s)
+                """), 
+                properties)
+
+def create_docs(cursor, realm, names):
+    # Returns a dictionary of document name -> ID
+    cursor.executemany(("""
                     INSERT INTO DOC (DOCUMENT, REALM) 
                     VALUES (%s, %s)
                     """), 
-                    (document['document'], realm))
-    return cursor.lastrowid
+                    [(name, realm) for name in names])
+    cursor.execute("SELECT DOCUMENT, ID FROM DOC WHERE REALM = %s AND DOCUMENT IN ({})".format(in_clause(names)), 
+                   [realm] + names)
+    return {row[0]: row[1] for row in cursor.fetchall()}
 
-def create_doc_version(bucket, cursor, tx_id, doc_id, doc_key, document):
-    cursor.execute(("""
-                    INSERT INTO DOC_VERSION (DOC_ID, TX_ID, LOCATION_URL, TYPE, MIME_TYPE)
-                    VALUES(%s, %s, %s, %s, %s)
+def create_doc_versions(cursor, tx_id, versions):
+    # versions is a list of (doc_id, location_url, document, content_id). Returns the version IDs in the same order
+    cursor.executemany(("""
+                    INSERT INTO DOC_VERSION (DOC_ID, TX_ID, LOCATION_URL, TYPE, MIME_TYPE, CONTENT_ID)
+                    VALUES(%s, %s, %s, %s, %s, %s)
                     """), 
-                    (doc_id, tx_id, "s3://{}/{}".format(bucket, doc_key),  
+                    [(doc_id, tx_id, location_url,  
                     document['type'], 
-                    document['content']['mimeType']))
-    return cursor.lastrowid
+                    document['content']['mimeType'],
+                    content_id) for doc_id, location_url, document, content_id in versions])
+    # The IDs of a multi-row insert are allocated in the order of the rows
+    cursor.execute("SELECT ID FROM DOC_VERSION WHERE TX_ID = %s ORDER BY ID", (tx_id,))
+    return [row[0] for row in cursor.fetchall()]
 
-def create_doc_event(cursor, tx_id, doc_id, replaces_doc_id, event_description, status):
-    cursor.execute(("""
-                    INSERT INTO DOC_EVENT (DESCRIPTION, STATUS, DOC_ID, REF_DOC_ID, REF_TX_ID) 
-                    VALUES(%s, %s, %s, %s, %s) 
+def create_doc_events(cursor, events):
+    # events is a list of (event_description, status, doc_id, ref_doc_id, tx_id, doc_version_id). doc_version_id is the version the event refers to
+    if not events:
+        return
+    cursor.executemany(("""
+                    INSERT INTO DOC_EVENT (DESCRIPTION, STATUS, DOC_ID, REF_DOC_ID, REF_TX_ID, DOC_VERSION_ID) 
+                    VALUES(%s, %s, %s, %s, %s, %s) 
                     """), 
-                    (event_description, status, doc_id, replaces_doc_id, tx_id))
-    return cursor.lastrowid
-    
-def get_doc_by_name(cursor, realm, name):
+                    events)
+
+def attribute_doc_events(cursor, min_id, max_id):
+    # Backfill DOC_EVENT.DOC_VERSION_ID for the events of a DOC ID range that were written before the column existed: the latest version of the document at the time of the event
+    cursor.execute("""
+        UPDATE DOC_EVENT e
+        SET e.DOC_VERSION_ID = (SELECT MAX(v.ID) FROM DOC_VERSION v WHERE v.DOC_ID = e.DOC_ID AND v.CREATED_AT <= e.CREATED_AT)
+        WHERE e.DOC_VERSION_ID IS NULL
+            AND e.DOC_ID BETWEEN %s AND %s
+        """, (min_id, max_id))
+    return cursor.rowcount
+
+def refresh_docs(cursor, doc_ids=None, min_id=None, max_id=None):
+    # Recompute the current state columns of DOC (latest version and latest event) from DOC_VERSION and DOC_EVENT. Called with the documents touched by a transaction before it commits, or with an ID range to backfill
+    if doc_ids is not None:
+        doc_ids = list(set(doc_ids))
+        if not doc_ids:
+            return 0
+        condition = "DOC_ID IN ({})".format(in_clause(doc_ids))
+        params = doc_ids
+    else:
+        condition = "DOC_ID BETWEEN %s AND %s"
+        params = [min_id, max_id]
     cursor.execute("""
-        SELECT d.ID,
-            MAX(v.ID) AS VERSION_ID,
-            (SELECT MAX(e.ID) FROM DOC_EVENT e WHERE e.DOC_ID = d.ID GROUP BY e.DOC_ID) AS EVENT_ID,
-            (SELECT e2.STATUS FROM DOC_EVENT e2 WHERE e2.ID = EVENT_ID) AS STATUS
-        FROM DOC d, DOC_VERSION v
+        UPDATE DOC d
+            JOIN (SELECT DOC_ID, MAX(ID) AS ID FROM DOC_VERSION WHERE {condition} GROUP BY DOC_ID) lv ON lv.DOC_ID = d.ID
+            JOIN DOC_VERSION v ON v.ID = lv.ID
+            JOIN (SELECT DOC_ID, MAX(ID) AS ID FROM DOC_EVENT WHERE {condition} GROUP BY DOC_ID) le ON le.DOC_ID = d.ID
+            JOIN DOC_EVENT e ON e.ID = le.ID
+        SET d.VERSION_ID = v.ID,
+            d.LOCATION_URL = v.LOCATION_URL,
+            d.MIME_TYPE = v.MIME_TYPE,
+            d.EVENT_ID = e.ID,
+            d.STATUS = e.STATUS
+        """.format(condition=condition), 
+        params + params)
+    return cursor.rowcount
+
+def get_doc_id_range(cursor):
+    cursor.execute("SELECT MIN(ID), MAX(ID) FROM DOC")
+    return cursor.fetchone()
+
+def get_docs_by_name(cursor, realm, names):
+    # Returns a dictionary of document name -> (document ID, latest version ID, current status) for the documents that exist. One round trip for all the names. The state of the documents written before the current state columns existed (and not backfilled yet) is computed from DOC_VERSION and DOC_EVENT; the documents without a version do not exist
+    names = list(set(names))
+    if not names:
+        return {}
+    cursor.execute("""
+        SELECT d.DOCUMENT, d.ID,
+            COALESCE(d.VERSION_ID, (SELECT MAX(v.ID) FROM DOC_VERSION v WHERE v.DOC_ID = d.ID)),
+            COALESCE(d.STATUS, (SELECT e.STATUS FROM DOC_EVENT e WHERE e.DOC_ID = d.ID ORDER BY e.ID DESC LIMIT 1))
+        FROM DOC d
         WHERE
-            d.ID = v.DOC_ID
-            AND d.DOCUMENT = %(name)s
-            AND d.REALM = %(realm)s
-        GROUP BY d.ID
-        """, 
-        {"name": name, "realm": realm})
-    row = cursor.fetchone()
-    if row:
-        return row[0], row[1], row[3]
-    return (None, None, None)
+            d.REALM = %s
+            AND d.DOCUMENT IN ({})
+        """.format(in_clause(names)), 
+        [realm] + names)
+    return {row[0]: (row[1], row[2], row[3]) for row in cursor.fetchall() if row[2] is not None}
 
 def get_doc_location(cursor, realm, name):
+    # Returns (location, mime type, version ID, version creation time in epoch seconds, size, content digest, expiry in epoch seconds) of the current version. The size and the digest are not known for the versions written before content addressing was introduced. The expiry is None for the documents that do not expire
     cursor.execute("""
-        SELECT d.ID,
-            (SELECT MAX(v.ID) FROM DOC_VERSION v WHERE v.DOC_ID = d.ID GROUP BY d.ID) AS VERSION_ID,
-            (SELECT v2.LOCATION_URL FROM DOC_VERSION v2 WHERE v2.ID = VERSION_ID) AS LOCATION_URL,
-            (SELECT v2.MIME_TYPE FROM DOC_VERSION v2 WHERE v2.ID = VERSION_ID) AS MIME_TYPE,
-            (SELECT MAX(e.ID) FROM DOC_EVENT e WHERE e.DOC_ID = d.ID GROUP BY e.DOC_ID) AS EVENT_ID,
-            (SELECT e2.STATUS FROM DOC_EVENT e2 WHERE e2.ID = EVENT_ID) AS STATUS
+        SELECT d.LOCATION_URL, d.MIME_TYPE, d.VERSION_ID, UNIX_TIMESTAMP(v.CREATED_AT), c.SIZE, c.DIGEST, UNIX_TIMESTAMP(d.EXPIRES_AT)
         FROM DOC d
+            JOIN DOC_VERSION v ON v.ID = d.VERSION_ID
+            LEFT JOIN DOC_CONTENT c ON c.ID = v.CONTENT_ID
         WHERE
             d.DOCUMENT = %(name)s
             AND d.REALM = %(realm)s
-        GROUP BY d.ID
-        HAVING STATUS NOT IN ('R','D')
+            AND d.STATUS NOT IN ('R','D')
+            AND (d.EXPIRES_AT IS NULL OR d.EXPIRES_AT > NOW())
         """, 
         {"name": name, "realm": realm})
     row = cursor.fetchone()
     if row:
-        return (row[2], row[3])
-    return (None, None)
+        return row
+    return (None, None, None, None, None, None, None)
+
+def set_doc_expiry(cursor, expiry):
+    # expiry is a list of (doc_id, expires at in epoch seconds). None clears the expiry of an earlier version
+    if not expiry:
+        return
+    cursor.executemany("UPDATE DOC SET EXPIRES_AT = FROM_UNIXTIME(%s) WHERE ID = %s", 
+                       [(expires_at, doc_id) for doc_id, expires_at in expiry])
+
+def lock_expired_docs(cursor, limit):
+    # Returns (id, realm, document) of up to limit expired documents, locked until commit. Documents locked by another transaction are skipped rather than waited for
+    cursor.execute("""
+        SELECT ID, REALM, DOCUMENT FROM DOC
+        WHERE EXPIRES_AT <= NOW()
+        ORDER BY EXPIRES_AT
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+        """, (limit,))
+    return cursor.fetchall()
+
+def get_versions_of_docs(cursor, doc_ids):
+    # Returns (version id, content id, location) of the versions of the documents whose objects have not been reclaimed
+    cursor.execute("SELECT ID, CONTENT_ID, LOCATION_URL FROM DOC_VERSION WHERE DOC_ID IN ({}) AND RECLAIMED_AT IS NULL".format(in_clause(doc_ids)), doc_ids)
+    return cursor.fetchall()
+
+def get_referenced_locations(cursor, locations):
+    # The locations (of the given ones) that some version still points to. The versions whose objects were reclaimed do not count
+    if not locations:
+        return set()
+    cursor.execute("SELECT DISTINCT LOCATION_URL FROM DOC_VERSION WHERE LOCATION_URL IN ({}) AND RECLAIMED_AT IS NULL".format(in_clause(locations)), locations)
+    return set([row[0] for row in cursor.fetchall()])
+
+def lock_reclaimable_versions(cursor, grace_period, limit):
+    # Returns (version id, content id, location) of up to limit versions whose objects have not been reclaimed yet and that are no longer served for more than grace_period seconds: all the versions of the documents deleted or replaced, and the versions superseded by a newer version of the same document. Locked until commit; rows locked by another transaction are skipped
+    cursor.execute("""
+        SELECT v.ID, v.CONTENT_ID, v.LOCATION_URL
+        FROM DOC d
+            JOIN DOC_EVENT e ON e.ID = d.EVENT_ID
+            JOIN DOC_VERSION v ON v.DOC_ID = d.ID
+        WHERE v.RECLAIMED_AT IS NULL
+            AND ((d.STATUS IN ('R', 'D') AND e.EVENT_TIME <= NOW() - INTERVAL %(grace)s SECOND)
+                OR EXISTS (SELECT 1 FROM DOC_VERSION n
+                    WHERE n.DOC_ID = v.DOC_ID
+                        AND n.ID > v.ID
+                        AND n.CREATED_AT <= NOW(6) - INTERVAL %(grace)s SECOND))
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+        """, {'grace': grace_period, 'limit': limit})
+    return cursor.fetchall()
+
+def mark_versions_reclaimed(cursor, version_ids):
+    # The version rows are kept for the history; they no longer hold a reference to the content
+    cursor.execute("UPDATE DOC_VERSION SET RECLAIMED_AT = NOW(), CONTENT_ID = NULL WHERE ID IN ({})".format(in_clause(version_ids)), version_ids)
+
+def delete_docs(cursor, doc_ids):
+    # Deletes the documents with their versions, references and events. DOC_EVENT is partitioned, so its rows are not removed by foreign key cascades
+    cursor.execute("DELETE FROM DOC_EVENT WHERE DOC_ID IN ({})".format(in_clause(doc_ids)), doc_ids)
+    cursor.execute("UPDATE DOC_EVENT SET REF_DOC_ID = NULL WHERE REF_DOC_ID IN ({})".format(in_clause(doc_ids)), doc_ids)
+    cursor.execute("DELETE FROM DOC WHERE ID IN ({})".format(in_clause(doc_ids)), doc_ids)
+    return cursor.rowcount
@@ -0,0 +1,24 @@
+def get_partitions(cursor, table):
+    # Returns (name, upper bound in days as per TO_DAYS) of the partitions of the table in order. The bound of the MAXVALUE partition is None
+    cursor.execute("""
+        SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE()
+            AND TABLE_NAME = %s
+            AND PARTITION_NAME IS NOT NULL
+        ORDER BY PARTITION_ORDINAL_POSITION
+        """, (table,))
+    return [(row[0], None if row[1] == 'MAXVALUE' else int(row[1])) for row in cursor.fetchall()]
+
+def to_days(cursor, date):
+    cursor.execute("SELECT TO_DAYS(%s)", (date,))
+    return cursor.fetchone()[0]
+
+def split_last_partition(cursor, table, last, partitions):
+    # partitions is a list of (name, date); each holds the rows before its date. The last (MAXVALUE) partition is split, which only moves rows if it has any
+    cursor.execute("ALTER TABLE {} REORGANIZE PARTITION {} INTO ({}, PARTITION {} VALUES LESS THAN MAXVALUE)".format(
+        table, last, 
+        ', '.join(["PARTITION {} VALUES LESS THAN (TO_DAYS('{}'))".format(name, date.isoformat()) for name, date in partitions]),
+        last))
+
+def drop_partitions(cursor, table, names):
+    cursor.execute("ALTER TABLE {} DROP PARTITION {}".format(table, ', '.join(names)))
@@ -0,0 +1,66 @@
+# Copying a realm's rows to another database (see model/realm_mover.py). The IDs are allocated by the target database, so the references between the rows are remapped
+
+# In copy order: the rows referred to come first. (table, join to the realm, foreign key column -> referenced table)
+REALM_TABLES = [
+    ('TX', "WHERE t.REALM = %s", {}),
+    ('DOC_CONTENT', "WHERE t.REALM = %s", {}),
+    # VERSION_ID and EVENT_ID refer to rows that are copied later (see set_doc_state)
+    ('DOC', "WHERE t.REALM = %s", {}),
+    ('DOC_VERSION', "JOIN DOC d ON d.ID = t.DOC_ID WHERE d.REALM = %s",
+        {'DOC_ID': 'DOC', 'TX_ID': 'TX', 'CONTENT_ID': 'DOC_CONTENT'}),
+    ('DOC_REF', "JOIN DOC_VERSION v ON v.ID = t.DOC_VERSION_ID JOIN DOC d ON d.ID = v.DOC_ID WHERE d.REALM = %s",
+        {'DOC_VERSION_ID': 'DOC_VERSION', 'TX_ID': 'TX'}),
+    ('DOC_REF_PROPERTY', "JOIN DOC_REF r ON r.ID = t.REF_ID JOIN DOC_VERSION v ON v.ID = r.DOC_VERSION_ID JOIN DOC d ON d.ID = v.DOC_ID WHERE d.REALM = %s",
+        {'REF_ID': 'DOC_REF'}),
+    ('TX_EVENT', "JOIN TX x ON x.ID = t.TX_ID WHERE x.REALM = %s",
+        {'TX_ID': 'TX'}),
+    ('DOC_EVENT', "JOIN DOC d ON d.ID = t.DOC_ID WHERE d.REALM = %s",
+        {'DOC_ID': 'DOC', 'DOC_VERSION_ID': 'DOC_VERSION', 'REF_DOC_ID': 'DOC', 'REF_TX_ID': 'TX'})
+]
+
+def get_realm_rows(cursor, table, join, realm, after, limit):
+    # Returns the column names and the next rows in ID order
+    cursor.execute("SELECT t.* FROM {} t {} AND t.ID > %s ORDER BY t.ID LIMIT %s".format(table, join), (realm, after, limit))
+    return cursor.column_names, cursor.fetchall()
+
+def insert_row(cursor, table, columns, row):
+    # One row at a time: the new ID is needed to remap the references to the row
+    cursor.execute("INSERT INTO {}({}) VALUES({})".format(table, ','.join(columns), ','.join(['%s'] * len(columns))), row)
+    return cursor.lastrowid
+
+def set_doc_state(cursor, states):
+    # states is a list of (version_id, event_id, doc_id)
+    cursor.executemany("UPDATE DOC SET VERSION_ID = %s, EVENT_ID = %s WHERE ID = %s", states)
+
+def count_realm_rows(cursor, table, join, realm):
+    cursor.execute("SELECT COUNT(*) FROM {} t {}".format(table, join), (realm,))
+    return cursor.fetchone()[0]
+
+def count_pending_txs(cursor, realm):
+    # Transactions accepted in the asynchronous mode and not completed yet: their latest event has status P
+    cursor.execute("""
+        SELECT COUNT(*) FROM TX t
+            JOIN TX_EVENT e ON e.ID = (SELECT MAX(e2.ID) FROM TX_EVENT e2 WHERE e2.TX_ID = t.ID)
+        WHERE t.REALM = %s AND e.STATUS = 'P'
+    """, (realm,))
+    return cursor.fetchone()[0]
+
+def delete_realm_events(cursor, realm, limit):
+    # The event tables have no foreign keys to cascade the deletes. Returns the number of rows deleted
+    cursor.execute("""
+        DELETE FROM DOC_EVENT
+        WHERE DOC_ID IN (SELECT ID FROM DOC WHERE REALM = %s)
+        LIMIT %s
+    """, (realm, limit))
+    deleted = cursor.rowcount
+    cursor.execute("""
+        DELETE FROM TX_EVENT
+        WHERE TX_ID IN (SELECT ID FROM TX WHERE REALM = %s)
+        LIMIT %s
+    """, (realm, limit))
+    return deleted + cursor.rowcount
+
+def delete_realm_rows(cursor, table, realm, limit):
+    # TX, DOC or DOC_CONTENT. Deleting DOC cascades to DOC_VERSION, DOC_REF and DOC_REF_PROPERTY
+    cursor.execute("DELETE FROM {} WHERE REALM = %s LIMIT %s".format(table), (realm, limit))
+    return cursor.rowcount
@@ -5,31 +5,117 @@ def create_tx(payload, tx_type, cursor):
     tx_id = cursor.lastrowid
     return tx_id
 
-def create_tx_event(cursor, tx_id):
-    cursor.execute(("""INSERT INTO TX_EVENT (EVENT, STATUS, TX_ID) 
-                  VALUES(%s, %s, %s) 
+def create_tx_event(cursor, tx_id, event='INGESTION', status='I', description=None):
+    cursor.execute(("""INSERT INTO TX_EVENT (EVENT, STATUS, DESCRIPTION, TX_ID) 
+                  VALUES(%s, %s, %s, %s) 
                   """), 
-                  ('INGESTION', 'I', tx_id))
+                  (event, status, description, tx_id))
+
+def get_tx_status(cursor, tx_id, lock=False):
+    # Status of the latest event of the transaction. With lock, the transaction row stays locked until commit/rollback so that only one worker can process it
+    if lock:
+        cursor.execute("SELECT ID FROM TX WHERE ID = %s FOR UPDATE", (tx_id,))
+        if not cursor.fetchall():
+            return None
+    cursor.execute("SELECT STATUS FROM TX_EVENT WHERE TX_ID = %s ORDER BY ID DESC LIMIT 1", (tx_id,))
+    row = cursor.fetchone()
+    return row[0] if row else None
     
-def get_events(cursor, realm, start_time, end_time):
+def get_tx(cursor, realm, tx):
+    # Uses the UNIQUE (TX, REALM) index. Returns (id, type, principal, created at, latest event id, latest status)
+    cursor.execute("""SELECT 
+        t.ID, t.TX_TYPE, t.PRINCIPAL, t.CREATED_AT, e.ID, e.STATUS
+        FROM 
+            TX t
+            LEFT JOIN TX_EVENT e ON e.ID = (SELECT MAX(e2.ID) FROM TX_EVENT e2 WHERE e2.TX_ID = t.ID)
+        WHERE 
+            t.TX = %s
+            AND t.REALM = %s
+        """, (tx, realm))
+    return cursor.fetchone()
+
+def get_tx_events(cursor, tx_id):
+    cursor.execute("""SELECT 
+        EVENT_TIME, EVENT, STATUS, DESCRIPTION
+        FROM TX_EVENT
+        WHERE TX_ID = %s
+        ORDER BY ID
+        """, (tx_id,))
+    return cursor.fetchall()
+
+def get_tx_documents(cursor, tx_id):
+    # The document events recorded by the transaction along with the version it created, if any
+    cursor.execute("""SELECT 
+        e.EVENT_TIME, d.DOCUMENT, e.DESCRIPTION, e.STATUS, v.ID, v.TYPE, v.MIME_TYPE, v.LOCATION_URL
+        FROM 
+            DOC_EVENT e
+            JOIN DOC d ON e.DOC_ID = d.ID
+            LEFT JOIN DOC_VERSION v ON v.DOC_ID = d.ID AND v.TX_ID = e.REF_TX_ID
+        WHERE 
+            e.REF_TX_ID = %s
+        ORDER BY 
+            e.ID
+        """, (tx_id,))
+    return cursor.fetchall()
+
+def get_events(cursor, realm, start_time, end_time, after=None, limit=None):
+    # Keyset pagination on (EVENT_TIME, ID), backed by the composite index of DOC_EVENT. after is the (event time, id) of the last event already returned. The version is the one the event refers to (DOC_VERSION_ID), so each event is returned once. The rows are not fetched here; the caller iterates the cursor
+    conditions = ["e.EVENT_TIME BETWEEN FROM_UNIXTIME(%s) AND FROM_UNIXTIME(%s)"]
+    params = [start_time, end_time]
+    if after:
+        conditions.append("(e.EVENT_TIME > %s OR (e.EVENT_TIME = %s AND e.ID > %s))")
+        params.extend([after[0], after[0], after[1]])
+    params.append(realm)
+    cursor.execute("""SELECT 
+        e.EVENT_TIME, d.DOCUMENT, e.STATUS, e.REF_TX_ID, e.REF_DOC_ID, v.LOCATION_URL, v.TYPE, v.MIME_TYPE, e.ID
+        FROM 
+            DOC_EVENT e
+            JOIN DOC d ON e.DOC_ID = d.ID
+            LEFT JOIN DOC_VERSION v ON v.ID = e.DOC_VERSION_ID
+        WHERE 
+            {}
+            AND d.REALM = %s
+        ORDER BY 
+            e.EVENT_TIME, e.ID
+        {}""".format(' AND '.join(conditions), 'LIMIT %s' if limit else ''), 
+        params + ([limit] if limit else []))
+    return cursor
+
+def get_feed_position(cursor):
+    # The latest (TX_EVENT ID, DOC_EVENT ID). A change feed without a cursor starts from here
+    cursor.execute("SELECT (SELECT IFNULL(MAX(ID), 0) FROM TX_EVENT), (SELECT IFNULL(MAX(ID), 0) FROM DOC_EVENT)")
+    return cursor.fetchone()
+
+def get_feed_tx_events(cursor, realm, after_id, settle_time, limit):
+    # The TX_EVENTs of the realm after after_id, in ID order. The last column tells if the event is older than settle_time seconds (see feed_service)
+    cursor.execute("""SELECT 
+        e.ID, e.EVENT_TIME, t.TX, e.EVENT, e.STATUS, e.DESCRIPTION, e.CREATED_AT <= NOW(6) - INTERVAL %s MICROSECOND
+        FROM 
+            TX_EVENT e
+            JOIN TX t ON t.ID = e.TX_ID
+        WHERE 
+            e.ID > %s
+            AND t.REALM = %s
+        ORDER BY 
+            e.ID
+        LIMIT %s
+        """, (int(settle_time * 1000000), after_id, realm, limit))
+    return cursor.fetchall()
+
+def get_feed_doc_events(cursor, realm, after_id, settle_time, limit):
+    # Same as get_feed_tx_events for DOC_EVENTs
     cursor.execute("""SELECT 
-        e.EVENT_TIME, d.DOCUMENT, e.STATUS, e.REF_TX_ID, e.REF_DOC_ID, v.LOCATION_URL, v.TYPE, v.MIME_TYPE
+        e.ID, e.EVENT_TIME, t.TX, d.DOCUMENT, e.STATUS, e.DESCRIPTION, v.LOCATION_URL, v.TYPE, v.MIME_TYPE, e.CREATED_AT <= NOW(6) - INTERVAL %s MICROSECOND
         FROM 
             DOC_EVENT e
             JOIN DOC d ON e.DOC_ID = d.ID
-            JOIN DOC_VERSION v ON v.DOC_ID = d.ID
+            LEFT JOIN TX t ON t.ID = e.REF_TX_ID
+            LEFT JOIN DOC_VERSION v ON v.ID = e.DOC_VERSION_ID
         WHERE 
-            e.EVENT_TIME BETWEEN FROM_UNIXTIME(%s) AND FROM_UNIXTIME(%s)
+            e.ID > %s
             AND d.REALM = %s
         ORDER BY 
-            e.EVENT_TIME
-        """, (start_time, end_time, realm))
-    # print(cursor.statement)
-    events = []
-    rows = cursor.fetchall()
-    for row in rows:
-        events.append((row[0], row[1], row[2], row[3], row[4], row[5], row[6], row[7]))
-    return events
-    # format_strings = ','.join(['%s'] * len(list_of_ids))
-    # cursor.execute("DELETE FROM foo.bar WHERE baz IN (%s)" % format_strings,
-    #            tuple(list_of_ids))
\ No newline at end of file
+            e.ID
+        LIMIT %s
+        """, (int(settle_time * 1000000), after_id, realm, limit))
+    return cursor.fetchall()
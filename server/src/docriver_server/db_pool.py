@@ -0,0 +1,181 @@
+import collections
+import logging
+import threading
+import time
+
+import mysql.connector
+from mysql.connector.errors import PoolError
+from opentelemetry.instrumentation.mysql import MySQLInstrumentor
+
+import metrics_util
+from job_util import run_periodically
+
+class PooledConnection:
+    # What the pool hands out. Delegates to the physical connection; close() returns it to the pool
+    instrumented = True
+
+    def __init__(self, pool, connection):
+        self._pool = pool
+        self._connection = connection
+
+    def __getattr__(self, name):
+        if self._connection is None:
+            raise PoolError("Connection already returned to the pool")
+        return getattr(self._connection, name)
+
+    def is_connected(self):
+        # The services close a connection only if it is connected. A checked out connection reports connected so that a broken one is still returned to the pool (which replaces it) instead of leaking its slot
+        return self._connection is not None
+
+    def close(self):
+        if self._connection is not None:
+            connection = self._connection
+            self._connection = None
+            self._pool.release(connection)
+
+class ConnectionPool:
+    # Drop-in replacement of MySQLConnectionPool that queues the requests when all the connections are in use instead of failing them. Up to max_waiting requests wait up to wait_timeout seconds for a connection; beyond that, PoolError is raised as before.
+    # Connections are opened up to pool_size as needed (prewarm() opens them ahead), instrumented once when opened, and pinged before reuse when they have been idle for more than validate_interval seconds (or by the background validation, see start())
+    def __init__(self, pool_name, pool_size, max_waiting=100, wait_timeout=10, validate_interval=60, instrument=False, **config):
+        self.pool_name = pool_name
+        self.pool_size = pool_size
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.validate_interval = validate_interval
+        self.instrument = instrument
+        self.config = config
+        self.condition = threading.Condition()
+        # (connection, idle since). Most recently used last: reused first, so that the others can be validated (or time out on the server) together
+        self.idle = collections.deque()
+        self.opened = 0
+        self.waiting = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.attributes = {'pool': pool_name}
+
+    def connect(self):
+        connection = mysql.connector.connect(**self.config)
+        return MySQLInstrumentor().instrument_connection(connection) if self.instrument else connection
+
+    def get_connection(self):
+        start = time.monotonic()
+        connection = None
+        with self.condition:
+            while True:
+                if self.idle:
+                    connection, idle_since = self.idle.pop()
+                    break
+                if self.opened < self.pool_size:
+                    self.opened = self.opened + 1
+                    break
+                remaining = start + self.wait_timeout - time.monotonic()
+                if self.waiting >= self.max_waiting or remaining <= 0:
+                    metrics_util.increment_pool_timeouts(self.attributes)
+                    raise PoolError("No connection available in pool {} after {:.3f}s. Waiting: {}".format(self.pool_name, time.monotonic() - start, self.waiting))
+                self.waiting = self.waiting + 1
+                try:
+                    self.condition.wait(remaining)
+                finally:
+                    self.waiting = self.waiting - 1
+
+        try:
+            if connection is None:
+                connection = self.connect()
+            elif time.monotonic() - idle_since > self.validate_interval and not self.ping(connection):
+                connection = self.connect()
+        except Exception as e:
+            self.discard()
+            raise e
+        metrics_util.record_pool_wait(time.monotonic() - start, self.attributes)
+        metrics_util.add_pool_in_use(1, self.attributes)
+        return PooledConnection(self, connection)
+
+    def release(self, connection):
+        metrics_util.add_pool_in_use(-1, self.attributes)
+        try:
+            # Rolls back what was left uncommitted and resets the session variables, like MySQLConnectionPool
+            connection.reset_session()
+        except Exception as e:
+            logging.warning("Discarding connection of pool {}. Exception: {}".format(self.pool_name, e))
+            self.close_quietly(connection)
+            self.discard()
+            return
+        with self.condition:
+            self.idle.append((connection, time.monotonic()))
+            self.condition.notify()
+
+    def discard(self):
+        # Frees the slot of a connection that could not be opened or was broken
+        with self.condition:
+            self.opened = self.opened - 1
+            self.condition.notify()
+
+    def ping(self, connection):
+        try:
+            connection.ping(reconnect=False)
+            return True
+        except Exception as e:
+            logging.info("Reconnecting stale connection of pool {}. Exception: {}".format(self.pool_name, e))
+            self.close_quietly(connection)
+            return False
+
+    def close_quietly(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def prewarm(self, count=None):
+        # Opens connections up to count (default: pool_size) so that the first requests do not pay for the connection setup. Returns the number opened
+        count = min(count if count is not None else self.pool_size, self.pool_size)
+        opened = 0
+        while True:
+            with self.condition:
+                if self.opened >= count:
+                    return opened
+                self.opened = self.opened + 1
+            try:
+                connection = self.connect()
+            except Exception as e:
+                self.discard()
+                raise e
+            with self.condition:
+                self.idle.appendleft((connection, time.monotonic()))
+                self.condition.notify()
+            opened = opened + 1
+
+    def validate(self):
+        # Pings the connections that have been idle for longer than validate_interval and replaces the broken ones. The connections being checked are out of the idle list meanwhile, so requests do not get them
+        now = time.monotonic()
+        with self.condition:
+            stale = [entry for entry in self.idle if now - entry[1] > self.validate_interval]
+            for entry in stale:
+                self.idle.remove(entry)
+        replaced = 0
+        for connection, idle_since in stale:
+            if not self.ping(connection):
+                try:
+                    connection = self.connect()
+                    replaced = replaced + 1
+                except Exception as e:
+                    logging.warning("Unable to reconnect connection of pool {}. Exception: {}".format(self.pool_name, e))
+                    self.discard()
+                    continue
+            with self.condition:
+                self.idle.appendleft((connection, time.monotonic()))
+                self.condition.notify()
+        if replaced:
+            logging.info("Replaced {} broken connections of pool {}".format(replaced, self.pool_name))
+        return len(stale), replaced
+
+    def start(self):
+        self.thread = threading.Thread(target=run_periodically, args=(self.validate, self.validate_interval, self.stop_event), name='{}-validator'.format(self.pool_name), daemon=True)
+        self.thread.start()
+
+    def shutdown(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+        with self.condition:
+            while self.idle:
+                self.close_quietly(self.idle.pop()[0])
@@ -0,0 +1,120 @@
+import logging
+import threading
+import time
+
+import mysql.connector
+
+class ReadPool:
+    # What the read-only services get instead of a pool when the replica may be used
+    def __init__(self, router):
+        self.router = router
+
+    def get_connection(self):
+        return self.router.get_read_connection()
+
+class DbRouter:
+    # Routes the connections of the read-only endpoints to an optional replica pool. get_connection() always returns a connection to the primary, so the router can be used wherever a pool is expected.
+    # The replica is used only while its replication lag (checked at most every check_interval seconds) is within max_lag, and falls back to the primary when a connection cannot be made.
+    # Read-your-writes: the reads of a realm go to the primary for a while after a write to it, either by this gateway instance or by the client (see written_at)
+    def __init__(self, primary, replica=None, max_lag=5, check_interval=5):
+        self.primary = primary
+        self.replica = replica
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.replica_usable = False
+        self.checked_at = 0
+        self.checking = False
+        # Realm -> time of the last write committed by this instance
+        self.written = {}
+        self.stats = {'replica': 0, 'primary': 0, 'fallback': 0}
+
+    def get_connection(self):
+        return self.primary.get_connection()
+
+    def consistency_window(self):
+        # A replica that passed the last check is at most max_lag seconds behind, and the check is at most check_interval seconds old
+        return self.max_lag + self.check_interval
+
+    def mark_written(self, realm):
+        if self.replica:
+            self.written[realm] = time.time()
+
+    def recently_written(self, realm, written_at=None):
+        last = max(self.written.get(realm, 0), written_at if written_at else 0)
+        return time.time() - last < self.consistency_window()
+
+    def reader(self, realm, written_at=None):
+        # written_at is the time of the client's last write as reported by the client (see the controller), for writes made through other gateway instances
+        if not self.replica or self.recently_written(realm, written_at):
+            self.stats['primary'] = self.stats['primary'] + 1
+            return self.primary
+        return ReadPool(self)
+
+    def get_read_connection(self):
+        if self.check_replica():
+            try:
+                connection = self.replica.get_connection()
+                self.stats['replica'] = self.stats['replica'] + 1
+                return connection
+            except Exception as e:
+                logging.warning("Replica unavailable, reading from the primary. Exception: {}".format(e))
+                with self.lock:
+                    self.replica_usable = False
+                    self.checked_at = time.time()
+        self.stats['fallback'] = self.stats['fallback'] + 1
+        return self.primary.get_connection()
+
+    def check_replica(self):
+        # The first request after the check interval does the check; the others use the previous result meanwhile
+        with self.lock:
+            if self.checking or time.time() - self.checked_at < self.check_interval:
+                return self.replica_usable
+            self.checking = True
+        usable = False
+        try:
+            lag = replica_lag(self.replica)
+            usable = lag is not None and lag <= self.max_lag
+            if not usable:
+                logging.warning("Replica lag: {}s. Reading from the primary".format(lag))
+        except Exception as e:
+            logging.warning("Unable to check the replica, reading from the primary. Exception: {}".format(e))
+        with self.lock:
+            self.replica_usable = usable
+            self.checked_at = time.time()
+            self.checking = False
+        return usable
+
+    def replica_status(self):
+        # For the health check. None if there is no replica
+        return self.check_replica() if self.replica else None
+
+def replica_lag(pool):
+    # Seconds behind the source, or None if replication is not running. A server that is not a replica (no status) has no lag
+    connection = pool.get_connection()
+    cursor = connection.cursor(dictionary=True)
+    try:
+        try:
+            cursor.execute("SHOW REPLICA STATUS")
+        except mysql.connector.Error:
+            # Before MySQL 8.0.22
+            cursor.execute("SHOW SLAVE STATUS")
+        row = cursor.fetchone()
+        if not row:
+            return 0
+        return row['Seconds_Behind_Source'] if 'Seconds_Behind_Source' in row else row['Seconds_Behind_Master']
+    finally:
+        cursor.close()
+        connection.close()
+
+def read_pool(connection_pool, realm, written_at=None):
+    return connection_pool.reader(realm, written_at) if isinstance(connection_pool, DbRouter) else connection_pool
+
+def primary_read(connection_pool, pool):
+    # True if pool, the reader of connection_pool, is the primary although there is a replica: the client wrote recently and must see its writes
+    return isinstance(connection_pool, DbRouter) and connection_pool.replica is not None and pool is connection_pool.primary
+
+def mark_written(connection_pool, realm):
+    # Called after a commit that changes the realm
+    if isinstance(connection_pool, DbRouter):
+        connection_pool.mark_written(realm)
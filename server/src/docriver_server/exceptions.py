@@ -6,4 +6,15 @@ class ValidationException(Exception):
 class DocumentException(Exception):
     def __init__(self, message="Document exception"):
         self.message = message
-        super().__init__(self.message)
\ No newline at end of file
+        super().__init__(self.message)
+
+class StorageException(Exception):
+    def __init__(self, message="Storage exception", errors=None):
+        self.message = message
+        self.errors = errors if errors is not None else {}
+        super().__init__(self.message)
+
+class UnavailableException(Exception):
+    def __init__(self, message="Service unavailable"):
+        self.message = message
+        super().__init__(self.message)
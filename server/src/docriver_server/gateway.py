@@ -1,6 +1,5 @@
 #!/usr/bin/env python
 
-import mysql.connector
 from minio import Minio
 import argparse
 import logging
@@ -14,7 +13,6 @@ from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExport
 from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
 from opentelemetry.sdk.resources import Resource
 from opentelemetry.instrumentation.flask import FlaskInstrumentor
-from opentelemetry.instrumentation.mysql import MySQLInstrumentor
 
 from opentelemetry.sdk.metrics.export import ConsoleMetricExporter
 from opentelemetry.exporter.otlp.proto.http.metric_exporter import OTLPMetricExporter
@@ -31,27 +29,96 @@ from opentelemetry.sdk._logs import LoggerProvider, LoggingHandler
 from opentelemetry.sdk._logs.export import BatchLogRecordProcessor
 
 from controller.http import init_app, init_params
+from model.upload_engine import UploadEngine
+from model.tx_processor import TxProcessor
+from model.reclaimer import Reclaimer
+from db_router import DbRouter
+from db_pool import ConnectionPool
+from shard_router import ShardRouter
+from model.location_cache import init_location_cache
+from model.body_cache import init_body_cache
+from model.document_service import init_coalescing
+from model.feed_service import init_feed
 from docriver_auth.keystore import get_entries
+from docriver_auth.auth_token import init_token_cache
+from docriver_auth.jwks import JwksKeySet
 import metrics_util
 import trace_util
 
-def init_db(host, port, db, user, password, pool_size, instrument_connection = False):
-    # Instrument MySQL conections
-    if instrument_connection:
-        MySQLInstrumentor().instrument()
+def init_db(host, port, db, user, password, pool_size, instrument_connection = False, pool_name='docriver', max_waiting=100, wait_timeout=10, validate_interval=60):
+    # MySQL connections are instrumented by the pool, once per connection
     trace_util.set_instrument_connection(instrument_connection)
     
-    return mysql.connector.pooling.MySQLConnectionPool(pool_name='docriver', 
-            pool_size=pool_size,
+    return ConnectionPool(pool_name, pool_size,
+            max_waiting=max_waiting,
+            wait_timeout=wait_timeout,
+            validate_interval=validate_interval,
+            instrument=instrument_connection,
             user=user, password=password,
             host=host,
             port=port,
             database=db)
 
+def start_db_pool(connection_pool, prewarm):
+    # Opens the connections ahead of the first requests and starts the periodic validation of the idle ones
+    if prewarm:
+        logging.info("Opened {} connections of pool {}".format(connection_pool.prewarm(prewarm), connection_pool.pool_name))
+    connection_pool.start()
+
+def init_db_router(primary, replica_host, port, db, user, password, pool_size, max_lag, check_interval, instrument_connection = False, max_waiting=100, wait_timeout=10, validate_interval=60):
+    replica = init_db(replica_host, port, db, user, password, pool_size, instrument_connection, 'docriver-replica', max_waiting, wait_timeout, validate_interval) if replica_host else None
+    return DbRouter(primary, replica, max_lag, check_interval)
+
+def init_shard_pool(args, name, config):
+    # A shard of the shard map file: the settings that are not in the file are the same as the default database's
+    connection_pool = init_db(config['host'], config.get('port', args.dbPort), config.get('database', args.dbDatabase), config.get('user', args.dbUser), config.get('password', args.dbPassword), config.get('poolSize', args.dbPoolSize), args.otelConnectionInstrument, 'docriver-{}'.format(name), args.dbPoolMaxWaiting, args.dbPoolWaitTimeout, args.dbPoolValidateInterval)
+    start_db_pool(connection_pool, min(args.dbPoolPrewarm, connection_pool.pool_size))
+    router = init_db_router(connection_pool, config.get('replicaHost'), config.get('port', args.dbPort), config.get('database', args.dbDatabase), config.get('user', args.dbUser), config.get('password', args.dbPassword), args.dbReplicaPoolSize, args.dbReplicaMaxLag, args.dbReplicaCheckInterval, args.otelConnectionInstrument, args.dbPoolMaxWaiting, args.dbPoolWaitTimeout, args.dbPoolValidateInterval)
+    if router.replica:
+        start_db_pool(router.replica, args.dbReplicaPoolSize)
+    return router
+
+def init_shard_router(connection_pool, map_file, reload_interval, pool_factory):
+    if not map_file:
+        return connection_pool
+    return ShardRouter(connection_pool, pool_factory, map_file, reload_interval)
+
 def init_obj_store(url, access_key, secret_key):
     # TODO fix the secure=False
     return Minio(url, secure=False, access_key=access_key, secret_key=secret_key)
     
+def init_obj_store_presigner(url, access_key, secret_key, region):
+    # Presigning is done offline when the region is known
+    secure = url.startswith('https://')
+    return Minio(url[url.find('://')+3:] if '://' in url else url, secure=secure, access_key=access_key, secret_key=secret_key, region=region)
+
+def init_delivery(mode, obj_url, obj_public_url, access_key, secret_key, region, accel_prefix, expires):
+    # How the document bytes are delivered: streamed by the gateway (stream), by nginx through X-Accel-Redirect (accel) or directly by the object store through a presigned URL (presign)
+    if mode == 'stream':
+        return None
+    return {'mode': mode, 
+            'accelPrefix': accel_prefix, 
+            'expires': expires,
+            # nginx reaches the object store using the internal URL. Clients use the public URL
+            'presigner': init_obj_store_presigner(obj_url if mode == 'accel' else (obj_public_url or obj_url), access_key, secret_key, region)}
+
+def init_obj_store_uploader(max_workers, max_per_tx):
+    return UploadEngine(max_workers, max_per_tx)
+
+def init_tx_processor(max_workers, connection_pool, minio, scanner, bucket, untrusted_fs_mount, scanner_fs_mount, uploader):
+    if max_workers <= 0:
+        return None
+    processor = TxProcessor(max_workers, connection_pool, minio, scanner, bucket, untrusted_fs_mount, scanner_fs_mount, uploader)
+    processor.recover()
+    return processor
+
+def init_reclaimer(interval, connection_pool, minio, bucket, grace_period, rate):
+    if interval <= 0:
+        return None
+    reclaimer = Reclaimer(connection_pool, minio, bucket, grace_period, rate)
+    reclaimer.start(interval)
+    return reclaimer
+
 def init_virus_scanner(host, port):
     return clamd.ClamdNetworkSocket(host=host, port=port)
 
@@ -62,6 +129,13 @@ def init_authorization(keystore, password):
          return None, None, None, None, None
     return get_entries(keystore, password)
 
+def init_jwks(jwks, public_keys, refresh_interval):
+    # jwks: comma separated issuer=url. The keystore's keys remain in use for the other issuers
+    if not jwks:
+        return public_keys
+    sources = dict([source.split('=', 1) for source in jwks.split(',')])
+    return JwksKeySet(sources, public_keys, refresh_interval).start()
+
 def init_tracing(exp = None, endpoint = None, auth_token_key=None, auth_token_val=None):
     resource = init_resource(auth_token_key, auth_token_val)  
     provider = TracerProvider(resource=resource)
@@ -127,13 +201,41 @@ def parse_args(args):
     parser.add_argument("--objAccessKey", help="Access key of the object store", default='docriver-key')
     parser.add_argument("--objSecretKey", help="Secret key for the object store", default='docriver-secret')
     parser.add_argument("--bucket", help="Bucket name where the documents are stored", default='docriver')
+    parser.add_argument("--objPublicUrl", help="URL of the object store as seen by the clients (for example https://docs.example.com:9000). Used by the presign delivery mode. Defaults to objUrl", default=None)
+    parser.add_argument("--objRegion", help="Region of the object store. Used for signing URLs", default='us-east-1')
+    parser.add_argument("--deliveryMode", choices=['stream', 'accel', 'presign'], help="How the document contents are delivered on GET /document. stream: through the gateway, accel: by nginx using X-Accel-Redirect, presign: redirect to a presigned object store URL", default='stream')
+    parser.add_argument("--deliveryAccelPrefix", help="Internal nginx location that proxies the object store (accel delivery mode)", default='/internal/objstore')
+    parser.add_argument("--deliveryUrlExpiry", type=int, help="Validity of the presigned URLs in seconds (accel and presign delivery modes)", default=60)
+    parser.add_argument("--authJwks", help="Comma separated list of issuer=url of the JSON Web Key Sets of the token issuers (such as the token server's /.well-known/jwks.json). The keys are selected by kid and refreshed in the background, so that the issuers can rotate their keys", default=None)
+    parser.add_argument("--authJwksRefreshInterval", type=int, help="How often (in seconds) the JSON Web Key Sets are fetched", default=300)
+    parser.add_argument("--authTokenCacheSize", type=int, help="Maximum number of verified authorization tokens cached in memory (until they expire), so that a token replayed for many requests is verified once. 0 disables the cache", default=10000)
+    parser.add_argument("--locationCacheSize", type=int, help="Maximum number of document locations cached in memory. 0 disables the cache", default=10000)
+    parser.add_argument("--locationCacheTtl", type=int, help="Time in seconds a cached document location is used. This bounds how long other gateway instances may serve a replaced/deleted document", default=30)
+    parser.add_argument("--bodyCacheDir", help="Local directory used to cache the contents of frequently read documents. The cache is disabled if not specified", default=None)
+    parser.add_argument("--bodyCacheSize", type=int, help="Maximum total size of the document contents cached in bodyCacheDir, in bytes", default=1024*1024*1024)
+    parser.add_argument("--bodyCacheMaxObjectSize", type=int, help="Documents larger than this (in bytes) are not cached", default=64*1024*1024)
+    parser.add_argument("--coalesceMaxObjectSize", type=int, help="Concurrent requests for the same document share one object store read (held in memory) if the document is not larger than this, in bytes. 0 disables it", default=1024*1024)
+    parser.add_argument("--feedPollInterval", type=int, help="Change feed subscribers are woken up by the transactions committed by this instance. If other gateway instances write to the same database, set this to re-check the database every so many seconds. 0 disables it", default=0)
+    parser.add_argument("--feedSettleTime", type=float, help="Change feed events are delivered once they are older than this (in seconds), so that events committed out of order are not skipped", default=1)
+    parser.add_argument("--objUploadWorkers", type=int, help="Maximum number of concurrent object store uploads across all transactions", default=16)
+    parser.add_argument("--objUploadWorkersPerTx", type=int, help="Maximum number of concurrent object store uploads within a single transaction", default=4)
 
     parser.add_argument("--rawFilesystemMount", help="mount point of the shared filesystem where raw documents is stored by applications. The applications can copy files to this location and specify the location instead of uploading", default='.')
     parser.add_argument("--untrustedFilesystemMount", help="mount point of a shared filesystem where untrusted files are staged for validations, virus scans, etc. This mount point must be shared with the virus scanner", default='.')
     
     parser.add_argument("--dbPoolSize", help="Connection pool size", type=int, default=5)
+    parser.add_argument("--dbPoolMaxWaiting", help="Maximum number of requests waiting for a connection when all the connections of the pool are in use. The requests beyond that fail right away", type=int, default=100)
+    parser.add_argument("--dbPoolWaitTimeout", help="How long (in seconds) a request waits for a connection", type=float, default=10)
+    parser.add_argument("--dbPoolPrewarm", help="Number of connections opened at startup", type=int, default=5)
+    parser.add_argument("--dbPoolValidateInterval", help="Idle connections are checked (and reconnected if broken) this often, in seconds", type=int, default=60)
     parser.add_argument("--dbHost", help="Database host name", default='127.0.0.1')
     parser.add_argument("--dbPort", type=int, help="Database port number", default=3306)
+    parser.add_argument("--dbShardMap", help="JSON file that maps realms to other databases (shards). The realms that are not in it are in the database above. See shard_router.py for the format. The file is re-read when it changes", default=None)
+    parser.add_argument("--dbShardReloadInterval", type=int, help="How often (in seconds) the shard map file is checked for changes", default=10)
+    parser.add_argument("--dbReplicaHost", help="Host name of a read replica of the database. The read-only endpoints use it when it is available and not lagging. The port, database, user and password are the same as the primary's", default=None)
+    parser.add_argument("--dbReplicaPoolSize", type=int, help="Replica connection pool size", default=5)
+    parser.add_argument("--dbReplicaMaxLag", type=int, help="Reads fall back to the primary when the replica is more than this many seconds behind", default=5)
+    parser.add_argument("--dbReplicaCheckInterval", type=int, help="How often (in seconds) the replication lag is checked", default=5)
     parser.add_argument("--dbUser", help="Database user name", default='docriver')
     parser.add_argument("--dbPassword", help="Database password", default='docriver')
     parser.add_argument("--dbDatabase", help="Database name", default='docriver')
@@ -141,6 +243,11 @@ def parse_args(args):
     parser.add_argument("--scanHost", help="Document virus checker hostname", default='127.0.0.1')
     parser.add_argument("--scanPort", type=int, help="Document virus checker port number", default=3310)
     parser.add_argument("--scannerFilesystemMount", help="Mount point for the untrusted area in the scanner server", default='/scandir')
+    parser.add_argument("--reclaimInterval", type=int, help="Run the reclamation of the storage used by deleted/replaced documents and orphaned objects every so many seconds. 0 disables it", default=3600)
+    parser.add_argument("--reclaimGracePeriod", type=int, help="Objects are reclaimed only if the document was deleted/replaced (or the orphaned object was written) more than this many seconds ago", default=24*60*60)
+    parser.add_argument("--reclaimRate", type=float, help="I/O budget of the reclamation: maximum number of rows/objects processed per second", default=100)
+    parser.add_argument("--txWorkers", type=int, help="Number of background workers that process the transactions submitted in the asynchronous mode (?async=true or Prefer: respond-async). 0 disables the asynchronous mode", default=4)
+    parser.add_argument('--streamingIngest', help="Read each uploaded document once and stream it to the virus scanner and the object store at the same time, instead of staging it in the untrusted filesystem. Note that the scanner's StreamMaxLength limits the document size in this mode", action=argparse.BooleanOptionalAction)
 
     parser.add_argument('--authKeystore', default=None,
                         help='A PKCS12 keystore file for storing certifcates and keys for authorizing transactions')
@@ -180,18 +287,35 @@ if __name__ == '__main__':
     
     init_metrics(args.otelMetricsExp, args.otelExpEndpoint, args.otelBackendAuthTokenKey, args.otelBackendAuthTokenKey)
     
-    connection_pool = init_db(args.dbHost, args.dbPort, args.dbDatabase, args.dbUser, args.dbPassword, args.dbPoolSize, args.otelConnectionInstrument)
+    connection_pool = init_db(args.dbHost, args.dbPort, args.dbDatabase, args.dbUser, args.dbPassword, args.dbPoolSize, args.otelConnectionInstrument, 'docriver', args.dbPoolMaxWaiting, args.dbPoolWaitTimeout, args.dbPoolValidateInterval)
+    start_db_pool(connection_pool, args.dbPoolPrewarm)
+    connection_pool = init_db_router(connection_pool, args.dbReplicaHost, args.dbPort, args.dbDatabase, args.dbUser, args.dbPassword, args.dbReplicaPoolSize, args.dbReplicaMaxLag, args.dbReplicaCheckInterval, args.otelConnectionInstrument, args.dbPoolMaxWaiting, args.dbPoolWaitTimeout, args.dbPoolValidateInterval)
+    if connection_pool.replica:
+        start_db_pool(connection_pool.replica, args.dbReplicaPoolSize)
+    connection_pool = init_shard_router(connection_pool, args.dbShardMap, args.dbShardReloadInterval, lambda name, config: init_shard_pool(args, name, config))
     
+    init_token_cache(args.authTokenCacheSize, metrics_util.increment_token_cache)
+    init_location_cache(args.locationCacheSize, args.locationCacheTtl)
+    init_body_cache(args.bodyCacheDir, args.bodyCacheSize, args.bodyCacheMaxObjectSize)
+    init_coalescing(args.coalesceMaxObjectSize)
+    init_feed(args.feedPollInterval, args.feedSettleTime)
+
     minio = init_obj_store(args.objUrl, args.objAccessKey, args.objSecretKey)
+    uploader = init_obj_store_uploader(args.objUploadWorkers, args.objUploadWorkersPerTx)
+    delivery = init_delivery(args.deliveryMode, args.objUrl, args.objPublicUrl, args.objAccessKey, args.objSecretKey, args.objRegion, args.deliveryAccelPrefix, args.deliveryUrlExpiry)
     
     scanner = init_virus_scanner(args.scanHost, args.scanPort)
     
     auth_private_key, auth_public_key, auth_signer_cert, auth_signer_cn, auth_public_keys = init_authorization(args.authKeystore, args.authPassword)
+    auth_public_keys = init_jwks(args.authJwks, auth_public_keys, args.authJwksRefreshInterval)
+
+    init_reclaimer(args.reclaimInterval, connection_pool, minio, args.bucket, args.reclaimGracePeriod, args.reclaimRate)
+    tx_processor = init_tx_processor(args.txWorkers, connection_pool, minio, scanner, args.bucket, args.untrustedFilesystemMount, args.scannerFilesystemMount, uploader)
 
     app = init_app()
     FlaskInstrumentor().instrument_app(app, excluded_urls="health")
 
-    init_params(connection_pool, minio, scanner, args.bucket, args.untrustedFilesystemMount, args.rawFilesystemMount, args.scannerFilesystemMount, auth_private_key, auth_public_key, auth_signer_cert, auth_signer_cn, auth_public_keys, args.authAudience)
+    init_params(connection_pool, minio, scanner, args.bucket, args.untrustedFilesystemMount, args.rawFilesystemMount, args.scannerFilesystemMount, auth_private_key, auth_public_key, auth_signer_cert, auth_signer_cn, auth_public_keys, args.authAudience, args.streamingIngest, uploader, tx_processor, delivery)
 
     if args.tlsKey:
         logging.info("Starting server in TLS mode - cert: {}, key: {}".format(args.tlsCert, args.tlsKey))
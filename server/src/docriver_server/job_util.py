@@ -0,0 +1,31 @@
+import threading
+import time
+
+# Helpers for the background maintenance jobs (see admin.py)
+
+class RateLimiter:
+    # Token bucket. acquire(count) blocks until count units of work are allowed. The bucket holds up to one second worth of units so that a job that was idle cannot burst. A rate of 0 disables the limit
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, count=1):
+        if self.rate <= 0 or count <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens = self.tokens - count
+            # A deficit is paid back by sleeping. The lock is held so that the other users of the limiter queue up behind
+            if self.tokens < 0:
+                time.sleep(-self.tokens / self.rate)
+
+def run_periodically(fn, interval, stop=None):
+    # Calls fn every interval seconds (measured from the end of the previous call) until stop (a threading.Event) is set. With an interval of 0, fn is called once
+    while True:
+        fn()
+        if interval <= 0 or (stop.wait(interval) if stop else time.sleep(interval)):
+            return
@@ -18,6 +18,13 @@ def init_measurements():
     global submit_docs_hist
     global submit_error_hist
     global submit_bytes_hist
+    global location_cache_counters
+    global token_cache_counters
+    global reclaimed_objects_counter
+    global reclaimed_bytes_counter
+    global pool_wait_hist
+    global pool_in_use_counter
+    global pool_timeouts_counter
     
     meter = metrics.get_meter('docriver-gateway')
     
@@ -28,6 +35,26 @@ def init_measurements():
     submit_docs_hist = meter.create_histogram(name="drg_sub_docs", description="number of documents submitted in a transaction", unit="1")
     submit_bytes_hist = meter.create_histogram(name="drg_sub_bytes", description="size of files submitted in a transaction", unit="byte")
     submit_error_hist = meter.create_histogram(name="drg_sub_errs", description="number of errors processing submit requests", unit="1")
+
+    location_cache_counters = {
+        'hit': meter.create_counter(name="drg_loc_cache_hits", description="number of document location lookups served from the cache", unit="1"),
+        'miss': meter.create_counter(name="drg_loc_cache_misses", description="number of document location lookups that went to the database", unit="1"),
+        'eviction': meter.create_counter(name="drg_loc_cache_evictions", description="number of document locations evicted from the cache (size or TTL)", unit="1"),
+        'invalidation': meter.create_counter(name="drg_loc_cache_invalidations", description="number of document locations invalidated by a new version, replacement or deletion", unit="1")
+    }
+
+    token_cache_counters = {
+        'hit': meter.create_counter(name="drg_token_cache_hits", description="number of authorization tokens whose verified claims were served from the cache", unit="1"),
+        'miss': meter.create_counter(name="drg_token_cache_misses", description="number of authorization tokens that had to be verified", unit="1"),
+        'eviction': meter.create_counter(name="drg_token_cache_evictions", description="number of verified tokens evicted from the cache (size, expiry or key change)", unit="1")
+    }
+
+    reclaimed_objects_counter = meter.create_counter(name="drg_reclaimed_objects", description="number of objects removed from the object store by the reclamation worker", unit="1")
+    reclaimed_bytes_counter = meter.create_counter(name="drg_reclaimed_bytes", description="storage reclaimed from the object store by the reclamation worker", unit="byte")
+
+    pool_wait_hist = meter.create_histogram(name="drg_db_pool_wait", description="time spent waiting for a database connection", unit="s")
+    pool_in_use_counter = meter.create_up_down_counter(name="drg_db_pool_in_use", description="number of database connections checked out of the pool", unit="1")
+    pool_timeouts_counter = meter.create_counter(name="drg_db_pool_timeouts", description="number of requests that did not get a database connection in time (or found the wait queue full)", unit="1")
     
 def increment_submit_requests(attributes = {}):
    submit_reqs_hist.record(1, attributes)
@@ -40,3 +67,22 @@ def record_submit_files_bytes(size, attributes={}):
     
 def increment_submit_errors(attributes = {}):
    submit_error_hist.record(1, attributes)
+
+def increment_location_cache(event, count=1):
+    location_cache_counters[event].add(count)
+
+def increment_token_cache(event, count=1):
+    token_cache_counters[event].add(count)
+
+def record_reclaimed(objects, size, attributes={}):
+    reclaimed_objects_counter.add(objects, attributes)
+    reclaimed_bytes_counter.add(size, attributes)
+
+def record_pool_wait(seconds, attributes={}):
+    pool_wait_hist.record(seconds, attributes)
+
+def add_pool_in_use(count, attributes={}):
+    pool_in_use_counter.add(count, attributes)
+
+def increment_pool_timeouts(attributes={}):
+    pool_timeouts_counter.add(1, attributes)
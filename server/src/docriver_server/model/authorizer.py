@@ -1,5 +1,6 @@
 from docriver_auth.auth_token import decode
 from docriver_auth.exceptions import AuthorizationException
+from model.policy import get_policy
 import re
 import logging
 
@@ -14,24 +15,25 @@ def authorize_submit(public_keys, token, audience, payload):
         payload['dr:principal'] = 'unknown'
         return auth, issuer
     try:
-        auth, issuer = validate_token_authorize_base(public_keys, token, audience, payload['dr:realm'])
+        auth, issuer, policy = validate_token_authorize_base(public_keys, token, audience, payload['dr:realm'])
 
-        raiseif('txType' not in auth['permissions'], 'txType not specified')
-        raiseif(auth['permissions']['txType'] != 'submit', 'transaction type invalid')
+        raiseif(policy.tx_type is None, 'txType not specified')
+        raiseif(policy.tx_type != 'submit', 'transaction type invalid')
 
-        raiseif('tx' in auth['permissions'] and auth['permissions']['tx'] != payload['tx'], 'tx invalid')
+        raiseif(policy.tx is not None and policy.tx != payload['tx'], 'tx invalid')
 
-        # TODO check if we can avoid the int conversion below
-        document_count =  int(auth['permissions']['documentCount']) if 'documentCount' in auth['permissions'] else 1
-        raiseif (document_count >= 0 and len(payload['documents']) > document_count, "Document count exceeds allowed")
+        raiseif(policy.document_count is None, 'documentCount invalid')
+        raiseif (policy.document_count >= 0 and len(payload['documents']) > policy.document_count, "Document count exceeds allowed")
 
+        # The references of the transaction apply to each of its documents, in addition to the document's own
+        tx_references = payload['references'] if 'references' in payload else []
+        all_references = list(tx_references)
         for document in payload['documents']:
-            all_references = payload['references'] if 'references' in payload else [] \
-                + document['references'] if 'references' in document else []
-            raiseif(len(all_references) == 0 and 'resourceType' in auth['permissions'], 'References are required')
-            for reference in all_references:
-                authorize_reference(auth, reference)
+            document_references = document['references'] if 'references' in document else []
+            raiseif(len(tx_references) + len(document_references) == 0 and policy.references_required(), 'References are required')
+            all_references.extend(document_references)
             # TODO add authorization on "type"
+        raiseif(not policy.allows_references(all_references), 'reference does not match')
 
         logging.getLogger('Authorization').info("Authorized transaction: {} - realm: {} subject: {}, issuer: {}".format(payload['tx'], payload['dr:realm'], auth['sub'], issuer))
 
@@ -48,13 +50,11 @@ def authorize_delete(public_keys, token, audience, payload):
         payload['dr:principal'] = 'unknown'
         return auth, issuer
     try:
-        auth, issuer = validate_token_authorize_base(public_keys, token, audience, payload['dr:realm'])
-        raiseif('txType' not in auth['permissions'], 'txType not specified')
-        raiseif(auth['permissions']['txType'] != 'delete', 'transaction type invalid')
+        auth, issuer, policy = validate_token_authorize_base(public_keys, token, audience, payload['dr:realm'])
+        raiseif(policy.tx_type is None, 'txType not specified')
+        raiseif(policy.tx_type != 'delete', 'transaction type invalid')
 
-        if 'document' in auth['permissions']:
-            for document in payload['documents']:
-                raiseif(not re.match(auth['permissions']['document'], document['document']), 'document name mismatch')
+        raiseif(not policy.allows_documents([document['document'] for document in payload['documents']]), 'document name mismatch')
 
         payload['dr:principal'] = auth['sub']
     except Exception as e:
@@ -72,16 +72,9 @@ def validate_token_authorize_base(public_keys, token, audience, realm):
     raiseif(issuer != realm and issuer != 'docriver', 'Invalid issuer')
     raiseif('permissions' not in auth, 'No permissions available')
 
-    raiseif('realm' in auth['permissions'] and not re.match(auth['permissions']['realm'], realm), "realm does not match")
-    return auth,issuer
-
-def authorize_reference(auth, reference):
-    if 'resourceType' in auth['permissions']:
-        # Resource type validation is needed
-        raiseif(not re.match(auth['permissions']['resourceType'], reference['resourceType']), "resourceType does not match")
-    if 'resourceId' in auth['permissions']:
-        # Resource ID validation is needed
-        raiseif(not re.match(auth['permissions']['resourceId'], reference['resourceId']), "resourceId does not match")
+    policy = get_policy(auth['permissions'])
+    raiseif(not policy.allows_realm(realm), "realm does not match")
+    return auth,issuer,policy
 
 def authorize_get_document(public_keys, token, audience, realm, document):
     auth = None 
@@ -89,9 +82,9 @@ def authorize_get_document(public_keys, token, audience, realm, document):
     if not public_keys:
         return 'unknown', auth, issuer
     try:
-        auth, issuer = validate_token_authorize_base(public_keys, token, audience, realm)
-        raiseif(auth['permissions']['txType'] != 'get-document', 'transaction type invalid')
-        raiseif(not re.match(auth['permissions']['document'], document), 'document name mismatch')
+        auth, issuer, policy = validate_token_authorize_base(public_keys, token, audience, realm)
+        raiseif(policy.tx_type != 'get-document', 'transaction type invalid')
+        raiseif(not policy.allows_documents([document], required=True), 'document name mismatch')
         return auth['sub'],auth,issuer
     except Exception as e:
         logging.getLogger('Authorization').warning("Authorization failure - issuer: {}, token: {}, exception: {}".format(issuer, auth, e))
@@ -103,8 +96,8 @@ def authorize_get_events(public_keys, token, audience, realm):
     if not public_keys:
         return 'unknown', auth, issuer
     try:
-        auth, issuer = validate_token_authorize_base(public_keys, token, audience, realm)
-        raiseif(auth['permissions']['txType'] != 'get-events', 'transaction type invalid')
+        auth, issuer, policy = validate_token_authorize_base(public_keys, token, audience, realm)
+        raiseif(policy.tx_type != 'get-events', 'transaction type invalid')
         return auth['sub'],auth,issuer
     except Exception as e:
         logging.getLogger('Authorization').warning("Authorization failure - issuer: {}, token: {}, exception: {}".format(issuer, auth, e))
@@ -0,0 +1,122 @@
+import collections
+import hashlib
+import logging
+import os
+import threading
+import uuid
+
+# Optional read-through cache of document contents on the local disk. The key is the object store location of a version, which is never overwritten, so the entries never need invalidation. The cache is bounded by the total size of the files and evicts the least recently used ones
+cache = None
+
+TMP_SUFFIX = '.tmp'
+
+class BodyCache:
+    def __init__(self, directory, max_bytes, max_object_size):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_object_size = max_object_size
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stats = {'hit': 0, 'miss': 0, 'fill': 0, 'eviction': 0}
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+
+    def load(self):
+        # Pick up the entries left by a previous run, oldest first. Partially filled files are discarded
+        files = []
+        for name in os.listdir(self.directory):
+            filename = os.path.join(self.directory, name)
+            if name.endswith(TMP_SUFFIX):
+                os.remove(filename)
+                continue
+            stat = os.stat(filename)
+            files.append((stat.st_atime, name, stat.st_size))
+        for atime, name, size in sorted(files):
+            self.entries[name] = size
+            self.size = self.size + size
+        with self.lock:
+            self.evict()
+
+    def filename(self, name):
+        return os.path.join(self.directory, name)
+
+    def open(self, location):
+        # Returns an open file for the cached contents or None. An entry evicted while it is open remains readable until it is closed
+        name = hashlib.sha256(location.encode('utf-8')).hexdigest()
+        with self.lock:
+            if name not in self.entries:
+                self.stats['miss'] = self.stats['miss'] + 1
+                return None
+            self.entries.move_to_end(name)
+            try:
+                stream = open(self.filename(name), 'rb')
+            except FileNotFoundError:
+                self.size = self.size - self.entries.pop(name)
+                self.stats['miss'] = self.stats['miss'] + 1
+                return None
+            self.stats['hit'] = self.stats['hit'] + 1
+            return stream
+
+    def cacheable(self, size):
+        return size is not None and size <= self.max_object_size
+
+    def read_through(self, location, size, chunks):
+        # Passes the chunks on to the requester while writing them to a temporary file. The entry is added only if the whole body was received; a disconnected client or a failed write just leaves it out
+        name = hashlib.sha256(location.encode('utf-8')).hexdigest()
+        tmp_filename = self.filename("{}-{}{}".format(name, uuid.uuid4().hex, TMP_SUFFIX))
+        out = open(tmp_filename, 'wb')
+        written = 0
+        complete = False
+        try:
+            for chunk in chunks:
+                if out:
+                    try:
+                        out.write(chunk)
+                        written = written + len(chunk)
+                    except OSError as e:
+                        logging.warning("Unable to write to the body cache: {}. Exception: {}".format(tmp_filename, e))
+                        out.close()
+                        out = None
+                yield chunk
+            complete = True
+        finally:
+            if out:
+                out.close()
+            if out and complete and written == size:
+                self.add(name, tmp_filename, size)
+            else:
+                os.remove(tmp_filename)
+
+    def add(self, name, tmp_filename, size):
+        with self.lock:
+            os.rename(tmp_filename, self.filename(name))
+            if name in self.entries:
+                self.size = self.size - self.entries.pop(name)
+            self.entries[name] = size
+            self.size = self.size + size
+            self.stats['fill'] = self.stats['fill'] + 1
+            self.evict()
+
+    def evict(self):
+        while self.size > self.max_bytes and self.entries:
+            name, size = self.entries.popitem(last=False)
+            self.size = self.size - size
+            self.stats['eviction'] = self.stats['eviction'] + 1
+            try:
+                os.remove(self.filename(name))
+            except FileNotFoundError:
+                pass
+
+def init_body_cache(directory, max_bytes, max_object_size):
+    global cache
+    cache = BodyCache(directory, max_bytes, max_object_size) if directory and max_bytes > 0 else None
+    return cache
+
+def open_cached_body(location):
+    return cache.open(location) if cache else None
+
+def read_through(location, size, chunks):
+    if cache and cache.cacheable(size):
+        return cache.read_through(location, size, chunks)
+    return chunks
@@ -1,8 +1,17 @@
-from flask import stream_with_context
+from flask import stream_with_context, Response
+from werkzeug.http import http_date, is_resource_modified
+from werkzeug.wsgi import wrap_file
+from datetime import timedelta
+import os
+import urllib.parse
+import uuid
 from dao.document import get_doc_location
 from exceptions import DocumentException
 from model.s3_url import parse_url
 from model.authorizer import authorize_get_document
+from model.location_cache import get_location
+from model.body_cache import open_cached_body, read_through
+from model.single_flight import coalesce
 from opentelemetry.trace import SpanKind
 from opentelemetry import trace
 
@@ -10,13 +19,20 @@ from trace_util import new_span, instrumented_connection
 
 import logging
 
-@stream_with_context
-def stream(minio, bucket, path):
-    span = trace.get_current_span()
-    span.set_attribute('path',path)
+# A request with more ranges than this is served in full (RFC 9110 allows a server to ignore the Range header)
+MAX_RANGES = 16
+
+# Objects up to this size are read once into memory and the buffer is shared by the concurrent requests for the same version. 0 disables it
+coalesce_max_object_size = 0
+
+def init_coalescing(max_object_size):
+    global coalesce_max_object_size
+    coalesce_max_object_size = max_object_size
+
+def read_object(minio, bucket, path, offset=0, length=0):
     response = None
     try:
-        response = minio.get_object(bucket, path)
+        response = minio.get_object(bucket, path, offset=offset, length=length)
         while True:
             chunk = response.read(amt=1024)
             if len(chunk) > 0:
@@ -24,31 +40,187 @@ def stream(minio, bucket, path):
             else:
                 return None
     finally:
-        response.close()
-        response.release_conn()
+        if response:
+            response.close()
+            response.release_conn()
+
+def read_file(stream, offset=0, length=0):
+    # Same semantics as read_object: a length of 0 means up to the end
+    stream.seek(offset)
+    remaining = length if length else -1
+    while remaining != 0:
+        chunk = stream.read(64*1024 if remaining < 0 else min(64*1024, remaining))
+        if not chunk:
+            return None
+        if remaining > 0:
+            remaining = remaining - len(chunk)
+        yield chunk
+
+def object_reader(minio, bucket, path):
+    return lambda offset=0, length=0: read_object(minio, bucket, path, offset, length)
+
+def file_reader(stream):
+    return lambda offset=0, length=0: read_file(stream, offset, length)
+
+def buffer_reader(buffer):
+    return lambda offset=0, length=0: iter([buffer[offset:offset+length] if length else buffer[offset:]])
+
+def read_shared_object(minio, bucket, path, location):
+    # One object store read for all the requests that arrive while it is in progress
+    return coalesce(('object', location), lambda: b''.join(read_object(minio, bucket, path)))
+
+@stream_with_context
+def stream(reader, path, offset=0, length=0, close=None, fill=None):
+    # fill, if specified, receives the chunks of a complete body on their way to the client (read-through cache)
+    span = trace.get_current_span()
+    span.set_attribute('path',path)
+    try:
+        chunks = reader(offset, length)
+        yield from fill(chunks) if fill else chunks
+    finally:
+        if close:
+            close()
 
-def stream_document(connection_pool, minio, bucket, realm, document, public_keys, audience, token):
+@stream_with_context
+def stream_ranges(reader, path, ranges, size, mime_type, boundary, close=None):
+    # multipart/byteranges body. Each part is read separately
     span = trace.get_current_span()
-    span.set_attribute('bucket',bucket)
-    
-    principal,auth,issuer = authorize_get_document(public_keys, token, audience, realm, document)    
-    logging.info("Received document request: {}/{}. Principal: {}".format(realm, document, principal))
-    span.set_attribute('principal', principal)
+    span.set_attributes({'path': path, 'numRanges': len(ranges)})
+    try:
+        for start, stop in ranges:
+            yield "--{}\r\nContent-Type: {}\r\nContent-Range: bytes {}-{}/{}\r\n\r\n".format(boundary, mime_type, start, stop-1, size).encode('utf-8')
+            yield from reader(start, stop-start)
+            yield b"\r\n"
+        yield "--{}--\r\n".format(boundary).encode('utf-8')
+    finally:
+        if close:
+            close()
+
+def format_etag(version_id, digest):
+    # Strong validator: the content digest when known, which stays the same across versions with identical content
+    return "sha256-{}".format(digest) if digest else "v{}".format(version_id)
+
+def satisfiable_ranges(request_range, size):
+    # Returns the list of (start, stop) byte ranges (stop is exclusive) that can be served, or None if the Range header is to be ignored
+    if not request_range or request_range.units != 'bytes' or len(request_range.ranges) > MAX_RANGES:
+        return None
+    ranges = []
+    for start, stop in request_range.ranges:
+        if start < 0:
+            # Suffix range: the last -start bytes
+            start = max(0, size + start)
+            stop = size
+        else:
+            stop = size if stop is None else min(stop, size)
+        if start < stop:
+            ranges.append((start, stop))
+    return ranges
+
+def if_range_matches(if_range, etag, last_modified):
+    # Without If-Range, or if the client still has the current representation, the range can be served. Otherwise the whole document is sent
+    if if_range.etag:
+        return if_range.etag == etag
+    if if_range.date:
+        return int(if_range.date.timestamp()) >= last_modified
+    return True
+
+def presigned_url(delivery, bucket, path, mime_type):
+    return delivery['presigner'].presigned_get_object(bucket, path, 
+        expires=timedelta(seconds=delivery['expires']), 
+        response_headers={'response-content-type': mime_type})
+
+def accel_redirect(delivery, bucket, path, mime_type, headers):
+    # nginx serves the bytes from an internal location that proxies the object store. The URL is presigned so that nginx does not need credentials
+    url = urllib.parse.urlsplit(presigned_url(delivery, bucket, path, mime_type))
+    headers.update({'X-Accel-Redirect': "{}{}?{}".format(delivery['accelPrefix'], url.path, url.query),
+                    'Content-Type': mime_type})
+    return '', 200, headers
 
+def presigned_redirect(delivery, bucket, path, mime_type, headers):
+    # The client fetches the bytes directly from the object store. The redirect must not be cached beyond the life of the URL
+    headers.update({'Location': presigned_url(delivery, bucket, path, mime_type), 'Cache-Control': 'no-store'})
+    return '', 307, headers
+
+def lookup_location(connection_pool, realm, document):
     connection = instrumented_connection(connection_pool.get_connection())
     cursor = None
     try:
         cursor = connection.cursor()
-        location, mime_type = get_doc_location(cursor, realm, document)
-        if not location:
-            raise DocumentException('Document not found')
-        bucket, path = parse_url(location)
-        with new_span('minio_get_object', kind=SpanKind.CLIENT, 
-                    attributes={'document': path, 'db.name': bucket, 'db.system': 'minio'}):
-            return stream(minio, bucket, path), 200, {'Content-Type': mime_type}
-        # return app.response_class(response.stream(), status=response.status, headers=response.getheaders().items())
+        return get_doc_location(cursor, realm, document)
     finally:
         if cursor:
             cursor.close()
         if connection.is_connected():
-            connection.close()
\ No newline at end of file
+            connection.close()
+
+def stream_document(connection_pool, minio, bucket, realm, document, public_keys, audience, token, request=None, delivery=None, fresh=False):
+    span = trace.get_current_span()
+    span.set_attribute('bucket',bucket)
+
+    principal,auth,issuer = authorize_get_document(public_keys, token, audience, realm, document)
+    logging.info("Received document request: {}/{}. Principal: {}".format(realm, document, principal))
+    span.set_attribute('principal', principal)
+
+    # Authorization is done per request (above); the lookup is shared by the concurrent requests for the same document (see get_location), unless fresh: a client that wrote recently reads from the primary, and neither a cached location nor a lookup shared with replica reads is guaranteed to include its write
+    location, mime_type, version_id, last_modified, size, digest, expires_at = get_location(realm, document, 
+        lambda: lookup_location(connection_pool, realm, document), fresh)
+
+    if not location:
+        raise DocumentException('Document not found')
+    bucket, path = parse_url(location)
+
+    etag = format_etag(version_id, digest)
+    headers = {'ETag': '"{}"'.format(etag), 'Last-Modified': http_date(int(last_modified))}
+    if request and not is_resource_modified(request.environ, etag=etag, last_modified=headers['Last-Modified']):
+        # Revalidation is answered from the metadata store alone
+        span.set_attribute('notModified', True)
+        return '', 304, headers
+
+    if delivery and delivery['mode'] == 'accel':
+        return accel_redirect(delivery, bucket, path, mime_type, headers)
+    if delivery and delivery['mode'] == 'presign':
+        return presigned_redirect(delivery, bucket, path, mime_type, headers)
+
+    cached = open_cached_body(location)
+    if cached:
+        span.set_attribute('bodyCache', 'hit')
+        return serve_body(request, file_reader(cached), path, os.fstat(cached.fileno()).st_size, mime_type, etag, last_modified, headers, cached)
+
+    with new_span('minio_get_object', kind=SpanKind.CLIENT,
+                attributes={'document': path, 'db.name': bucket, 'db.system': 'minio'}):
+        if size is None:
+            # Versions stored before the size was recorded
+            size = minio.stat_object(bucket, path).size
+        if size <= coalesce_max_object_size:
+            buffer = read_shared_object(minio, bucket, path, location)
+            return serve_body(request, buffer_reader(buffer), path, size, mime_type, etag, last_modified, headers, 
+                              fill=lambda chunks: read_through(location, size, chunks))
+        return serve_body(request, object_reader(minio, bucket, path), path, size, mime_type, etag, last_modified, headers, 
+                          fill=lambda chunks: read_through(location, size, chunks))
+
+def serve_body(request, reader, path, size, mime_type, etag, last_modified, headers, cached=None, fill=None):
+    # The contents come from either the object store or a file in the body cache (cached)
+    close = cached.close if cached else None
+    headers.update({'Accept-Ranges': 'bytes', 'Content-Type': mime_type})
+
+    ranges = None
+    if request and request.range and if_range_matches(request.if_range, etag, int(last_modified)):
+        ranges = satisfiable_ranges(request.range, size)
+    if ranges is None:
+        headers['Content-Length'] = str(size)
+        if cached and request:
+            # Lets the WSGI server use sendfile
+            return Response(wrap_file(request.environ, cached), 200, headers, direct_passthrough=True)
+        return stream(reader, path, close=close, fill=fill), 200, headers
+    if len(ranges) == 0:
+        if close:
+            close()
+        return '', 416, {'Content-Range': 'bytes */{}'.format(size)}
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        headers.update({'Content-Range': 'bytes {}-{}/{}'.format(start, stop-1, size), 'Content-Length': str(stop-start)})
+        return stream(reader, path, start, stop-start, close=close), 206, headers
+
+    boundary = uuid.uuid4().hex
+    headers['Content-Type'] = 'multipart/byteranges; boundary={}'.format(boundary)
+    return stream_ranges(reader, path, ranges, size, mime_type, boundary, close=close), 206, headers
@@ -0,0 +1,161 @@
+from flask import stream_with_context
+from opentelemetry import trace
+
+import json
+import logging
+import time
+
+import dao.tx as dao
+from exceptions import ValidationException
+from model.authorizer import authorize_get_events
+from model.notifier import listen, realm_key
+from trace_util import instrumented_connection
+
+# Change feed of the TX_EVENTs and DOC_EVENTs of a realm, after a resumable cursor. The subscribers wait on the realm's notifier key and only query the database when a transaction of the realm commits in this gateway instance (or every poll_interval seconds, if configured, to pick up the changes made by other instances)
+
+# Events are returned in ID order, but the IDs are allocated on insert, so a transaction can commit after one with a larger ID has been read. An event is only returned once it is older than settle_time seconds (this bounds how long a transaction can take between writing its events and committing); the feed stops at the first event that is not settled yet
+settle_time = 1
+poll_interval = 0
+
+BATCH_SIZE = 500
+# An idle SSE stream sends a comment this often so that proxies do not close it
+KEEPALIVE_SECONDS = 15
+# SSE streams are closed after this long to free the worker; the clients reconnect with the Last-Event-ID
+MAX_STREAM_SECONDS = 300
+
+def init_feed(_poll_interval, _settle_time):
+    global poll_interval
+    global settle_time
+    poll_interval = _poll_interval
+    settle_time = _settle_time
+
+def format_feed_cursor(position):
+    return "{}.{}".format(*position)
+
+def parse_feed_cursor(cursor):
+    try:
+        tx_event_id, doc_event_id = cursor.split('.')
+        return int(tx_event_id), int(doc_event_id)
+    except ValueError:
+        raise ValidationException('Invalid cursor: {}'.format(cursor))
+
+def format_tx_event(row, position):
+    return {'source': 'tx',
+            'eventTime': int(row[1].strftime('%s')),
+            'tx': row[2],
+            'event': row[3],
+            'status': row[4],
+            'description': row[5],
+            'cursor': format_feed_cursor(position)}
+
+def format_doc_event(row, position):
+    return {'source': 'document',
+            'eventTime': int(row[1].strftime('%s')),
+            'tx': row[2],
+            'document': row[3],
+            'status': row[4],
+            'description': row[5],
+            'location': row[6],
+            'type': row[7],
+            'mime': row[8],
+            'cursor': format_feed_cursor(position)}
+
+def with_connection(connection_pool, fn):
+    connection = instrumented_connection(connection_pool.get_connection())
+    cursor = None
+    try:
+        cursor = connection.cursor()
+        return fn(cursor)
+    finally:
+        if cursor:
+            cursor.close()
+        if connection.is_connected():
+            connection.close()
+
+def read_feed(connection_pool, realm, position):
+    # Returns the settled events after position, the new position and whether there are events that are not settled yet
+    def read(cursor):
+        return (dao.get_feed_tx_events(cursor, realm, position[0], settle_time, BATCH_SIZE),
+                dao.get_feed_doc_events(cursor, realm, position[1], settle_time, BATCH_SIZE))
+    tx_rows, doc_rows = with_connection(connection_pool, read)
+
+    events = []
+    pending = False
+    tx_event_id, doc_event_id = position
+    for row in tx_rows:
+        if not row[6]:
+            pending = True
+            break
+        tx_event_id = row[0]
+        events.append(format_tx_event(row, (tx_event_id, doc_event_id)))
+    for row in doc_rows:
+        if not row[9]:
+            pending = True
+            break
+        doc_event_id = row[0]
+        events.append(format_doc_event(row, (tx_event_id, doc_event_id)))
+    return events, (tx_event_id, doc_event_id), pending
+
+def next_events(connection_pool, realm, position, listener, timeout, check=True):
+    # Returns the events after position as soon as there are any, or none after timeout seconds. Also returns whether the database has to be checked right away on the next call (more events or events not settled yet). With check=False, the database is not queried until notified
+    deadline = time.time() + timeout
+    pending = False
+    while True:
+        if check:
+            events, position, pending = read_feed(connection_pool, realm, position)
+            if events:
+                return events, position, True
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return [], position, pending
+        wait = remaining
+        if pending:
+            wait = min(wait, settle_time)
+        if poll_interval:
+            wait = min(wait, poll_interval)
+        # Without a notification, the database is checked again only if the wait was cut short to settle events or poll
+        check = listener.wait(wait) or wait < remaining
+
+def start_position(connection_pool, cursor):
+    # Without a cursor, the feed starts with the events that happen from now on
+    return parse_feed_cursor(cursor) if cursor else tuple(with_connection(connection_pool, dao.get_feed_position))
+
+def authorize_feed(realm, token, public_keys, audience):
+    span = trace.get_current_span()
+    span.set_attribute('realm', realm)
+    principal,auth,issuer = authorize_get_events(public_keys, token, audience, realm)
+    logging.info("Received change feed request for: {}. Principal: {}".format(realm, principal))
+    span.set_attribute('principal', principal)
+
+def get_feed(realm, connection_pool, token, public_keys, audience, cursor=None, timeout=0):
+    # Long-poll: waits up to timeout seconds for events after the cursor. "next" is the cursor for the next call
+    authorize_feed(realm, token, public_keys, audience)
+    with listen(realm_key(realm)) as listener:
+        position = start_position(connection_pool, cursor)
+        events, position, pending = next_events(connection_pool, realm, position, listener, timeout)
+    trace.get_current_span().set_attribute('numEvents', len(events))
+    return {'events': events, 'next': format_feed_cursor(position)}
+
+@stream_with_context
+def stream_events(connection_pool, realm, position):
+    # Server-Sent Events. The id of each message is the cursor to resume from (sent back by the browser as Last-Event-ID on reconnection)
+    end = time.time() + MAX_STREAM_SECONDS
+    with listen(realm_key(realm)) as listener:
+        # An id-only message: sets the Last-Event-ID so that a reconnection before the first event does not skip the events in between
+        yield "retry: 1000\nid: {}\n\n".format(format_feed_cursor(position))
+        check = True
+        while True:
+            remaining = end - time.time()
+            if remaining <= 0:
+                return
+            # An idle subscriber does not query the database until notified
+            events, position, check = next_events(connection_pool, realm, position, listener, min(KEEPALIVE_SECONDS, remaining), check)
+            if not events:
+                yield ": keepalive\n\n"
+            for event in events:
+                yield "id: {}\nevent: {}\ndata: {}\n\n".format(event['cursor'], event['source'], json.dumps(event))
+
+def stream_feed(realm, connection_pool, token, public_keys, audience, cursor=None):
+    # The authorization and the starting position are done before the response starts so that errors are reported with the right status
+    authorize_feed(realm, token, public_keys, audience)
+    return stream_events(connection_pool, realm, start_position(connection_pool, cursor))
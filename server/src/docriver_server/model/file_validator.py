@@ -9,6 +9,21 @@ from opentelemetry.trace import Status, StatusCode, SpanKind
 from exceptions import ValidationException
 from trace_util import new_span
 
+def validate_magic(principal, file, ext, mime_type, content):
+    info = fleep.get(content)
+    if not info.extension_matches(ext[1:]):
+        logging.getLogger("Integrity").warning("Extension mismatch in file: {}. Expected: {}, found:{}, principal: {}".format(file, ext, info.extension, principal))
+        raise ValidationException("Extension mismatch in file: {}. Expected: {}, found:{}".format(file, ext, info.extension))
+    if not info.mime_matches(mime_type):
+        logging.getLogger("Integrity").warning("Magic mismatch in file: {}. Expected: {}, found:{}, principal: {}".format(file, mime_type, info.mime, principal))
+        raise ValidationException("Magic mismatch in file: {}. Expected: {}, found:{}".format(file, mime_type, info.mime))
+
+def validate_scan_result(principal, result):
+    for kv in result.items():
+        if kv[1][0] != 'OK':
+            logging.getLogger("Integrity").warning("Integrity check failed on file {}. Error: {}, principal: {}".format(kv[0], kv[1], principal))
+            raise ValidationException("Virus check failed on file: {}. Error: {}".format(kv[0], kv[1]))
+
 def validate_documents(principal, scanner, scan_file_mount, stage_dir, filename_mime_dict):
     with new_span('validate_document'):
         with new_span("validate_document_extensions"):
@@ -20,27 +35,12 @@ def validate_documents(principal, scanner, scan_file_mount, stage_dir, filename_
                         continue
                     # For binary files, use magic to detect file types
                     with open(full_path, 'rb') as stream:
-                        ext = pathlib.Path(full_path).suffix
-                        content = stream.read(128)
-                        info = fleep.get(content)
-                        if not info.extension_matches(ext[1:]):
-                            logging.getLogger("Integrity").warning("Extension mismatch in file: {}. Expected: {}, found:{}, principal: {}".format(file, ext, info.extension, principal))
-                            raise ValidationException("Extension mismatch in file: {}. Expected: {}, found:{}".format(file, ext, info.extension))
-                        if not info.mime_matches(filename_mime_dict[full_path]):
-                            logging.getLogger("Integrity").warning("Magic mismatch in file: {}. Expected: {}, found:{}, principal: {}".format(file, filename_mime_dict[full_path], info.mime, principal))
-                            raise ValidationException("Magic mismatch in file: {}. Expected: {}, found:{}".format(file, filename_mime_dict[full_path], info.mime))
-                        # print('Type:', info.type)
-                        # print('File extension:', info.extension[0])
-                        # print('MIME type:', info.mime[0])
+                        validate_magic(principal, file, pathlib.Path(full_path).suffix, filename_mime_dict[full_path], stream.read(128))
 
         with new_span("scan_documents", kind=SpanKind.CLIENT, 
                                     attributes={'rpc.system': 'clamav', 'rpc.service': scanner.host}) as span:
             # This assumes that the staging area is created just below the untrusted filesystem mount
-            result = scanner.scan(join(scan_file_mount, pathlib.Path(stage_dir).name))
-            for kv in result.items():
-                if kv[1][0] != 'OK':
-                    logging.getLogger("Integrity").warning("Integrity check failed on file {}. Error: {}, principal: {}".format(kv[0], kv[1], principal))
-                    raise ValidationException("Virus check failed on file: {}. Error: {}".format(kv[0], kv[1]))
+            validate_scan_result(principal, scanner.scan(join(scan_file_mount, pathlib.Path(stage_dir).name)))
         
     # TODO this code is temporary
     # command="""
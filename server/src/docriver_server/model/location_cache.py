@@ -0,0 +1,88 @@
+import collections
+import threading
+import time
+
+from metrics_util import increment_location_cache
+from model.single_flight import coalesce
+
+# In-process LRU cache of the current location (and the rest of get_doc_location) of documents, keyed by (realm, document). Only documents that exist are cached, until the TTL or the expiry of the document (the last element of the value), whichever comes first; a cached entry can only become stale through a new version, a replacement or a deletion, which invalidate it. Other gateway instances are not told about the invalidations, so the TTL bounds how long they can serve a stale location
+cache = None
+
+# Without the cache, the concurrent lookups of a document are still shared, but only within a generation of the document, bumped by every invalidation of it. The generations are striped over a fixed number of counters so that they take bounded memory: an invalidation also bumps the documents that share the counter, which only means less sharing
+GENERATION_STRIPES = 4096
+generations = [0] * GENERATION_STRIPES
+generations_lock = threading.Lock()
+
+def generation_stripe(realm, document):
+    return hash((realm, document)) % GENERATION_STRIPES
+
+class LocationCache:
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        # Bumped on every invalidation. A value loaded from the database is only cached if no invalidation happened while it was being loaded
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.stats = {'hit': 0, 'miss': 0, 'eviction': 0, 'invalidation': 0}
+
+    def count(self, event, count=1):
+        self.stats[event] = self.stats[event] + count
+        increment_location_cache(event, count)
+
+    def get(self, key, loader):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry:
+                if entry[0] > time.time():
+                    self.entries.move_to_end(key)
+                    self.count('hit')
+                    return entry[1]
+                del self.entries[key]
+                self.count('eviction')
+            self.count('miss')
+            generation = self.generation
+
+        # Concurrent misses share the lookup, but only within a generation: a lookup that started before an invalidation is not handed to the requests that arrived after it
+        value = coalesce(('location', key, generation), loader)
+
+        with self.lock:
+            if value[0] and generation == self.generation:
+                expires = time.time() + self.ttl
+                if value[-1] is not None:
+                    expires = min(expires, value[-1])
+                self.entries[key] = (expires, value)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+                    self.count('eviction')
+        return value
+
+    def invalidate(self, keys):
+        with self.lock:
+            self.generation = self.generation + 1
+            for key in keys:
+                if self.entries.pop(key, None):
+                    self.count('invalidation')
+
+def init_location_cache(max_entries, ttl):
+    global cache
+    cache = LocationCache(max_entries, ttl) if max_entries > 0 and ttl > 0 else None
+    return cache
+
+def get_location(realm, document, loader, fresh=False):
+    if fresh:
+        return loader()
+    if not cache:
+        return coalesce(('location', realm, document, generations[generation_stripe(realm, document)]), loader)
+    return cache.get((realm, document), loader)
+
+def invalidate_locations(realm, documents):
+    if not documents:
+        return
+    with generations_lock:
+        for document in documents:
+            stripe = generation_stripe(realm, document)
+            generations[stripe] = generations[stripe] + 1
+    if cache:
+        cache.invalidate([(realm, document) for document in documents])
@@ -0,0 +1,45 @@
+import threading
+from contextlib import contextmanager
+
+# In-process wake-ups for the requests that long-poll a transaction or follow the change feed of a realm. Only the listeners registered for a key are tracked, so the registry does not grow with the number of transactions. Changes made by other gateway instances are not notified; the waiters pick them up by re-checking the database periodically
+lock = threading.Lock()
+listeners = {}
+
+class Listener:
+    def __init__(self):
+        self.event = threading.Event()
+
+    def wait(self, timeout):
+        notified = self.event.wait(timeout)
+        self.event.clear()
+        return notified
+
+@contextmanager
+def listen(key):
+    # Register before checking the current state so that a change between the check and the wait is not lost
+    listener = Listener()
+    with lock:
+        listeners.setdefault(key, set()).add(listener)
+    try:
+        yield listener
+    finally:
+        with lock:
+            listeners[key].discard(listener)
+            if not listeners[key]:
+                del listeners[key]
+
+def notify(key):
+    with lock:
+        for listener in listeners.get(key, []):
+            listener.event.set()
+
+def tx_key(realm, tx):
+    return 'tx:{}/{}'.format(realm, tx)
+
+def realm_key(realm):
+    return 'realm:{}'.format(realm)
+
+def notify_tx(realm, tx):
+    # Called after a transaction commits: wakes up the requests waiting on the transaction and the change feed subscribers of the realm
+    notify(tx_key(realm, tx))
+    notify(realm_key(realm))
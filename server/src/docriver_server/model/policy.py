@@ -0,0 +1,79 @@
+import collections
+import hashlib
+import json
+import re
+import threading
+
+# The permissions claim of a token compiled into an immutable matcher: the patterns are compiled once per distinct permissions (shared by the tokens issued for the same grant) instead of on every match. As before, the patterns are matched at the start of the value (re.match)
+
+# Upper bound of the number of compiled policies kept
+MAX_POLICIES = 10000
+
+def compile_pattern(pattern):
+    return re.compile(pattern) if pattern is not None else None
+
+class Policy(collections.namedtuple('Policy', ['tx_type', 'tx', 'document_count', 'realm', 'document', 'resource_type', 'resource_id'])):
+    __slots__ = ()
+
+    def allows_realm(self, realm):
+        return not self.realm or self.realm.match(realm) is not None
+
+    def allows_documents(self, documents, required=False):
+        # Without a document pattern, any document is allowed unless required
+        if not self.document:
+            return not required
+        match = self.document.match
+        return all([match(document) for document in documents])
+
+    def references_required(self):
+        return self.resource_type is not None
+
+    def allows_references(self, references):
+        # One pass over the distinct values: the references of a transaction repeat the same few resource types (and often ids) across documents
+        if self.resource_type:
+            match = self.resource_type.match
+            if not all([match(value) for value in set([reference['resourceType'] for reference in references])]):
+                return False
+        if self.resource_id:
+            match = self.resource_id.match
+            if not all([match(value) for value in set([reference['resourceId'] for reference in references])]):
+                return False
+        return True
+
+def document_count(permissions):
+    # None if invalid
+    try:
+        return int(permissions['documentCount']) if 'documentCount' in permissions else 1
+    except (TypeError, ValueError):
+        return None
+
+def compile_policy(permissions):
+    return Policy(permissions.get('txType'),
+                  permissions.get('tx'),
+                  document_count(permissions),
+                  compile_pattern(permissions.get('realm')),
+                  compile_pattern(permissions.get('document')),
+                  compile_pattern(permissions.get('resourceType')),
+                  compile_pattern(permissions.get('resourceId')))
+
+lock = threading.Lock()
+# Digest of the canonical JSON of the permissions -> policy. Keyed by value rather than by the claims object, which is a new one for every request when the token cache is disabled
+policies = collections.OrderedDict()
+
+def policy_key(permissions):
+    return hashlib.sha256(json.dumps(permissions, sort_keys=True).encode('utf-8')).digest()
+
+def get_policy(permissions):
+    key = policy_key(permissions)
+    with lock:
+        policy = policies.get(key)
+        if policy is not None:
+            policies.move_to_end(key)
+            return policy
+    policy = compile_policy(permissions)
+    with lock:
+        policies[key] = policy
+        policies.move_to_end(key)
+        while len(policies) > MAX_POLICIES:
+            policies.popitem(last=False)
+    return policy
@@ -0,0 +1,155 @@
+import logging
+import time
+
+from dao.realm import REALM_TABLES, get_realm_rows, insert_row, set_doc_state, count_realm_rows, count_pending_txs, delete_realm_events, delete_realm_rows
+from shard_router import DEFAULT_SHARD, load_shard_map, save_shard_map
+
+# Moves the metadata of a realm to another shard while the gateways keep running (see "admin.py move-realm"). The objects stay where they are.
+# 1. The realm is marked as moving in the shard map: once the gateways have reloaded the map (wait), its writes are rejected with 503 while its reads keep going to the source. The move is refused if the realm has asynchronous transactions that are not completed: their workers write to the source (they retry while the realm is moving)
+# 2. The rows are copied to the target and the counts are compared
+# 3. The realm is assigned to the target in the map. After another wait, no gateway reads from the source any more and the source rows are deleted
+# The rows get new IDs in the target, so the change feed cursors of the realm have to be reset by the feed consumers
+
+def copy_realm(source, target, realm, batch_size):
+    # Copies the realm's rows from the source connection to the target connection, committing every batch. Returns {table: rows}
+    source_cursor = source.cursor()
+    target_cursor = target.cursor()
+    ids = {table: {} for table, join, references in REALM_TABLES}
+    doc_states = []
+    counts = {}
+    try:
+        for table, join, references in REALM_TABLES:
+            after = 0
+            while True:
+                columns, rows = get_realm_rows(source_cursor, table, join, realm, after, batch_size)
+                if not rows:
+                    break
+                id_index = columns.index('ID')
+                for row in rows:
+                    values = dict(zip(columns, row))
+                    for column, referenced in references.items():
+                        if values[column] is not None:
+                            # A reference outside the realm (should not happen) is dropped rather than pointing to an unrelated row of the target
+                            values[column] = ids[referenced].get(values[column])
+                    if table == 'DOC':
+                        doc_states.append((values['ID'], values['VERSION_ID'], values['EVENT_ID']))
+                        values['VERSION_ID'] = None
+                        values['EVENT_ID'] = None
+                    new_columns = [column for column in columns if column != 'ID']
+                    ids[table][row[id_index]] = insert_row(target_cursor, table, new_columns, [values[column] for column in new_columns])
+                target.commit()
+                after = rows[-1][id_index]
+            counts[table] = len(ids[table])
+            logging.info("Copied {} rows of {}".format(counts[table], table))
+
+        states = [(ids['DOC_VERSION'].get(version_id), ids['DOC_EVENT'].get(event_id), ids['DOC'][doc_id])
+                  for doc_id, version_id, event_id in doc_states]
+        for start in range(0, len(states), batch_size):
+            set_doc_state(target_cursor, states[start:start + batch_size])
+            target.commit()
+        return counts
+    except Exception as e:
+        target.rollback()
+        raise e
+    finally:
+        source_cursor.close()
+        target_cursor.close()
+
+def count_realm(connection, realm):
+    cursor = connection.cursor()
+    try:
+        return {table: count_realm_rows(cursor, table, join, realm) for table, join, references in REALM_TABLES}
+    finally:
+        cursor.close()
+
+def pending_txs(connection, realm):
+    cursor = connection.cursor()
+    try:
+        return count_pending_txs(cursor, realm)
+    finally:
+        cursor.close()
+        # Ends the read snapshot, so that the next reads see the commits made since
+        connection.rollback()
+
+def delete_realm(connection, realm, batch_size):
+    # In batches, so that the locks are held briefly. Returns the number of rows deleted, not counting the cascades
+    cursor = connection.cursor()
+    deleted = 0
+    try:
+        while True:
+            count = delete_realm_events(cursor, realm, batch_size)
+            connection.commit()
+            deleted = deleted + count
+            if not count:
+                break
+        for table in ['DOC', 'DOC_CONTENT', 'TX']:
+            while True:
+                count = delete_realm_rows(cursor, table, realm, batch_size)
+                connection.commit()
+                deleted = deleted + count
+                if not count:
+                    break
+        return deleted
+    except Exception as e:
+        connection.rollback()
+        raise e
+    finally:
+        cursor.close()
+
+def move_realm(map_file, realm, target_shard, connect, wait, batch_size):
+    # connect(shard) returns a new connection to the shard. wait is the number of seconds for the gateways to pick up a change of the map (their reload interval plus the longest write transaction)
+    shard_map = load_shard_map(map_file)
+    source_shard = shard_map.get('realms', {}).get(realm, DEFAULT_SHARD)
+    if source_shard == target_shard:
+        raise ValueError("Realm {} is already in shard {}".format(realm, target_shard))
+    if target_shard != DEFAULT_SHARD and target_shard not in shard_map.get('shards', {}):
+        raise ValueError("Unknown shard: {}".format(target_shard))
+
+    source = connect(source_shard)
+    target = connect(target_shard)
+    try:
+        if any(count_realm(target, realm).values()):
+            raise ValueError("Shard {} has rows of realm {} already. Remove them first".format(target_shard, realm))
+        pending = pending_txs(source, realm)
+        if pending:
+            raise ValueError("Realm {} has {} pending transactions. Try again later".format(realm, pending))
+
+        shard_map.setdefault('moving', {})[realm] = target_shard
+        save_shard_map(map_file, shard_map)
+        logging.info("Realm {} is read-only. Waiting {}s for the gateways".format(realm, wait))
+        time.sleep(wait)
+
+        # Accepted before the gateways stopped the writes
+        pending = pending_txs(source, realm)
+        if pending:
+            del shard_map['moving'][realm]
+            save_shard_map(map_file, shard_map)
+            raise ValueError("Realm {} has {} pending transactions. Try again later".format(realm, pending))
+
+        try:
+            copied = copy_realm(source, target, realm, batch_size)
+            expected = count_realm(source, realm)
+            if copied != expected:
+                raise Exception("Copy of realm {} is incomplete. Expected: {}, copied: {}".format(realm, expected, copied))
+        except Exception as e:
+            logging.error("Move failed, removing the partial copy and restoring the shard map")
+            delete_realm(target, realm, batch_size)
+            del shard_map['moving'][realm]
+            save_shard_map(map_file, shard_map)
+            raise e
+
+        del shard_map['moving'][realm]
+        if target_shard == DEFAULT_SHARD:
+            del shard_map['realms'][realm]
+        else:
+            shard_map.setdefault('realms', {})[realm] = target_shard
+        save_shard_map(map_file, shard_map)
+        logging.info("Realm {} moved to shard {}. Waiting {}s before removing it from shard {}".format(realm, target_shard, wait, source_shard))
+        time.sleep(wait)
+
+        deleted = delete_realm(source, realm, batch_size)
+        logging.info("Removed {} rows of realm {} from shard {}".format(deleted, realm, source_shard))
+        return copied
+    finally:
+        source.close()
+        target.close()
@@ -0,0 +1,166 @@
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+
+from minio.error import S3Error
+
+from dao.document import lock_reclaimable_versions, mark_versions_reclaimed, get_referenced_locations
+from dao.content import release_contents, get_content_locations
+from model.retention import remove_objects
+from model.s3_url import parse_url, format_url
+from job_util import RateLimiter, run_periodically
+from metrics_util import record_reclaimed
+from trace_util import instrumented_connection
+from shard_router import ShardRouter, realm_pool
+
+class Reclaimer:
+    # Background worker that frees the object store space that is no longer needed:
+    # - the objects of the versions of documents deleted or replaced more than grace_period seconds ago, and of the versions superseded by a new version (of the same document) that long ago. Only the current version of a document is served. The versions are marked (RECLAIMED_AT), content shared with live versions is kept
+    # - orphaned objects: objects older than grace_period that no metadata row points to, such as the leftovers of failed transactions. The grace period also covers the objects of transactions that have not committed yet
+    # The I/O (rows, object listings, stats and deletes) is paced by the rate limiter and the bucket listing is walked a bounded number of objects per run, resuming where the previous run stopped
+    def __init__(self, connection_pool, minio, bucket, grace_period, rate, batch_size=100, scan_limit=10000):
+        self.connection_pool = connection_pool
+        self.minio = minio
+        self.bucket = bucket
+        self.grace_period = grace_period
+        self.batch_size = batch_size
+        self.scan_limit = scan_limit
+        self.limiter = RateLimiter(rate)
+        # Orphan scan position: the last object name checked
+        self.scan_after = None
+        self.stats = {'versions': 0, 'objects': 0, 'bytes': 0}
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self, interval):
+        self.thread = threading.Thread(target=run_periodically, args=(self.run, interval, self.stop_event), name='reclaimer', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            self.reclaim_versions()
+            self.reclaim_orphans()
+        except Exception as e:
+            logging.error("Reclamation failed. Exception: {}".format(e), exc_info=True)
+
+    def stat_size(self, location):
+        self.limiter.acquire()
+        bucket, path = parse_url(location)
+        try:
+            return self.minio.stat_object(bucket, path).size
+        except S3Error as e:
+            # Already gone
+            return 0
+
+    def remove(self, objects, kind):
+        # objects is a list of (location, size). Unknown sizes (versions written before content addressing) are looked up
+        if not objects:
+            return
+        sizes = {location: size if size is not None else self.stat_size(location) for location, size in objects}
+        self.limiter.acquire(len(sizes))
+        removed = remove_objects(self.minio, list(sizes.keys()))
+        size = sum([sizes[location] for location in removed])
+        self.stats['objects'] = self.stats['objects'] + len(removed)
+        self.stats['bytes'] = self.stats['bytes'] + size
+        record_reclaimed(len(removed), size, {'kind': kind})
+        logging.info("Reclaimed {} {} object(s), {} bytes".format(len(removed), kind, size))
+
+    def shard_pools(self):
+        return list(self.connection_pool.pools.values()) if isinstance(self.connection_pool, ShardRouter) else [self.connection_pool]
+
+    def reclaim_batch(self, connection_pool):
+        # Returns the number of versions reclaimed
+        connection = instrumented_connection(connection_pool.get_connection())
+        cursor = None
+        try:
+            cursor = connection.cursor()
+            versions = lock_reclaimable_versions(cursor, self.grace_period, self.batch_size)
+            if not versions:
+                connection.rollback()
+                return 0
+            objects = release_contents(cursor, [version[1] for version in versions if version[1]])
+            legacy_locations = list(set([version[2] for version in versions if not version[1] and version[2]]))
+            mark_versions_reclaimed(cursor, [version[0] for version in versions])
+            referenced = get_referenced_locations(cursor, legacy_locations)
+            objects.extend([(location, None) for location in legacy_locations if location not in referenced])
+            connection.commit()
+        except Exception as e:
+            connection.rollback()
+            raise e
+        finally:
+            if cursor:
+                cursor.close()
+            if connection.is_connected():
+                connection.close()
+        # After the commit; an object that fails to be removed is picked up by the orphan scan
+        self.remove(objects, 'version')
+        self.stats['versions'] = self.stats['versions'] + len(versions)
+        return len(versions)
+
+    def reclaim_versions(self):
+        for connection_pool in self.shard_pools():
+            if self.stop_event.is_set():
+                return
+            while True:
+                self.limiter.acquire(self.batch_size)
+                if self.reclaim_batch(connection_pool) < self.batch_size or self.stop_event.is_set():
+                    break
+
+    def unreferenced(self, locations):
+        # The object paths start with the realm. Each realm's references are looked up in its shard
+        by_realm = {}
+        for location in locations:
+            by_realm.setdefault(parse_url(location)[1].split('/')[0], []).append(location)
+        unreferenced = []
+        for realm, realm_locations in by_realm.items():
+            unreferenced.extend(self.unreferenced_in(realm_pool(self.connection_pool, realm), realm_locations))
+        return unreferenced
+
+    def unreferenced_in(self, connection_pool, locations):
+        connection = instrumented_connection(connection_pool.get_connection())
+        cursor = None
+        try:
+            cursor = connection.cursor()
+            referenced = get_referenced_locations(cursor, locations) | get_content_locations(cursor, locations)
+            return [location for location in locations if location not in referenced]
+        finally:
+            if cursor:
+                cursor.close()
+            if connection.is_connected():
+                connection.close()
+
+    def check_orphans(self, candidates):
+        # candidates is a list of (location, size)
+        if not candidates:
+            return
+        self.limiter.acquire(len(candidates))
+        orphans = set(self.unreferenced([location for location, size in candidates]))
+        self.remove([(location, size) for location, size in candidates if location in orphans], 'orphan')
+
+    def reclaim_orphans(self):
+        # The bucket listing is in name order, so the scan can resume after the last name checked
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.grace_period)
+        scanned = 0
+        candidates = []
+        for obj in self.minio.list_objects(self.bucket, recursive=True, start_after=self.scan_after):
+            if scanned % self.batch_size == 0:
+                # The listing itself is paged I/O
+                self.limiter.acquire(self.batch_size)
+            scanned = scanned + 1
+            if obj.last_modified and obj.last_modified <= cutoff:
+                candidates.append((format_url(self.bucket, obj.object_name), obj.size))
+            if len(candidates) >= self.batch_size:
+                self.check_orphans(candidates)
+                candidates = []
+            self.scan_after = obj.object_name
+            if scanned >= self.scan_limit or self.stop_event.is_set():
+                self.check_orphans(candidates)
+                return
+        self.check_orphans(candidates)
+        # Start over on the next run
+        self.scan_after = None
+
+    def shutdown(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
@@ -0,0 +1,136 @@
+from datetime import date
+import logging
+import time
+
+from minio.deleteobjects import DeleteObject
+import mysql.connector
+from mysql.connector import errorcode
+
+from dao.document import lock_expired_docs, get_versions_of_docs, get_referenced_locations, delete_docs
+from dao.content import release_contents
+from dao.partition import get_partitions, to_days, split_last_partition, drop_partitions
+from model.s3_url import parse_url, format_url
+
+PARTITIONED_TABLES = ['TX_EVENT', 'DOC_EVENT']
+
+# Upper bound of the number of keys in a MinIO multi-object delete request
+MAX_REMOVE_OBJECTS = 1000
+
+def add_months(day, months):
+    # First day of the month, months after the month of day
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+def partition_name(day):
+    # Named after the month it holds (its upper bound is the first day of the next month)
+    return "p{:04d}{:02d}".format(day.year, day.month)
+
+def rollover_partitions(connection, months_ahead, retain_months=0, today=None):
+    # Adds monthly partitions up to months_ahead months from now, so that the MAXVALUE partition stays empty and splitting it is cheap. With retain_months, drops the partitions (and with them the events) older than that. Returns {table: (added, dropped)}
+    today = today if today else date.today()
+    cursor = connection.cursor()
+    result = {}
+    try:
+        # Checked for all the tables before any is changed
+        all_partitions = {table: get_partitions(cursor, table) for table in PARTITIONED_TABLES}
+        for table, partitions in all_partitions.items():
+            if not partitions or partitions[-1][1] is not None:
+                raise Exception("Table {} is not partitioned by range with a MAXVALUE partition. If the database was created with an earlier gateway-init.sql, upgrade it with infrastructure/mysql/migrations/002-partition-events.sql".format(table))
+        for table in PARTITIONED_TABLES:
+            partitions = all_partitions[table]
+            last_bound = partitions[-2][1] if len(partitions) > 1 else 0
+            added = []
+            for months in range(1, months_ahead + 2):
+                bound = add_months(today, months)
+                if to_days(cursor, bound) > last_bound:
+                    added.append((partition_name(add_months(today, months - 1)), bound))
+            if added:
+                split_last_partition(cursor, table, partitions[-1][0], added)
+
+            dropped = []
+            if retain_months > 0:
+                oldest = to_days(cursor, add_months(today, -retain_months))
+                dropped = [name for name, bound in partitions[:-1] if bound <= oldest]
+                if dropped:
+                    drop_partitions(cursor, table, dropped)
+            logging.info("Partitions of {}. Added: {}, dropped: {}".format(table, [name for name, bound in added], dropped))
+            result[table] = ([name for name, bound in added], dropped)
+        return result
+    finally:
+        cursor.close()
+
+def remove_objects(minio, locations):
+    # Bulk delete, grouped by bucket. Returns the locations removed. Failures are logged, the objects are left behind for the reclamation of orphaned objects
+    by_bucket = {}
+    for location in locations:
+        bucket, path = parse_url(location)
+        by_bucket.setdefault(bucket, []).append(path)
+    removed = []
+    for bucket, paths in by_bucket.items():
+        for start in range(0, len(paths), MAX_REMOVE_OBJECTS):
+            batch = paths[start:start + MAX_REMOVE_OBJECTS]
+            failed = set()
+            for error in minio.remove_objects(bucket, [DeleteObject(path) for path in batch]):
+                logging.warning("Unable to remove object: {}/{}. Error: {}".format(bucket, error.name, error.message))
+                failed.add(error.name)
+            removed.extend([format_url(bucket, path) for path in batch if path not in failed])
+    return removed
+
+def purge_batch(connection, minio, batch_size):
+    # Deletes up to batch_size expired documents in one database transaction, then their objects that are no longer referenced. Returns the (documents, objects) removed
+    cursor = connection.cursor()
+    try:
+        docs = lock_expired_docs(cursor, batch_size)
+        if not docs:
+            connection.rollback()
+            return 0, 0
+        doc_ids = [doc[0] for doc in docs]
+        versions = get_versions_of_docs(cursor, doc_ids)
+        # Content addressed versions share objects; the object goes when its last reference does
+        locations = [location for location, size in release_contents(cursor, [version[1] for version in versions if version[1]])]
+        # Versions written before content addressing own their objects
+        legacy_locations = list(set([version[2] for version in versions if not version[1] and version[2]]))
+        delete_docs(cursor, doc_ids)
+        referenced = get_referenced_locations(cursor, legacy_locations)
+        locations.extend([location for location in legacy_locations if location not in referenced])
+        connection.commit()
+    except Exception as e:
+        connection.rollback()
+        raise e
+    finally:
+        cursor.close()
+
+    # After the commit: an object that fails to be removed is orphaned, which is better than metadata pointing to a missing object
+    return len(docs), len(remove_objects(minio, locations)) if locations else 0
+
+def purge_expired(connection, minio, batch_size, limiter, max_batches=0):
+    # Purges the expired documents in batches until there are none left (or max_batches). The limiter paces the documents and objects removed so that the purge does not compete with ingest for the database and the object store
+    cursor = connection.cursor()
+    try:
+        # Give up quickly (the batch is retried) rather than hold up a submit that locked the same rows
+        cursor.execute("SET SESSION innodb_lock_wait_timeout = 1")
+    finally:
+        cursor.close()
+
+    total_docs = 0
+    total_objects = 0
+    batches = 0
+    while not max_batches or batches < max_batches:
+        limiter.acquire(batch_size)
+        start = time.time()
+        batches = batches + 1
+        try:
+            docs, objects = purge_batch(connection, minio, batch_size)
+        except mysql.connector.Error as e:
+            if e.errno not in [errorcode.ER_LOCK_WAIT_TIMEOUT, errorcode.ER_LOCK_DEADLOCK]:
+                raise e
+            # The remaining documents are picked up by the next run
+            logging.warning("Purge yielded to a concurrent transaction: {}".format(e))
+            break
+        total_docs = total_docs + docs
+        total_objects = total_objects + objects
+        if docs:
+            logging.info("Purged {} expired documents and {} objects in {:.3f}s".format(docs, objects, time.time() - start))
+        if docs < batch_size:
+            break
+    return total_docs, total_objects
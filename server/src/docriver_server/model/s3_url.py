@@ -6,4 +6,7 @@ def parse_url(location):
     assert index > 0
     bucket = bucket_path[0:index]
     path = bucket_path[index+1:]
-    return bucket,path
\ No newline at end of file
+    return bucket,path
+
+def format_url(bucket, path):
+    return "s3://{}/{}".format(bucket, path)
\ No newline at end of file
@@ -0,0 +1,49 @@
+import threading
+
+# Coalesces concurrent calls with the same key: the first caller does the work and the ones that arrive while it is in progress wait for and share its result (or exception). Nothing is kept once the call completes
+class Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.stats = {'call': 0, 'shared': 0}
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = Call()
+                self.calls[key] = call
+                self.stats['call'] = self.stats['call'] + 1
+            else:
+                self.stats['shared'] = self.stats['shared'] + 1
+        return self.run(key, call, fn) if leader else self.wait(call)
+
+    def run(self, key, call, fn):
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise e
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+    def wait(self, call):
+        call.done.wait()
+        if call.error:
+            raise call.error
+        return call.result
+
+flights = SingleFlight()
+
+def coalesce(key, fn):
+    return flights.do(key, fn)
@@ -0,0 +1,140 @@
+import collections
+import hashlib
+import io
+import queue
+import threading
+
+from opentelemetry import context
+
+CHUNK_SIZE = 64*1024
+MAGIC_SIZE = 128
+
+class PipeAbortedException(Exception):
+    def __init__(self, message="Pipe aborted"):
+        self.message = message
+        super().__init__(self.message)
+
+class PipeStream(io.RawIOBase):
+    # A bounded, in-memory pipe between the fan-out reader and one consumer thread. The writer blocks when the consumer falls behind, so memory stays bounded by max_chunks * CHUNK_SIZE per consumer
+    def __init__(self, max_chunks=16):
+        self.chunks = queue.Queue(max_chunks)
+        self.pending = collections.deque()
+        self.pending_size = 0
+        self.eof = False
+        self.abandoned = False
+
+    def readable(self):
+        return True
+
+    def write_chunk(self, chunk):
+        while not self.abandoned:
+            try:
+                self.chunks.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def close_writer(self):
+        self.write_chunk(b'')
+
+    def abort(self):
+        self.write_chunk(None)
+
+    def abandon(self):
+        # Called by the consumer when it exits so that the writer never blocks on a dead consumer
+        self.abandoned = True
+
+    def read(self, size=-1):
+        whole = size is None or size < 0
+        while not self.eof and (whole or self.pending_size < size):
+            chunk = self.chunks.get()
+            if chunk is None:
+                raise PipeAbortedException()
+            if len(chunk) == 0:
+                self.eof = True
+            else:
+                # memoryview slices are not copied, which keeps small reads (the scanner reads 1KB at a time) linear
+                self.pending.append(memoryview(chunk))
+                self.pending_size += len(chunk)
+        wanted = self.pending_size if whole else min(size, self.pending_size)
+        parts = []
+        remaining = wanted
+        while remaining > 0:
+            chunk = self.pending[0]
+            if len(chunk) <= remaining:
+                parts.append(chunk)
+                self.pending.popleft()
+                remaining = remaining - len(chunk)
+            else:
+                parts.append(chunk[0:remaining])
+                self.pending[0] = chunk[remaining:]
+                remaining = 0
+        self.pending_size = self.pending_size - wanted
+        return b''.join(parts)
+
+class ConsumerThread(threading.Thread):
+    def __init__(self, name, target):
+        super().__init__(name="ingest-{}".format(name), daemon=True)
+        self.consumer = name
+        self.target = target
+        self.pipe = PipeStream()
+        self.result = None
+        self.error = None
+        # Carry the trace context over so that the consumer spans (minio, scanner) nest under the request span
+        self.trace_context = context.get_current()
+
+    def run(self):
+        token = context.attach(self.trace_context)
+        try:
+            self.result = self.target(self.pipe)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.pipe.abandon()
+            context.detach(token)
+
+def raise_consumer_error(consumers):
+    for consumer in consumers:
+        if consumer.error:
+            raise consumer.error
+
+def fan_out(source, targets, head_validator=None, chunk_size=CHUNK_SIZE):
+    # Reads the source exactly once. Every chunk is hashed, the leading bytes are handed to head_validator (magic sniffing) and the chunk is fed to each target running on its own thread. Returns the size, the SHA-256 digest and the result of each target. Any failure aborts all the targets
+    consumers = [ConsumerThread(name, target) for name, target in targets.items()]
+    for consumer in consumers:
+        consumer.start()
+
+    hasher = hashlib.sha256()
+    size = 0
+    head = b''
+    validated = head_validator is None
+    try:
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            size = size + len(chunk)
+            hasher.update(chunk)
+            if not validated:
+                head = head + chunk[0:MAGIC_SIZE-len(head)]
+                if len(head) >= MAGIC_SIZE:
+                    head_validator(head)
+                    validated = True
+            raise_consumer_error(consumers)
+            for consumer in consumers:
+                consumer.pipe.write_chunk(chunk)
+        if not validated:
+            head_validator(head)
+    except Exception as e:
+        for consumer in consumers:
+            consumer.pipe.abort()
+        for consumer in consumers:
+            consumer.join()
+        raise e
+
+    for consumer in consumers:
+        consumer.pipe.close_writer()
+    for consumer in consumers:
+        consumer.join()
+    raise_consumer_error(consumers)
+    return size, hasher.hexdigest(), {consumer.consumer: consumer.result for consumer in consumers}
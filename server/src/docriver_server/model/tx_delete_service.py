@@ -2,9 +2,12 @@ import logging
 from opentelemetry import trace
 
 from dao.tx import create_tx, create_tx_event
-from dao.document import get_doc_by_name, create_doc_event
+from dao.document import get_docs_by_name, create_doc_events, refresh_docs
 from exceptions import ValidationException
 from model.common import current_time_ms, format_result_base
+from model.notifier import notify_tx
+from model.location_cache import invalidate_locations
+from db_router import mark_written
 from model.authorizer import authorize_delete
 from trace_util import instrumented_connection
 
@@ -28,14 +31,23 @@ def delete_docs_tx(token, realm, payload, connection_pool, public_keys, audience
         payload['dr:txId'] = tx_id    
         create_tx_event(cursor, tx_id)
         documents = payload['documents']
+        found = get_docs_by_name(cursor, payload['dr:realm'], [document['document'] for document in documents])
+        events = []
+        deleted = set()
         for document in documents:
-            doc_id, version_id, doc_status = get_doc_by_name(cursor, payload['dr:realm'], document['document']) 
-            if doc_id == None or doc_status in ['R', 'D']:
+            doc_id, version_id, doc_status = found.get(document['document'], (None, None, None))
+            if doc_id == None or doc_status in ['R', 'D'] or document['document'] in deleted:
                 raise ValidationException('Document does not exist or has already been deleted/replaced')
-            create_doc_event(cursor, tx_id, doc_id, None, 'DELETE', 'D')
+            deleted.add(document['document'])
+            events.append(('DELETE', 'D', doc_id, None, tx_id, version_id))
+        create_doc_events(cursor, events)
+        refresh_docs(cursor, [event[2] for event in events])
         end = current_time_ms()
         result = format_result_base(start, payload, end)
         connection.commit()
+        mark_written(connection_pool, realm)
+        invalidate_locations(realm, deleted)
+        notify_tx(realm, payload['tx'])
         span.set_attributes({'numDocuments': len(documents), 'txKey': payload['dr:txId']})
         return result
     except Exception as e:
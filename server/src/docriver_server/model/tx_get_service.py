@@ -1,13 +1,73 @@
+from flask import stream_with_context
 from opentelemetry import trace
 from datetime import datetime
 
+import json
 import logging
+import time
 
 import dao.tx as dao
+from exceptions import ValidationException, DocumentException
 from model.authorizer import authorize_get_events
+from model.notifier import listen, tx_key
 from trace_util import instrumented_connection
 
-def get_events(realm, start, end, connection_pool, token, public_keys, audience):
+# Upper bound of the "limit" of a page of events
+MAX_PAGE_SIZE = 10000
+
+def format_event_cursor(event):
+    # Opaque to the clients: the (EVENT_TIME, ID) key of the event
+    return "{}-{}".format(event[0].strftime('%Y%m%d%H%M%S'), event[8])
+
+def parse_event_cursor(cursor):
+    try:
+        event_time, event_id = cursor.split('-')
+        return datetime.strptime(event_time, '%Y%m%d%H%M%S'), int(event_id)
+    except ValueError:
+        raise ValidationException('Invalid cursor: {}'.format(cursor))
+
+def format_event(event):
+    return {'eventTime': int(event[0].strftime('%s')),
+            'document': event[1],
+            'status': event[2],
+            'location': event[5],
+            'type': event[6],
+            'mime': event[7],
+            'cursor': format_event_cursor(event)}
+
+@stream_with_context
+def stream_events(connection, cursor, limit, ndjson):
+    # Without a limit: a JSON array of all the events in the window (as before). With a limit: a page object whose "next" is the cursor to pass as "after" to get the next page (null on the last page). NDJSON: one event per line, the cursor of the last line is where to resume from. The rows are read from the database as they are sent, so memory use does not depend on the number of events
+    span = trace.get_current_span()
+    count = 0
+    last = None
+    more = False
+    try:
+        if not ndjson:
+            yield '{"events": [' if limit else '['
+        for event in cursor:
+            if limit and count == limit:
+                # The extra row fetched to find out if there is a next page
+                more = True
+                break
+            if ndjson:
+                yield json.dumps(format_event(event)) + '\n'
+            else:
+                yield (',' if last else '') + json.dumps(format_event(event))
+            last = event
+            count = count + 1
+        if not ndjson:
+            yield '], "next": {}}}'.format(json.dumps(format_event_cursor(last) if more else None)) if limit else ']'
+    finally:
+        span.set_attribute('numEvents', count)
+        # The unread rows (client disconnected) have to be consumed before the connection can be reused
+        for event in cursor:
+            pass
+        cursor.close()
+        if connection.is_connected():
+            connection.close()
+
+def get_events(realm, start, end, connection_pool, token, public_keys, audience, after=None, limit=None, ndjson=False):
     # token = attach(baggage.set_baggage('realm', realm))
     span = trace.get_current_span()
     span.set_attributes({'realm': realm, 'from': start, 
@@ -15,24 +75,97 @@ def get_events(realm, start, end, connection_pool, token, public_keys, audience)
     principal,auth,issuer = authorize_get_events(public_keys, token, audience, realm)    
     logging.info("Received tx events for: {}. Principal: {}".format(realm, principal))
     span.set_attribute('principal', principal)
+    if limit is not None and (limit <= 0 or limit > MAX_PAGE_SIZE):
+        raise ValidationException('The limit must be between 1 and {}'.format(MAX_PAGE_SIZE))
+    after = parse_event_cursor(after) if after else None
     
     connection = instrumented_connection(connection_pool.get_connection())
     cursor = None
     try:
         cursor = connection.cursor()
-        events = dao.get_events(cursor, realm, start, end)
-        result = []
-        for event in events:
-            result.append({'eventTime': int(event[0].strftime('%s')),
-                           'document': event[1],
-                           'status': event[2],
-                           'location': event[5],
-                           'type': event[6],
-                           'mime': event[7]})
-        span.set_attribute('numEvents', len(events))
-        return result
+        # The query runs before the response starts so that errors are reported with the right status
+        dao.get_events(cursor, realm, start, end, after, limit + 1 if limit else None)
+        return stream_events(connection, cursor, limit, ndjson)
+    except Exception as e:
+        if cursor:
+            cursor.close()
+        if connection.is_connected():
+            connection.close()
+        raise e
+
+def format_tx(realm, tx, row, events, documents):
+    return {'tx': tx,
+            'realm': realm,
+            'txType': row[1],
+            'principal': row[2],
+            'status': row[5],
+            'createdAt': int(row[3].strftime('%s')),
+            'events': [{'eventTime': int(event[0].strftime('%s')),
+                        'event': event[1],
+                        'status': event[2],
+                        'description': event[3]} for event in events],
+            'documents': [{'eventTime': int(document[0].strftime('%s')),
+                           'document': document[1],
+                           'event': document[2],
+                           'status': document[3],
+                           'versionId': document[4],
+                           'type': document[5],
+                           'mime': document[6],
+                           'location': document[7]} for document in documents]}
+
+def format_tx_etag(row):
+    # The transaction only changes by appending TX_EVENTs, so the latest event identifies its state
+    return "{}-{}".format(row[0], row[4])
+
+def lookup_tx(connection_pool, realm, tx):
+    connection = instrumented_connection(connection_pool.get_connection())
+    cursor = None
+    try:
+        cursor = connection.cursor()
+        return dao.get_tx(cursor, realm, tx)
+    finally:
+        if cursor:
+            cursor.close()
+        if connection.is_connected():
+            connection.close()
+
+def get_tx(realm, tx, connection_pool, token, public_keys, audience, etags=[], wait_for=None, timeout=0, poll_interval=1):
+    # Returns the ETag and the transaction, or None if the transaction matches one of the etags (not modified). If the transaction matches the etags or its status is not in wait_for, wait up to timeout seconds for it to change
+    span = trace.get_current_span()
+    span.set_attributes({'realm': realm, 'tx': tx})
+    principal,auth,issuer = authorize_get_events(public_keys, token, audience, realm)
+    span.set_attribute('principal', principal)
+
+    def unchanged(row):
+        return format_tx_etag(row) in etags or (wait_for and row[5] not in wait_for)
+
+    with listen(tx_key(realm, tx)) as listener:
+        deadline = time.time() + timeout
+        while True:
+            # The connection is not held while waiting
+            row = lookup_tx(connection_pool, realm, tx)
+            if not row:
+                raise DocumentException('Transaction not found')
+            remaining = deadline - time.time()
+            if not unchanged(row) or remaining <= 0:
+                break
+            # Changes made by other gateway instances are not notified, hence the poll interval
+            listener.wait(min(remaining, poll_interval))
+
+    etag = format_tx_etag(row)
+    span.set_attribute('etag', etag)
+    if etag in etags:
+        return etag, None
+
+    connection = instrumented_connection(connection_pool.get_connection())
+    cursor = None
+    try:
+        cursor = connection.cursor()
+        events = dao.get_tx_events(cursor, row[0])
+        documents = dao.get_tx_documents(cursor, row[0])
+        return etag, format_tx(realm, tx, row, events, documents)
     finally:
         if cursor:
             cursor.close()
         if connection.is_connected():
-            connection.close()
\ No newline at end of file
+            connection.close()
@@ -0,0 +1,67 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from exceptions import UnavailableException
+from model.tx_submit_service import process_pending_tx, pending_manifest_filenames
+
+class TxProcessor:
+    # Background workers that complete the transactions accepted in the asynchronous mode. The pending transactions are kept as manifest files next to their staging areas in the untrusted filesystem
+    def __init__(self, max_workers, connection_pool, minio, scanner, bucket, untrusted_fs_mount, scanner_fs_mount, uploader=None, retry_interval=10):
+        self.connection_pool = connection_pool
+        self.minio = minio
+        self.scanner = scanner
+        self.bucket = bucket
+        self.untrusted_fs_mount = untrusted_fs_mount
+        self.scanner_fs_mount = scanner_fs_mount
+        self.uploader = uploader
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='tx-processor')
+        # Seconds before a transaction of a realm that is being moved to another shard is tried again
+        self.retry_interval = retry_interval
+        self.retries = set()
+        self.lock = threading.Lock()
+        self.stopped = False
+
+    def submit(self, manifest_filename):
+        return self.executor.submit(self.process, manifest_filename)
+
+    def process(self, manifest_filename):
+        try:
+            return process_pending_tx(self.bucket, self.connection_pool, self.minio, self.scanner, self.scanner_fs_mount, manifest_filename, self.uploader)
+        except UnavailableException as e:
+            logging.info("Transaction: {} postponed for {}s. Reason: {}".format(manifest_filename, self.retry_interval, e))
+            self.retry(manifest_filename)
+        except Exception as e:
+            logging.error("Unable to process transaction: {}. Exception: {}".format(manifest_filename, e), exc_info=True)
+
+    def retry(self, manifest_filename):
+        def resubmit():
+            with self.lock:
+                self.retries.discard(timer)
+                if not self.stopped:
+                    self.submit(manifest_filename)
+        timer = threading.Timer(self.retry_interval, resubmit)
+        timer.daemon = True
+        with self.lock:
+            if self.stopped:
+                # Left to the recovery at the next start
+                return
+            self.retries.add(timer)
+        timer.start()
+
+    def recover(self):
+        # Requeue the transactions that were accepted but not completed before the gateway stopped
+        manifest_filenames = pending_manifest_filenames(self.untrusted_fs_mount)
+        for manifest_filename in manifest_filenames:
+            self.submit(manifest_filename)
+        if manifest_filenames:
+            logging.info("Recovered pending transactions: {}".format(len(manifest_filenames)))
+        return len(manifest_filenames)
+
+    def shutdown(self):
+        with self.lock:
+            self.stopped = True
+            for timer in self.retries:
+                timer.cancel()
+            self.retries.clear()
+        self.executor.shutdown(wait=True)
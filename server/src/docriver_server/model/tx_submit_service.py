@@ -1,4 +1,6 @@
 import base64
+import glob
+import hashlib
 import io
 import os
 import os.path
@@ -14,17 +16,28 @@ from minio.commonconfig import Tags
 import json
 from subprocess import PIPE, STDOUT
 import uuid
+import time
 import re
 
-from exceptions import ValidationException
-from dao.tx import create_tx, create_tx_event
-from dao.document import create_references, create_doc, create_doc_version, create_doc_event, get_doc_by_name
-from model.file_validator import validate_documents
+from exceptions import ValidationException, StorageException
+from dao.tx import create_tx, create_tx_event, get_tx_status, get_tx
+from dao.document import create_references, create_docs, create_doc_versions, create_doc_events, get_docs_by_name, refresh_docs, set_doc_expiry
+from dao.content import acquire_contents
+from model.s3_url import format_url
+from model.file_validator import validate_documents, validate_magic, validate_scan_result
+from model.stream_ingest import fan_out
 from model.common import current_time_ms, format_result_base
+from model.notifier import notify_tx
+from model.location_cache import invalidate_locations
+from db_router import mark_written
+from shard_router import realm_pool
 from model.authorizer import authorize_submit
 from trace_util import new_span, instrumented_connection
 from metrics_util import increment_submit_requests, increment_submit_errors, record_submit_doc_count, record_submit_files_bytes
 
+# Manifests of the transactions accepted in the asynchronous mode that are yet to be processed
+PENDING_MANIFEST_SUFFIX = '.tx.json'
+
 def get_payload_from_form(realm, request):
     for field in request.files.keys():
         if not field.startswith('file'):
@@ -103,6 +116,11 @@ def validate_manifest(payload):
         
             if re.match('^[\.]{2,}$', document['content']['path']):
                 raise ValidationException('path is not valid - contains ..')
+
+        if 'expiresAt' in document:
+            # Epoch seconds, like the other times in the API
+            if type(document['expiresAt']) != int or document['expiresAt'] <= time.time():
+                raise ValidationException('expiresAt must be a time in the future, in seconds since the epoch')
     
 def preprocess_manifest(principal, payload):
     for document in payload['documents']:
@@ -115,15 +133,45 @@ def decode(encoding, data):
         return base64.b64decode(data)
     raise ValidationException('Unsupported encoding')
 
-def put_object(minio, bucket, doc_key, stream, mime_type, tags, properties):
+def inline_filename(document, content):
+    ext = mimetypes.guess_extension(document['content']['mimeType'], True)
+    if not ext or ext == '.mp4':
+        # if we were unable to determine an extension based on the mimetype or if it is a mp4 type, look deeper into the content to match a magic signature
+        info = fleep.get(content[0:128])
+        ext = '.' + info.extension[0]
+    return "{}-{}{}".format(
+        # the following is needed to remove any "directories" if the document id is specified in a path form
+        document['document'][document['document'].rfind('/')+1:],
+        document['dr:version'], ext)
+
+def put_object(minio, bucket, doc_key, stream, mime_type, tags, properties, length=-1):
     doc_tags=Tags(for_object=True)
     if (tags):
         doc_tags.update(tags)
 
     minio.put_object(bucket, doc_key, stream, 
-        length=-1, part_size=10*1024*1024, 
+        length=length, part_size=10*1024*1024, 
         content_type=mime_type, tags=doc_tags, metadata=properties)
     
+def save_and_hash(stream, filename):
+    # Copy the stream to the staging area, computing the content digest on the way
+    hasher = hashlib.sha256()
+    with open(filename, 'wb') as out:
+        while True:
+            chunk = stream.read(64*1024)
+            if not chunk:
+                break
+            hasher.update(chunk)
+            out.write(chunk)
+    return hasher.hexdigest()
+
+def metadata_digest(document):
+    # The object store keeps the tags and the properties with the object. Two documents can only share an object if these match as well
+    metadata = {'mimeType': document['content']['mimeType'],
+                'tags': document['tags'] if 'tags' in document else None,
+                'properties': document['properties'] if 'properties' in document else None}
+    return hashlib.sha256(json.dumps(metadata, sort_keys=True).encode('utf-8')).hexdigest()
+
 def stage_documents_from_manifest(principal, stage_dir, raw_file_mount, payload):
     with new_span("stage_documents_from_manifest") as span:
         filename_mime_dict = {}
@@ -134,27 +182,22 @@ def stage_documents_from_manifest(principal, stage_dir, raw_file_mount, payload)
             if 'content' in document:
                 if 'inline' in document['content']:
                     content = decode(document['content']['encoding'] if 'encoding' in document['content'] else None, document['content']['inline'])
-                    ext = mimetypes.guess_extension(document['content']['mimeType'], True)
-                    if not ext or ext == '.mp4':
-                        # if we were unable to determine an extension based on the mimetype or if it is a mp4 type, look deeper into the content to match a magic signature
-                        info = fleep.get(content[0:128])
-                        ext = '.' + info.extension[0]
-                    stage_filename = "{}/{}-{}{}".format(stage_dir,
-                        # the following is needed to remove any "directories" if the document id is specified in a path form                 
-                        document['document'][document['document'].rfind('/')+1:], 
-                        document['dr:version'], ext)
-                    mode = "w" if document['content']['mimeType'].startswith('text') else "wb"
-                    with open(stage_filename, mode) as stream:
-                        stream.write(content)
+                    if isinstance(content, str):
+                        content = content.encode('utf-8')
+                    stage_filename = "{}/{}".format(stage_dir, inline_filename(document, content))
+                    digest = save_and_hash(io.BytesIO(content), stage_filename)
                 elif 'path' in document['content']:
                     src_filename = "{}/{}/{}".format(raw_file_mount, payload['dr:realm'], document['content']['path'])
                     stage_filename = "{}/{}".format(stage_dir, os.path.split(src_filename)[1])
-                    shutil.copyfile(src_filename, stage_filename)
+                    with io.FileIO(src_filename) as stream:
+                        digest = save_and_hash(stream, stage_filename)
                 # else: If the inline/path attributes are not specified, then the document refers to an existing document
             # else: If the content attribute is not specified, then the document refers to an existing document
 
             if stage_filename:
                 document['dr:stageFilename'] = stage_filename
+                document['dr:digest'] = digest
+                document['dr:fileSize'] = os.stat(stage_filename).st_size
                 if 'mimeType' not in document['content']:
                     document['content']['mimeType'] = mimetypes.guess_type(document['dr:stageFilename'], strict=False)[0]
                 filename_mime_dict[stage_filename] = document['content']['mimeType']
@@ -177,93 +220,268 @@ def stage_documents_from_form(principal, request, stage_dir, payload):
                 if not uploaded_file.filename or uploaded_file.filename == 'manifest.json':
                     continue
                 staged_filename = "{}/{}".format(stage_dir, uploaded_file.filename)
-                uploaded_file.save(staged_filename)
+                digest = save_and_hash(uploaded_file.stream, staged_filename)
                 document = find_matching_document(payload['documents'], uploaded_file.filename)
                 if document:
                     document['dr:stageFilename'] = staged_filename
+                    document['dr:digest'] = digest
+                    document['dr:fileSize'] = os.stat(staged_filename).st_size
                     if 'mimeType' not in document['content']:
                         document['content']['mimeType'] = mimetypes.guess_type(document['dr:stageFilename'], strict=False)[0]
                     filename_mime_dict[staged_filename] = document['content']['mimeType']
         return filename_mime_dict
 
+def has_content(document):
+    return 'dr:stageFilename' in document or 'dr:streamed' in document
+
 def format_doc_key(payload, document):
-    ext = pathlib.Path(document['dr:stageFilename']).suffix
+    ext = document['dr:extension'] if 'dr:extension' in document else pathlib.Path(document['dr:stageFilename']).suffix
     return "{}/{}-{}{}".format(payload['dr:realm'], document['document'], document['dr:version'], ext)
 
-def write_to_obj_store(principal, minio, bucket, payload):
+def stream_sources_from_manifest(raw_file_mount, payload):
+    for document in payload['documents']:
+        if 'content' in document:
+            if 'inline' in document['content']:
+                content = decode(document['content']['encoding'] if 'encoding' in document['content'] else None, document['content']['inline'])
+                if isinstance(content, str):
+                    content = content.encode('utf-8')
+                yield document, inline_filename(document, content), io.BytesIO(content)
+            elif 'path' in document['content']:
+                src_filename = "{}/{}/{}".format(raw_file_mount, payload['dr:realm'], document['content']['path'])
+                with io.FileIO(src_filename) as stream:
+                    yield document, os.path.split(src_filename)[1], stream
+            # else: If the inline/path attributes are not specified, then the document refers to an existing document
+        # else: If the content attribute is not specified, then the document refers to an existing document
+
+def stream_sources_from_form(request, payload):
+    for field in request.files.keys():
+        if not field.startswith('file'):
+            continue
+        for uploaded_file in request.files.getlist(field):
+            if not uploaded_file.filename or uploaded_file.filename == 'manifest.json':
+                continue
+            document = find_matching_document(payload['documents'], uploaded_file.filename)
+            if document:
+                yield document, uploaded_file.filename, uploaded_file.stream
+
+def stream_document_to_obj_store(principal, minio, bucket, scanner, payload, document, filename, source):
+    with new_span("stream_obj_to_store", kind=SpanKind.CLIENT, 
+                    attributes={'document': document['document'], 
+                                'db.name': bucket, 'db.system': 'minio'}) as doc_span:
+        if 'mimeType' not in document['content']:
+            document['content']['mimeType'] = mimetypes.guess_type(filename, strict=False)[0]
+        mime_type = document['content']['mimeType']
+        document['dr:extension'] = pathlib.Path(filename).suffix
+        doc_key = format_doc_key(payload, document)
+
+        head_validator = None
+        if not mime_type or not mime_type.startswith('text'):
+            head_validator = lambda head: validate_magic(principal, filename, document['dr:extension'], mime_type, head)
+        targets = {
+            'scanner': scanner.instream,
+            'objstore': lambda stream: put_object(minio, bucket, doc_key, stream, mime_type,
+                                document['tags'] if 'tags' in document else None,
+                                document['properties'] if 'properties' in document else None)
+        }
+        try:
+            size, digest, results = fan_out(source, targets, head_validator)
+            # The scanner reports an INSTREAM result under the name "stream"
+            validate_scan_result(principal, {filename: status for status in results['scanner'].values()})
+        except Exception as e:
+            # The object may have been written completely before another consumer rejected the document
+            remove_objects(minio, bucket, [doc_key])
+            raise e
+        document['dr:streamed'] = True
+        document['dr:fileSize'] = size
+        document['dr:digest'] = digest
+        doc_span.set_attribute('size', size)
+        return doc_key, size
+
+def stream_documents_to_obj_store(principal, minio, bucket, scanner, payload, sources, doc_keys):
+    # Single-pass ingest: each document body is read once and, at the same time, hashed, sniffed for magic bytes, scanned for viruses and written to the object store
+    with new_span("stream_documents_to_objstore") as span:
+        file_size = 0
+        for document, filename, source in sources:
+            doc_key, size = stream_document_to_obj_store(principal, minio, bucket, scanner, payload, document, filename, source)
+            doc_keys.append(doc_key)
+            file_size = file_size + size
+        payload['dr:fileSize'] = file_size
+
+def remove_objects(minio, bucket, doc_keys):
+    for doc_key in doc_keys:
+        try:
+            minio.remove_object(bucket, doc_key)
+        except Exception as e:
+            logging.warning("Unable to remove object: {}/{}. Exception: {}".format(bucket, doc_key, e))
+
+def write_doc_to_obj_store(minio, bucket, payload, document, doc_key, size):
+    with new_span("write_obj_to_store", kind=SpanKind.CLIENT, 
+                  attributes={'document': document['document'], 
+                              'db.name': bucket, 'db.system': 'minio'}) as doc_span:
+        # TODO add more dr:tags to store document, etc.
+        with io.FileIO(document['dr:stageFilename']) as stream:
+                put_object(minio, bucket, doc_key, stream, 
+                    document['content']['mimeType'],
+                    document['tags'] if 'tags' in document else None,
+                    document['properties'] if 'properties' in document else None,
+                    length=size)
+
+def write_to_obj_store(principal, minio, bucket, payload, uploader=None):
     with new_span("write_to_objstore") as span:
         documents = payload['documents']
         file_size = 0
+        tasks = []
+        doc_keys = []
         for document in documents: 
-            if 'dr:stageFilename' in document:
-                with new_span("write_obj_to_store", kind=SpanKind.CLIENT, 
-                              attributes={'document': document['document'], 
-                                          'db.name': bucket, 'db.system': 'minio'}) as doc_span:
-                    file_size = file_size + os.stat(document['dr:stageFilename']).st_size
-                    # TODO add more dr:tags to store document, etc.
-                    # TODO the code below is not transactional. That means if a file put fails, the minio storage will be in a messed up state. We can perform cleanups since we have the references in the metadata store. A better way to do this is to tar the files and have minio extract it - https://blog.min.io/minio-optimizes-small-objects/
-                    with io.FileIO(document['dr:stageFilename']) as stream:
-                            put_object(minio, bucket, format_doc_key(payload, document), stream, 
-                                document['content']['mimeType'],
-                                document['tags'] if 'tags' in document else None,
-                                document['properties'] if 'properties' in document else None)
+            if 'dr:stageFilename' in document and 'dr:deduplicated' not in document:
+                # The size is known up front, so MinIO does not need to use chunked encoding
+                size = os.stat(document['dr:stageFilename']).st_size
+                file_size = file_size + size
+                doc_key = format_doc_key(payload, document)
+                doc_keys.append(doc_key)
+                tasks.append((document['document'], 
+                    lambda document=document, doc_key=doc_key, size=size: write_doc_to_obj_store(minio, bucket, payload, document, doc_key, size)))
+
+        # TODO the code below is not transactional. That means if a file put fails, the minio storage will be in a messed up state. We can perform cleanups since we have the references in the metadata store. A better way to do this is to tar the files and have minio extract it - https://blog.min.io/minio-optimizes-small-objects/
+        errors = {}
+        if uploader:
+            errors = uploader.run(tasks)
+        else:
+            for name, task in tasks:
+                try:
+                    task()
+                except Exception as e:
+                    errors[name] = e
+                    break
+        if errors:
+            # The transaction is going to be rolled back. Remove whatever made it to the store
+            remove_objects(minio, bucket, doc_keys)
+            raise StorageException('Failed to store {} document(s): {}'.format(len(errors), 
+                ', '.join(["{}: {}".format(name, e) for name, e in errors.items()])), errors)
+        span.set_attribute('numObjects', len(tasks))
         payload['dr:fileSize'] = file_size
 
-def write_metadata(principal, connection, bucket, payload):
+def doc_states(cursor, realm, documents):
+    # The state of the documents as seen by this transaction. All the documents named by the transaction (including the replaced ones) are looked up in one query; after that the state is maintained in memory as the transaction is planned
+    names = [document['document'] for document in documents] + [document['replaces'] for document in documents if 'replaces' in document]
+    found = get_docs_by_name(cursor, realm, names)
+    states = {}
+    for name in names:
+        doc_id, version_id, status = found.get(name, (None, None, None))
+        states[name] = {'name': name, 'id': doc_id, 'status': status, 'version': {'id': version_id}, 'new': False}
+    return states
+
+def doc_exists(state):
+    return state['id'] or state['new']
+
+def plan_metadata(cursor, payload):
+    # Validate the transaction and work out all the rows to be written. IDs of the rows that are yet to be created are filled in later
+    realm = payload['dr:realm']
+    states = doc_states(cursor, realm, payload['documents'])
+    plan = {'docs': [], 'versions': [], 'events': [], 'references': [], 'documents': []}
+    for document in payload['documents']:
+        state = states[document['document']]
+        version = state['version']
+
+        if has_content(document):
+            new_version = 'replaces' in document and document['replaces'] == document['document']
+
+            if not new_version and doc_exists(state) and state['status'] not in ['R', 'D']:
+                raise ValidationException('The document already exists')
+
+            replaces = None
+            if 'replaces' in document and document['replaces'] != document['document']:
+                replaces = states[document['replaces']]
+                if not doc_exists(replaces) or replaces['status'] in ['R', 'D']:
+                    raise ValidationException('Non-existent or replaced replacement document: {}'.format(document['replaces']))
+
+            if not doc_exists(state):
+                # The document may already exist becaause a previous document with the same name has been replaced/voided or this is a "self-replacement" document (new version)
+                state['new'] = True
+                plan['docs'].append(state)
+
+            version = {'id': None, 'document': document, 'doc': state}
+            state['version'] = version
+            plan['versions'].append(version)
+
+            if 'replaces' in document:
+                if new_version:
+                    # Self replacement
+                    plan['events'].append(('NEW_VERSION', 'V', state, None, version))
+                else:
+                    plan['events'].append(('REPLACEMENT', 'R', replaces, state, replaces['version']))
+                    replaces['status'] = 'R'
+            plan['events'].append(('INGESTION', 'I', state, None, version))
+            state['status'] = 'I'
+        else:
+            # Reference to an existing document
+            if not doc_exists(state) or state['status'] in ['R', 'D']:
+                raise ValidationException("Document: {} not found or has been replaced".format(document['document']))
+            plan['events'].append(('REFERENCE', 'J', state, None, version))
+            state['status'] = 'J'
+
+        if 'references' in payload:
+            plan['references'].extend([(version, reference) for reference in payload['references']])
+
+        if 'references' in document:
+            plan['references'].extend([(version, reference) for reference in document['references']])
+
+        plan['documents'].append((document, state, version))
+    return plan
+
+def write_metadata(principal, connection, bucket, payload, tx_id=None):
+    # The rows are written table by table using multi-row inserts, so the number of statements does not depend on the number of documents in the transaction. Returns the names of the existing documents whose current version changes, for cache invalidation once the transaction commits
     with new_span("write_metadata") as span:
         cursor = connection.cursor()
         try:
-            tx_id = create_tx(payload, 'submit', cursor)
+            realm = payload['dr:realm']
+            if not tx_id:
+                tx_id = create_tx(payload, 'submit', cursor)
+                create_tx_event(cursor, tx_id)
+            # else: the transaction was recorded when it was accepted (asynchronous mode)
             payload['dr:txId'] = tx_id
-            create_tx_event(cursor, tx_id)
-            
-            documents = payload['documents']
-            for document in documents:
-                with new_span("Write_metadata_document", attributes={'document': document['document']}):
-                    doc_id, version_id, doc_status = get_doc_by_name(cursor, payload['dr:realm'], document['document'])            
-
-                    if 'dr:stageFilename' in document:
-                        new_version = 'replaces' in document and document['replaces'] == document['document']
-
-                        if not new_version and doc_id and doc_status not in ['R', 'D']:
-                            raise ValidationException('The document already exists')
-                    
-                        if 'replaces' in document:
-                            replaces_doc_id = None
-                            if document['replaces'] != document['document']:
-                                replaces_doc_id, replaces_version_id, replaces_doc_status = get_doc_by_name(cursor, payload['dr:realm'], document['replaces'])
-                                if replaces_doc_id == None or replaces_doc_status in ['R', 'D']:
-                                    raise ValidationException('Non-existent or replaced replacement document: {}'.format(document['replaces']))
-
-                        if not doc_id:
-                            # The document may already exist becaause a previous document with the same name has been replaced/voided or this is a "self-replacement" document (new version)
-                            doc_id = create_doc(cursor, document, payload['dr:realm'])
-
-                        version_id = create_doc_version(bucket, cursor, tx_id, doc_id, format_doc_key(payload, document), document)
-
-                        if 'replaces' in document:
-                            if new_version:
-                                # Self replacement
-                                create_doc_event(cursor, tx_id, doc_id, None, 'NEW_VERSION', 'V')
-                            else:
-                                create_doc_event(cursor, tx_id, replaces_doc_id, doc_id, 'REPLACEMENT', 'R')
-                    else:
-                        # Reference to an existing document
-                        if not doc_id or doc_status in ['R', 'D']:
-                            raise ValidationException("Document: {} not found or has been replaced".format(document['document']))
-
-                    create_doc_event(cursor, tx_id, doc_id, None, 
-                                    'INGESTION' if 'dr:stageFilename' in document else 'REFERENCE', 
-                                    'I' if 'dr:stageFilename' in document else 'J')
-
-                    if 'references' in payload:
-                        create_references(cursor, payload['references'], version_id)
-
-                    if 'references' in document:
-                        create_references(cursor, document['references'], version_id)
-
-                    document['dr:documentId'] = doc_id
-                    document['dr:documentVersionId'] = version_id
+
+            plan = plan_metadata(cursor, payload)
+
+            if plan['docs']:
+                doc_ids = create_docs(cursor, realm, [state['name'] for state in plan['docs']])
+                for state in plan['docs']:
+                    state['id'] = doc_ids[state['name']]
+
+            if plan['versions']:
+                # Content addressable storage: identical content in a realm is stored once and shared by the versions
+                for version in plan['versions']:
+                    document = version['document']
+                    version['content'] = (document['dr:digest'], metadata_digest(document))
+                    version['location'] = format_url(bucket, format_doc_key(payload, document))
+                contents = acquire_contents(cursor, realm, 
+                    [version['content'] + (version['location'], version['document']['dr:fileSize']) for version in plan['versions']])
+                for version in plan['versions']:
+                    content_id, location = contents[version['content']]
+                    if location != version['location']:
+                        version['document']['dr:deduplicated'] = True
+                    version['location'] = location
+                    version['contentId'] = content_id
+
+                version_ids = create_doc_versions(cursor, tx_id, 
+                    [(version['doc']['id'], version['location'], version['document'], version['contentId']) for version in plan['versions']])
+                for version, version_id in zip(plan['versions'], version_ids):
+                    version['id'] = version_id
+
+            create_doc_events(cursor, [(description, status, state['id'], ref_state['id'] if ref_state else None, tx_id, version['id']) 
+                                       for description, status, state, ref_state, version in plan['events']])
+            refresh_docs(cursor, [state['id'] for description, status, state, ref_state, version in plan['events']])
+
+            create_references(cursor, tx_id, [(version['id'], reference) for version, reference in plan['references']])
+
+            # Every new version sets the expiry, so that the expiry of an earlier version (or of a deleted document of the same name) does not carry over
+            set_doc_expiry(cursor, [(state['id'], document.get('expiresAt')) for document, state, version in plan['documents'] if has_content(document)])
+
+            for document, state, version in plan['documents']:
+                document['dr:documentId'] = state['id']
+                document['dr:documentVersionId'] = version['id']
+            span.set_attributes({'numVersions': len(plan['versions']), 'numEvents': len(plan['events']), 'numReferences': len(plan['references'])})
+            return [state['name'] for description, status, state, ref_state, version in plan['events'] if status in ['V', 'R']]
         finally:
             cursor.close()
 
@@ -279,7 +497,127 @@ def adjust_result(start, payload, end):
             document['content']['inline'] = '<snipped>'
     return result
 
-def submit_docs_tx(untrusted_fs_mount, raw_fs_mount, scanner_fs_mount, bucket, connection_pool, minio, scanner, public_keys, audience, realm, request):
+def pending_manifest_filename(stage_dir):
+    return stage_dir + PENDING_MANIFEST_SUFFIX
+
+def pending_manifest_filenames(untrusted_fs_mount):
+    return sorted(glob.glob("{}/*{}".format(untrusted_fs_mount, PENDING_MANIFEST_SUFFIX)))
+
+def save_pending_manifest(stage_dir, payload):
+    # The documents are already in the staging area. The manifest is saved next to it (outside the directory that gets scanned) without the content and the token
+    manifest = {k: v for k, v in payload.items() if k != 'authorization'}
+    # New dicts for the documents with inline content: the payload is used after this
+    manifest['documents'] = [{**document, 'content': {**document['content'], 'inline': '<snipped>'}} 
+                             if 'content' in document and 'inline' in document['content'] else document 
+                             for document in payload['documents']]
+    manifest['dr:stageDir'] = stage_dir
+
+    filename = pending_manifest_filename(stage_dir)
+    with open(filename + '.tmp', 'w') as out:
+        json.dump(manifest, out)
+        out.flush()
+        os.fsync(out.fileno())
+    os.rename(filename + '.tmp', filename)
+    return filename
+
+def accept_tx(connection, stage_dir, payload):
+    # Asynchronous mode: record the transaction as in progress and persist the manifest, so that the workers (or the gateway after a restart) can complete it
+    with new_span("accept_tx") as span:
+        cursor = connection.cursor()
+        try:
+            tx_id = create_tx(payload, 'submit', cursor)
+            payload['dr:txId'] = tx_id
+            create_tx_event(cursor, tx_id, 'ACCEPTED', 'P')
+            filename = save_pending_manifest(stage_dir, payload)
+            try:
+                connection.commit()
+            except Exception as e:
+                os.remove(filename)
+                raise e
+            notify_tx(payload['dr:realm'], payload['tx'])
+            return filename
+        finally:
+            cursor.close()
+
+def fail_tx(connection, payload, e):
+    cursor = connection.cursor()
+    try:
+        create_tx_event(cursor, payload['dr:txId'], 'FAILED', 'F', str(e)[0:200])
+        connection.commit()
+        notify_tx(payload['dr:realm'], payload['tx'])
+    finally:
+        cursor.close()
+
+def process_pending_tx(bucket, connection_pool, minio, scanner, scanner_fs_mount, manifest_filename, uploader=None):
+    # Complete a transaction accepted in the asynchronous mode: validate the staged documents and store them. The transaction ends up with status C (completed) or F (failed)
+    with new_span("process_pending_tx") as span:
+        with open(manifest_filename) as stream:
+            payload = json.load(stream)
+        stage_dir = payload['dr:stageDir']
+        metrics_attribs = {'realm': payload['dr:realm'], 'txType': 'submit', 'mode': 'async'}
+        span.set_attributes({'realm': payload['dr:realm'], 'principal': payload['dr:principal'], 'tx': payload['tx']})
+
+        # While the realm is moved to another shard this fails (UnavailableException) and the transaction stays pending: the processor retries it later
+        connection_pool = realm_pool(connection_pool, payload['dr:realm'], write=True)
+        connection = instrumented_connection(connection_pool.get_connection())
+        done = False
+        try:
+            cursor = connection.cursor()
+            try:
+                # Not the ID in the manifest: if the realm was moved to another shard since the transaction was accepted, it has a new ID there
+                tx = get_tx(cursor, payload['dr:realm'], payload['tx'])
+                tx_id = tx[0] if tx else None
+                status = get_tx_status(cursor, tx_id, lock=True) if tx_id else None
+            finally:
+                cursor.close()
+            payload['dr:txId'] = tx_id
+            span.set_attribute('txKey', str(tx_id))
+            if status != 'P':
+                # Already processed, or the request that accepted it never committed
+                logging.info("Skipping transaction: {}/{}. Status: {}".format(payload['dr:realm'], payload['tx'], status))
+                connection.rollback()
+                done = True
+                return status
+
+            filename_mime_dict = {document['dr:stageFilename']: document['content']['mimeType'] for document in payload['documents'] if 'dr:stageFilename' in document}
+            validate_documents(payload['dr:principal'], scanner, scanner_fs_mount, stage_dir, filename_mime_dict)
+            changed_docs = write_metadata(payload['dr:principal'], connection, bucket, payload, tx_id)
+            write_to_obj_store(payload['dr:principal'], minio, bucket, payload, uploader)
+
+            cursor = connection.cursor()
+            try:
+                create_tx_event(cursor, tx_id, 'COMPLETED', 'C')
+            finally:
+                cursor.close()
+            connection.commit()
+            done = True
+            mark_written(connection_pool, payload['dr:realm'])
+            invalidate_locations(payload['dr:realm'], changed_docs)
+            notify_tx(payload['dr:realm'], payload['tx'])
+            logging.info("Completed transaction: {}/{}".format(payload['dr:realm'], payload['tx']))
+            increment_submit_requests(metrics_attribs)
+            record_submit_doc_count(len(payload['documents']), metrics_attribs)
+            record_submit_files_bytes(payload['dr:fileSize'], metrics_attribs)
+            return 'C'
+        except Exception as e:
+            logging.warning("Transaction failed: {}/{}. Exception: {}".format(payload['dr:realm'], payload['tx'], e))
+            metrics_attribs['exception'] = str(e)
+            increment_submit_errors(metrics_attribs)
+            connection.rollback()
+            # If the failure cannot be recorded (database down, etc.), the staged transaction is left behind to be recovered later
+            fail_tx(connection, payload, e)
+            mark_written(connection_pool, payload['dr:realm'])
+            done = True
+            return 'F'
+        finally:
+            if done:
+                if os.path.isdir(stage_dir):
+                    shutil.rmtree(stage_dir)
+                os.remove(manifest_filename)
+            if connection.is_connected():
+                connection.close()
+
+def submit_docs_tx(untrusted_fs_mount, raw_fs_mount, scanner_fs_mount, bucket, connection_pool, minio, scanner, public_keys, audience, realm, request, streaming_ingest=False, uploader=None, respond_async=False, processor=None):
     span = trace.get_current_span()
     span.set_attribute('realm', realm)
     metrics_attribs = {'realm': realm, 'txType': 'submit'}
@@ -287,6 +625,8 @@ def submit_docs_tx(untrusted_fs_mount, raw_fs_mount, scanner_fs_mount, bucket, c
     start = current_time_ms()
     connection = instrumented_connection(connection_pool.get_connection())
     stage_dir = stage_dirname(untrusted_fs_mount)
+    streamed_doc_keys = []
+    keep_stage = False
     try:
         payload = None
         rest = request.content_type == 'application/json'
@@ -308,24 +648,56 @@ def submit_docs_tx(untrusted_fs_mount, raw_fs_mount, scanner_fs_mount, bucket, c
         
         span.set_attributes({'principal': payload['dr:principal'], 'tx': payload['tx'], 'contentType': request.headers.get('Accept', default='text/html'), 'tx': payload['tx']})
 
-        os.makedirs(stage_dir)
-
         preprocess_manifest(payload['dr:principal'],payload)
 
-        filename_mime_dict = None
-        if rest:
-            filename_mime_dict = stage_documents_from_manifest(payload['dr:principal'], stage_dir, raw_fs_mount, payload)
+        if respond_async and processor:
+            # Staging is the only work done on the request thread. The scan and the writes are done by the transaction processor
+            metrics_attribs['mode'] = 'async'
+            os.makedirs(stage_dir)
+            if rest:
+                stage_documents_from_manifest(payload['dr:principal'], stage_dir, raw_fs_mount, payload)
+            else:
+                stage_documents_from_form(payload['dr:principal'],request, stage_dir, payload)
+            manifest_filename = accept_tx(connection, stage_dir, payload)
+            mark_written(connection_pool, realm)
+            # The staging area now belongs to the transaction processor
+            keep_stage = True
+            processor.submit(manifest_filename)
+
+            end = current_time_ms()
+            result = adjust_result(start, payload, end)
+            result['dr:status'] = 'accepted'
+            span.set_attributes({'numDocuments': len(payload['documents']), 'txKey': payload['dr:txId']})
+            return result
+
+        if streaming_ingest:
+            metrics_attribs['ingest'] = 'stream'
+            sources = stream_sources_from_manifest(raw_fs_mount, payload) if rest else stream_sources_from_form(request, payload)
+            stream_documents_to_obj_store(payload['dr:principal'], minio, bucket, scanner, payload, sources, streamed_doc_keys)
+            changed_docs = write_metadata(payload['dr:principal'], connection, bucket, payload)
         else:
-            filename_mime_dict = stage_documents_from_form(payload['dr:principal'],request, stage_dir, payload)
+            os.makedirs(stage_dir)
+
+            filename_mime_dict = None
+            if rest:
+                filename_mime_dict = stage_documents_from_manifest(payload['dr:principal'], stage_dir, raw_fs_mount, payload)
+            else:
+                filename_mime_dict = stage_documents_from_form(payload['dr:principal'],request, stage_dir, payload)
 
-        validate_documents(payload['dr:principal'], scanner, scanner_fs_mount, stage_dir, filename_mime_dict)
-        write_metadata(payload['dr:principal'], connection, bucket, payload)
-        write_to_obj_store(payload['dr:principal'], minio, bucket, payload)
+            validate_documents(payload['dr:principal'], scanner, scanner_fs_mount, stage_dir, filename_mime_dict)
+            changed_docs = write_metadata(payload['dr:principal'], connection, bucket, payload)
+            write_to_obj_store(payload['dr:principal'], minio, bucket, payload, uploader)
 
         end = current_time_ms()
         result = adjust_result(start, payload, end)
         
         connection.commit()
+        mark_written(connection_pool, realm)
+        invalidate_locations(realm, changed_docs)
+        notify_tx(realm, payload['tx'])
+        if streaming_ingest:
+            # The streamed copies of the deduplicated documents are not referenced by any version
+            remove_objects(minio, bucket, [format_doc_key(payload, document) for document in payload['documents'] if 'dr:deduplicated' in document])
         span.set_attributes({'numDocuments': len(payload['documents']), 'txKey': payload['dr:txId']})
         increment_submit_requests(metrics_attribs)
         record_submit_doc_count(len(payload['documents']), metrics_attribs)
@@ -335,9 +707,10 @@ def submit_docs_tx(untrusted_fs_mount, raw_fs_mount, scanner_fs_mount, bucket, c
         metrics_attribs['exception'] = str(e)
         increment_submit_errors(metrics_attribs)
         connection.rollback()
+        remove_objects(minio, bucket, streamed_doc_keys)
         raise e
     finally:
-        if os.path.isdir(stage_dir):
+        if os.path.isdir(stage_dir) and not keep_stage:
             shutil.rmtree(stage_dir)
         if connection.is_connected():
             connection.close()
\ No newline at end of file
@@ -0,0 +1,39 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from opentelemetry import context
+
+class UploadEngine:
+    # A bounded thread pool shared by all the transactions (global limit). Each transaction may only have max_per_tx uploads in flight so that a single large transaction cannot starve the others
+    def __init__(self, max_workers, max_per_tx):
+        self.max_workers = max_workers
+        self.max_per_tx = max(1, min(max_per_tx, max_workers))
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='objstore-upload')
+
+    def run(self, tasks):
+        # tasks is a list of (name, callable). Waits for all the tasks to complete and returns a dictionary of name -> exception for the ones that failed
+        slots = threading.BoundedSemaphore(self.max_per_tx)
+        trace_context = context.get_current()
+        futures = []
+        for name, task in tasks:
+            slots.acquire()
+            futures.append((name, self.executor.submit(run_task, slots, trace_context, task)))
+
+        errors = {}
+        for name, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                errors[name] = e
+        return errors
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+def run_task(slots, trace_context, task):
+    token = context.attach(trace_context)
+    try:
+        return task()
+    finally:
+        context.detach(token)
+        slots.release()
@@ -0,0 +1,98 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from exceptions import UnavailableException
+
+# Shard map file (JSON):
+# {
+#   "shards": {"s1": {"host": "mysql-1", "port": 3306, "database": "docriver"}},
+#   "realms": {"p123456": "s1"},
+#   "moving": {"p234567": "s1"}
+# }
+# The database the gateway is started with (--dbHost etc.) is the shard named "default", where the realms that are not in "realms" live. A shard can also set "user", "password", "poolSize" and "replicaHost". "moving" lists the realms being copied to another shard (see "admin.py move-realm"): they are read-only until the move completes
+DEFAULT_SHARD = 'default'
+
+def load_shard_map(path):
+    with open(path) as stream:
+        shard_map = json.load(stream)
+    for realm, shard in list(shard_map.get('realms', {}).items()) + list(shard_map.get('moving', {}).items()):
+        if shard != DEFAULT_SHARD and shard not in shard_map.get('shards', {}):
+            raise ValueError("Unknown shard: {} (realm: {})".format(shard, realm))
+    return shard_map
+
+def save_shard_map(path, shard_map):
+    # Replaced atomically so that the gateways never read a partial file
+    temp = path + '.tmp'
+    with open(temp, 'w') as stream:
+        json.dump(shard_map, stream, indent=2)
+    os.replace(temp, path)
+
+class ShardRouter:
+    # Picks the database pool of a realm. get_connection() returns a connection of the default shard, so the router can be used wherever a pool is expected (health check, jobs that are not realm scoped).
+    # The map file is re-read when it changes (checked at most every reload_interval seconds); the pools of new shards are created with pool_factory(name, config)
+    def __init__(self, default_pool, pool_factory, map_file, reload_interval=10):
+        self.default_pool = default_pool
+        self.pool_factory = pool_factory
+        self.map_file = map_file
+        self.reload_interval = reload_interval
+        self.lock = threading.Lock()
+        self.pools = {DEFAULT_SHARD: default_pool}
+        self.realms = {}
+        self.moving = {}
+        self.modified = None
+        self.checked_at = 0
+        self.reload()
+
+    def get_connection(self):
+        return self.default_pool.get_connection()
+
+    def reload(self):
+        modified = os.stat(self.map_file).st_mtime
+        if modified == self.modified:
+            return False
+        shard_map = load_shard_map(self.map_file)
+        pools = dict(self.pools)
+        for name, config in shard_map.get('shards', {}).items():
+            if name not in pools:
+                pools[name] = self.pool_factory(name, config)
+        with self.lock:
+            self.pools = pools
+            self.realms = shard_map.get('realms', {})
+            self.moving = shard_map.get('moving', {})
+            self.modified = modified
+        logging.info("Loaded shard map: {}. Shards: {}, realms: {}, moving: {}".format(self.map_file, len(pools), len(self.realms), list(self.moving.keys())))
+        return True
+
+    def check_reload(self):
+        now = time.time()
+        with self.lock:
+            if now - self.checked_at < self.reload_interval:
+                return
+            self.checked_at = now
+        try:
+            self.reload()
+        except Exception as e:
+            # Keep routing with the map loaded last
+            logging.error("Unable to load shard map: {}. Exception: {}".format(self.map_file, e))
+
+    def shard(self, realm):
+        self.check_reload()
+        return self.realms.get(realm, DEFAULT_SHARD)
+
+    def pool(self, realm):
+        return self.pools[self.shard(realm)]
+
+    def write_pool(self, realm):
+        shard = self.shard(realm)
+        if realm in self.moving:
+            raise UnavailableException("Realm {} is being moved to another database. Retry later".format(realm))
+        return self.pools[shard]
+
+def realm_pool(connection_pool, realm, write=False):
+    # The pool of the realm's shard, or connection_pool itself when the metadata is not sharded
+    if not isinstance(connection_pool, ShardRouter):
+        return connection_pool
+    return connection_pool.write_pool(realm) if write else connection_pool.pool(realm)
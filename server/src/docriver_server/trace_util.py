@@ -22,4 +22,7 @@ def set_instrument_connection(instrument):
     instrument_connection = instrument
 
 def instrumented_connection(connection):
-    return MySQLInstrumentor().instrument_connection(connection) if instrument_connection else connection
\ No newline at end of file
+    # The connections of db_pool are instrumented once, when opened
+    if getattr(connection, 'instrumented', False):
+        return connection
+    return MySQLInstrumentor().instrument_connection(connection) if instrument_connection else connection
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# Micro-benchmark of the OKTA token verification (docriver_auth.okta.verify), offline: the keys are served by a local stand-in for the JWKS endpoint. Measures a signature check, a cache hit and the throughput of concurrent request threads
+# Run from the server directory: PYTHONPATH=src/docriver_server python -m test.benchmark.bench_okta
+import argparse
+import sys
+import threading
+import time
+import timeit
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from docriver_auth.jwks import to_jwks
+from docriver_auth.okta.verify import OktaTokenValidator
+from test.functional.util import start_jwks_server, jwks_url, OKTA_ISSUER
+from test.functional.test_okta_verify import okta_token
+
+def run(name, fn, number):
+    seconds = min(timeit.repeat(fn, number=number, repeat=5))
+    print("{:<32} {:>10.2f} us/op".format(name, seconds / number * 1e6))
+
+def run_concurrent(name, validator, tokens, threads, number):
+    def verify():
+        for i in range(number):
+            validator.verify(tokens[i % len(tokens)])
+    workers = [threading.Thread(target=verify) for i in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    seconds = time.perf_counter() - start
+    print("{:<32} {:>10.0f} ops/s".format(name, threads * number / seconds))
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description="OKTA token verification micro-benchmark")
+    parser.add_argument("--threads", type=int, help="Concurrent request threads", default=8)
+    parser.add_argument("--tokens", type=int, help="Distinct tokens (users) verified by the threads", default=100)
+    parser.add_argument("--number", type=int, help="Iterations per measurement", default=1000)
+    return parser.parse_args(args)
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    server = start_jwks_server()
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    server.jwks = to_jwks([key.public_key()])
+    tokens = [okta_token(key, expires=3600 + i) for i in range(args.tokens)]
+
+    uncached = OktaTokenValidator(OKTA_ISSUER, 'api://docriver', jwks_url(server), cache_size=0).start()
+    cached = OktaTokenValidator(OKTA_ISSUER, 'api://docriver', jwks_url(server), cache_size=args.tokens).start()
+    cached.verify(tokens[0])
+
+    run('signature check', lambda: uncached.verify(tokens[0]), args.number)
+    run('cache hit', lambda: cached.verify(tokens[0]), args.number)
+    run_concurrent('{} threads, no cache'.format(args.threads), uncached, tokens, args.threads, args.number)
+    run_concurrent('{} threads, cache'.format(args.threads), cached, tokens, args.threads, args.number)
+    print("JWKS fetches: {}".format(uncached.key_set.stats['refresh'] + cached.key_set.stats['refresh']))
+
+    uncached.shutdown()
+    cached.shutdown()
+    server.shutdown()
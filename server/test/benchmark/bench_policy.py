@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# Micro-benchmark of the submit authorization: the per-reference re.match on the permission strings (as authorize_submit used to do) vs the compiled policy of model/policy.py
+# Run from the server directory: PYTHONPATH=src/docriver_server python -m test.benchmark.bench_policy
+import argparse
+import re
+import sys
+import timeit
+
+from model.policy import compile_policy, get_policy
+
+PERMISSIONS = {'txType': 'submit', 'documentCount': '-1', 'realm': 'p12345.*', 'resourceType': 'claim|member', 'resourceId': '[0-9]+'}
+
+def payload(documents, references):
+    return {'tx': '1',
+            'references': [{'resourceType': 'claim', 'resourceId': '1000'}],
+            'documents': [{'document': 'd{}'.format(i),
+                           'references': [{'resourceType': 'member', 'resourceId': str(r)} for r in range(references)]}
+                          for i in range(documents)]}
+
+def authorize_regex(permissions, payload, realm):
+    if re.match(permissions['realm'], realm) is None:
+        return False
+    for document in payload['documents']:
+        for reference in payload['references'] + document['references']:
+            if not re.match(permissions['resourceType'], reference['resourceType']) \
+                    or not re.match(permissions['resourceId'], reference['resourceId']):
+                return False
+    return True
+
+def authorize_policy(permissions, payload, realm):
+    policy = get_policy(permissions)
+    if not policy.allows_realm(realm):
+        return False
+    references = list(payload['references'])
+    for document in payload['documents']:
+        references.extend(document['references'])
+    return policy.allows_references(references)
+
+def run(name, fn, number):
+    seconds = min(timeit.repeat(fn, number=number, repeat=5))
+    print("{:<32} {:>10.2f} us/op".format(name, seconds / number * 1e6))
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description="Authorization policy micro-benchmark")
+    parser.add_argument("--documents", type=int, help="Documents per transaction", default=50)
+    parser.add_argument("--references", type=int, help="References per document", default=5)
+    parser.add_argument("--number", type=int, help="Iterations per measurement", default=1000)
+    return parser.parse_args(args)
+
+if __name__ == '__main__':
+    args = parse_args(sys.argv[1:])
+    tx = payload(args.documents, args.references)
+    assert authorize_regex(PERMISSIONS, tx, 'p123456') and authorize_policy(PERMISSIONS, tx, 'p123456')
+    print("{} documents x {} references".format(args.documents, args.references))
+    run('re.match per reference', lambda: authorize_regex(PERMISSIONS, tx, 'p123456'), args.number)
+    run('compile per request', lambda: compile_policy(PERMISSIONS), args.number)
+    run('cached policy', lambda: authorize_policy(PERMISSIONS, tx, 'p123456'), args.number)
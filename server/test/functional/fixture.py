@@ -2,8 +2,20 @@ import os
 import pytest
 import logging
 from controller.http import init_app, init_params
-from gateway import init_db, init_obj_store, init_virus_scanner, init_authorization, init_tracing, init_metrics
-from test.functional.util import delete_obj_recursively, TEST_REALM, raw_dir, untrusted_dir, auth_keystore_path
+from model.location_cache import init_location_cache
+from docriver_auth.auth_token import init_token_cache
+from docriver_auth.jwks import JwksKeySet
+from docriver_auth.okta.verify import OktaTokenValidator
+from model.body_cache import init_body_cache
+from model.document_service import init_coalescing
+from model.single_flight import flights
+import model.feed_service as feed_service
+from db_router import DbRouter
+from shard_router import ShardRouter, save_shard_map
+from dao.realm import REALM_TABLES
+from model.realm_mover import delete_realm
+from gateway import init_db, init_obj_store, init_obj_store_uploader, init_tx_processor, init_delivery, init_virus_scanner, init_authorization, init_tracing, init_metrics
+from test.functional.util import delete_obj_recursively, TEST_REALM, raw_dir, untrusted_dir, auth_keystore_path, start_jwks_server, jwks_url, OKTA_ISSUER
 
 @pytest.fixture(scope="session", autouse=True)
 def connection_pool():
@@ -13,6 +25,17 @@ def connection_pool():
                    os.getenv('DOCRIVER_MYSQL_PASSWORD', default='docriver'), 
                    'docriver', 5)
 
+@pytest.fixture()
+def small_pool(metrics):
+    # A single connection, a single waiter
+    pool = init_db(os.getenv('DOCRIVER_MYSQL_HOST', default='127.0.0.1'), 
+                   os.getenv('DOCRIVER_MYSQL_PORT', default=3306), 
+                   os.getenv('DOCRIVER_MYSQL_USER', default='docriver'), 
+                   os.getenv('DOCRIVER_MYSQL_PASSWORD', default='docriver'), 
+                   'docriver', 1, False, 'docriver-small', 1, 1, 0)
+    yield pool
+    pool.shutdown()
+
 @pytest.fixture(scope="session", autouse=True)
 def auth_keystore():
     store = init_authorization(auth_keystore_path(), 'docriver')
@@ -22,6 +45,10 @@ def auth_keystore():
 def minio():
     return init_obj_store('localhost:9000', 'docriver-key', 'docriver-secret')
 
+@pytest.fixture(scope="session", autouse=True)
+def uploader():
+    return init_obj_store_uploader(4, 2)
+
 @pytest.fixture(scope="session", autouse=True)
 def scanner():
     return init_virus_scanner('127.0.0.1', 3310)
@@ -35,24 +62,160 @@ def metrics():
     return init_metrics()
 
 @pytest.fixture(scope="session", autouse=True)
-def client(connection_pool, minio, scanner, tracer, metrics):
-    app = core_client(connection_pool, minio, scanner, tracer, metrics, None, None, None, None, None, None)
+def client(connection_pool, minio, scanner, tracer, metrics, uploader):
+    app = core_client(connection_pool, minio, scanner, tracer, metrics, None, None, None, None, None, None, uploader=uploader)
     with app.test_client() as client:
         yield client
 
 @pytest.fixture(scope="session", autouse=True)
-def client_with_security(connection_pool, minio, scanner, tracer, metrics, auth_keystore):
-    app = core_client(connection_pool, minio, scanner, tracer, metrics, *auth_keystore, 'docriver')
+def client_with_security(connection_pool, minio, scanner, tracer, metrics, uploader, auth_keystore):
+    app = core_client(connection_pool, minio, scanner, tracer, metrics, *auth_keystore, 'docriver', uploader=uploader)
+    with app.test_client() as client:
+        yield client
+
+@pytest.fixture()
+def streaming_client(connection_pool, minio, scanner, tracer, metrics, uploader):
+    app = core_client(connection_pool, minio, scanner, tracer, metrics, None, None, None, None, None, None, streaming_ingest=True, uploader=uploader)
+    with app.test_client() as client:
+        yield client
+    # Restore the default (staged) ingest mode for the other tests
+    core_client(connection_pool, minio, scanner, tracer, metrics, None, None, None, None, None, None, uploader=uploader)
+
+@pytest.fixture()
+def tx_processor(connection_pool, minio, scanner, uploader):
+    processor = init_tx_processor(2, connection_pool, minio, scanner, 'docriver', untrusted_dir(), '/scandir', uploader)
+    yield processor
+    processor.shutdown()
+
+@pytest.fixture()
+def async_client(connection_pool, minio, scanner, tracer, metrics, uploader, tx_processor):
+    app = core_client(connection_pool, minio, scanner, tracer, metrics, None, None, None, None, None, None, uploader=uploader, tx_processor=tx_processor)
     with app.test_client() as client:
         yield client
+    core_client(connection_pool, minio, scanner, tracer, metrics, None, None, None, None, None, None, uploader=uploader)
+
+@pytest.fixture(params=['accel', 'presign'])
+def delivery_client(request, connection_pool, minio, scanner, tracer, metrics, uploader):
+    delivery = init_delivery(request.param, 'localhost:9000', None, 'docriver-key', 'docriver-secret', 'us-east-1', '/internal/objstore', 60)
+    app = core_client(connection_pool, minio, scanner, tracer, metrics, None, None, None, None, None, None, uploader=uploader, delivery=delivery)
+    with app.test_client() as client:
+        yield request.param, client
+    core_client(connection_pool, minio, scanner, tracer, metrics, None, None, None, None, None, None, uploader=uploader)
+
+@pytest.fixture()
+def replica_client(connection_pool, minio, scanner, tracer, metrics, uploader):
+    # The primary stands in for the replica
+    router = DbRouter(connection_pool, connection_pool, 1, 1)
+    app = core_client(router, minio, scanner, tracer, metrics, None, None, None, None, None, None, uploader=uploader)
+    with app.test_client() as client:
+        yield router, client
+    core_client(connection_pool, minio, scanner, tracer, metrics, None, None, None, None, None, None, uploader=uploader)
+
+@pytest.fixture()
+def sharded_client(tmp_path, connection_pool, minio, scanner, tracer, metrics, uploader):
+    # The shards are the test database too; what matters is which pool the requests get
+    map_file = str(tmp_path / 'shards.json')
+    save_shard_map(map_file, {'shards': {'s1': {'host': 'localhost'}}, 'realms': {TEST_REALM: 's1'}})
+    shard_pool = DbRouter(connection_pool)
+    router = ShardRouter(connection_pool, lambda name, config: shard_pool, map_file, 0)
+    app = core_client(router, minio, scanner, tracer, metrics, None, None, None, None, None, None, uploader=uploader)
+    with app.test_client() as client:
+        yield router, map_file, client
+    core_client(connection_pool, minio, scanner, tracer, metrics, None, None, None, None, None, None, uploader=uploader)
+
+@pytest.fixture()
+def shard_pool(connection_pool):
+    # The docriver_shard schema (see infrastructure/mysql/gateway-shard-init.sql), with the tables of the test database
+    pool = init_db(os.getenv('DOCRIVER_MYSQL_HOST', default='127.0.0.1'), 
+                   os.getenv('DOCRIVER_MYSQL_PORT', default=3306), 
+                   'docriver_shard',
+                   os.getenv('DOCRIVER_MYSQL_USER', default='docriver'), 
+                   os.getenv('DOCRIVER_MYSQL_PASSWORD', default='docriver'), 
+                   2, False, 'docriver-shard')
+    connection = pool.get_connection()
+    try:
+        cursor = connection.cursor()
+        for table, join, references in REALM_TABLES:
+            cursor.execute("CREATE TABLE IF NOT EXISTS {} LIKE docriver.{}".format(table, table))
+        cursor.close()
+        delete_realm(connection, TEST_REALM, 1000)
+    finally:
+        connection.close()
+    yield pool
+    connection = pool.get_connection()
+    try:
+        delete_realm(connection, TEST_REALM, 1000)
+    finally:
+        connection.close()
+    pool.shutdown()
+
+@pytest.fixture()
+def token_cache():
+    cache = init_token_cache(100)
+    yield cache
+    init_token_cache(0)
+
+@pytest.fixture()
+def jwks_server():
+    server = start_jwks_server()
+    yield server
+    server.shutdown()
+
+@pytest.fixture()
+def okta_validator(jwks_server):
+    # An OKTA authorization server stand-in: only its JWKS endpoint is needed
+    validator = OktaTokenValidator(OKTA_ISSUER, 'api://docriver', jwks_url(jwks_server), refresh_interval=3600, cache_size=100)
+    validator.key_set.min_refresh_interval = 0
+    yield jwks_server, validator.start()
+    validator.shutdown()
+
+@pytest.fixture()
+def jwks_client(connection_pool, minio, scanner, tracer, metrics, uploader, jwks_server):
+    keys = JwksKeySet({TEST_REALM: jwks_url(jwks_server)}, refresh_interval=3600, min_refresh_interval=0)
+    app = core_client(connection_pool, minio, scanner, tracer, metrics, None, None, None, None, keys, 'docriver', uploader=uploader)
+    with app.test_client() as client:
+        yield jwks_server, keys, client
+    core_client(connection_pool, minio, scanner, tracer, metrics, None, None, None, None, None, None, uploader=uploader)
+
+@pytest.fixture()
+def location_cache():
+    cache = init_location_cache(100, 60)
+    yield cache
+    init_location_cache(0, 0)
+
+@pytest.fixture()
+def body_cache(tmp_path):
+    cache = init_body_cache(str(tmp_path), 10*1024*1024, 1024*1024)
+    yield cache
+    init_body_cache(None, 0, 0)
+
+@pytest.fixture()
+def coalescing():
+    init_coalescing(1024*1024)
+    yield flights
+    init_coalescing(0)
+
+@pytest.fixture()
+def feed():
+    # No settle time: the tests do not write concurrently. The SSE streams are kept short
+    feed_service.init_feed(0, 0)
+    max_stream_seconds = feed_service.MAX_STREAM_SECONDS
+    feed_service.MAX_STREAM_SECONDS = 2
+    yield feed_service
+    feed_service.MAX_STREAM_SECONDS = max_stream_seconds
+    feed_service.init_feed(0, 1)
 
 @pytest.fixture()
 def cleanup(connection_pool, minio):
     connection = connection_pool.get_connection()
     cursor = connection.cursor()
     try:
+        # The event tables are partitioned and have no foreign keys to cascade the deletes
+        cursor.execute('DELETE FROM TX_EVENT')
+        cursor.execute('DELETE FROM DOC_EVENT')
         cursor.execute('DELETE FROM TX')
         cursor.execute('DELETE FROM DOC')
+        cursor.execute('DELETE FROM DOC_CONTENT')
         connection.commit()
 
         delete_obj_recursively(minio, 'docriver', TEST_REALM)
@@ -62,9 +225,9 @@ def cleanup(connection_pool, minio):
         if connection.is_connected():
             connection.close()
 
-def core_client(connection_pool, minio, scanner, tracer, metrics, auth_private_key, auth_public_key, auth_signer_cert, auth_signer_cn, auth_public_keys, auth_audience):
+def core_client(connection_pool, minio, scanner, tracer, metrics, auth_private_key, auth_public_key, auth_signer_cert, auth_signer_cn, auth_public_keys, auth_audience, streaming_ingest=False, uploader=None, tx_processor=None, delivery=None):
     logging.basicConfig(level='INFO')
     app = init_app()
     app.config['TESTING'] = True
-    init_params(connection_pool, minio, scanner, 'docriver', untrusted_dir(), raw_dir(), '/scandir', auth_private_key, auth_public_key, auth_signer_cert, auth_signer_cn, auth_public_keys, auth_audience)
+    init_params(connection_pool, minio, scanner, 'docriver', untrusted_dir(), raw_dir(), '/scandir', auth_private_key, auth_public_key, auth_signer_cert, auth_signer_cn, auth_public_keys, auth_audience, streaming_ingest, uploader, tx_processor, delivery)
     return app
\ No newline at end of file
@@ -0,0 +1,62 @@
+import pytest
+import json
+
+from test.functional.fixture import cleanup, client, async_client, tx_processor, connection_pool, minio, scanner, tracer, metrics, uploader
+from test.functional.util import submit_inline_doc, assert_location, wait_for_tx_status, untrusted_dir, TEST_REALM
+from model.tx_submit_service import pending_manifest_filenames, save_pending_manifest
+
+def test_async_submission(cleanup, connection_pool, minio, async_client):
+    response = async_client.post('/tx/{}?async=true'.format(TEST_REALM),
+        json={'tx': '1', 'documents': [{'document': 'a001', 'type': 'sample', 'content': {'mimeType': 'text/plain', 'inline': 'Hello world'}}]},
+        headers={'Accept': 'application/json'})
+    assert 202 == response.status_code
+    assert 'accepted' == response.json['dr:status']
+    assert '/tx/{}/1'.format(TEST_REALM) == response.headers['Location']
+
+    assert 'C' == wait_for_tx_status(connection_pool, '1')[0]
+    connection = connection_pool.get_connection()
+    cursor = None
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+                SELECT e.STATUS
+                FROM TX t, TX_EVENT e
+                WHERE e.TX_ID = t.ID
+                ORDER BY e.ID
+            """)
+        assert [('P',), ('C',)] == cursor.fetchall()
+        cursor.execute("SELECT LOCATION_URL FROM DOC_VERSION")
+        rows = cursor.fetchall()
+        assert 1 == len(rows)
+        assert_location(minio, rows[0][0])
+    finally:
+        if cursor:
+            cursor.close()
+        if connection.is_connected():
+            connection.close()
+    # The staging area and the pending manifest are gone
+    assert 0 == len(pending_manifest_filenames(untrusted_dir()))
+
+def test_async_infected_doc_submission(cleanup, connection_pool, minio, async_client):
+    result = submit_inline_doc(async_client, ('file:eicar.txt', '1', 'v001', None, 'text/plain'), headers={'Prefer': 'respond-async'})
+    assert (202, 'accepted') == result
+    status, description = wait_for_tx_status(connection_pool, '1')
+    assert 'F' == status and description.startswith('Virus check failed on file')
+    assert 0 == len(list(minio.list_objects('docriver', prefix=TEST_REALM, recursive=True)))
+    assert 0 == len(pending_manifest_filenames(untrusted_dir()))
+
+def test_async_not_enabled(cleanup, client):
+    # Without transaction processors the preference is ignored
+    assert (200, 'ok') == submit_inline_doc(client, ('Hello world', '1', 'd001', None, 'text/plain'), headers={'Prefer': 'respond-async'})
+
+def test_pending_manifest_snipped(tmp_path):
+    payload = {'tx': '1', 'authorization': 'Bearer x', 'dr:realm': TEST_REALM,
+               'documents': [{'document': 'a001', 'type': 'sample', 'content': {'mimeType': 'text/plain', 'inline': 'Hello world'}},
+                             {'document': 'a002', 'type': 'sample'}]}
+    with open(save_pending_manifest(str(tmp_path), payload), 'r') as file:
+        manifest = json.load(file)
+    assert '<snipped>' == manifest['documents'][0]['content']['inline']
+    assert 'authorization' not in manifest
+    # The payload is left as it was
+    assert 'Hello world' == payload['documents'][0]['content']['inline']
+    assert 'Bearer x' == payload['authorization']
@@ -1,11 +1,13 @@
 import pytest
 import sys
 import os
+import time
 from docriver_auth.keystore import get_entries
 from docriver_auth.auth_token import issue
+from model.policy import get_policy
 
-from test.functional.fixture import cleanup, client, connection_pool, minio, scanner, tracer, metrics, auth_keystore, client_with_security
-from test.functional.util import submit_inline_doc, TEST_REALM, issuer_keystore_path, delete_docs
+from test.functional.fixture import cleanup, client, connection_pool, minio, scanner, tracer, metrics, auth_keystore, client_with_security, uploader, token_cache
+from test.functional.util import submit_inline_doc, inline_doc_message, TEST_REALM, issuer_keystore_path, delete_docs
 
 def test_notoken(cleanup, client_with_security):
     result = submit_inline_doc(client_with_security, ('file:sample.pdf', '1', 'd001', 'base64', 'application/pdf'))
@@ -69,6 +71,31 @@ def test_successful_reference(cleanup, client_with_security):
         tx_references=[{'resourceType':'t1-claim', 'resourceId': 't1', 'description': 't1 test description'}])
     assert (200,'ok') == result[0:2]
 
+def test_bad_document_reference_with_tx_reference(cleanup, client_with_security):
+    # The document's own references are checked along with the transaction's
+    private_key, public_key, signer_cert, signer_cn, public_keys = get_entries(issuer_keystore_path(TEST_REALM), 'docriver')
+    encoded = issue(private_key, signer_cn, 'unknown', 'docriver', 300, 'docriver', {'txType': 'submit', 'resourceType': '.*-claim'})
+    message = inline_doc_message('file:sample.pdf', '1', 'd001', 'base64', 'application/pdf', None, "Bearer " + encoded[0],
+        [{'resourceType':'t1-claim', 'resourceId': 't1', 'description': 't1 test description'}])
+    message['documents'][0]['references'] = [{'resourceType':'t1-bill', 'resourceId': 't1', 'description': 't1 test description'}]
+    response = client_with_security.post('/tx/' + TEST_REALM, json=message, headers={'Accept': 'application/json'})
+    assert 401 == response.status_code
+
+def test_good_document_reference_with_tx_reference(cleanup, client_with_security):
+    private_key, public_key, signer_cert, signer_cn, public_keys = get_entries(issuer_keystore_path(TEST_REALM), 'docriver')
+    encoded = issue(private_key, signer_cn, 'unknown', 'docriver', 300, 'docriver', {'txType': 'submit', 'resourceType': '.*-claim'})
+    message = inline_doc_message('file:sample.pdf', '1', 'd001', 'base64', 'application/pdf', None, "Bearer " + encoded[0],
+        [{'resourceType':'t1-claim', 'resourceId': 't1', 'description': 't1 test description'}])
+    message['documents'][0]['references'] = [{'resourceType':'t2-claim', 'resourceId': 't2', 'description': 't2 test description'}]
+    response = client_with_security.post('/tx/' + TEST_REALM, json=message, headers={'Accept': 'application/json'})
+    assert 200 == response.status_code
+
+def test_policy_cached_by_value():
+    # Equal permissions from different tokens (or decodes of the same token) share the compiled policy
+    policy = get_policy({'txType': 'submit', 'realm': TEST_REALM, 'resourceType': '.*-claim'})
+    assert policy is get_policy({'resourceType': '.*-claim', 'realm': TEST_REALM, 'txType': 'submit'})
+    assert policy is not get_policy({'txType': 'submit', 'realm': TEST_REALM, 'resourceType': '.*-bill'})
+
 def test_successful_delete(cleanup, client_with_security):
     result = submit_inline_doc(client_with_security, ('file:sample.pdf', '1', 'd001', 'base64', 'application/pdf'), keystore_file=issuer_keystore_path(TEST_REALM), permissions={'txType': 'submit'})
     assert (200,'ok') == result
@@ -155,4 +182,23 @@ def test_get_events_valid_realm(cleanup, client_with_security):
     response = client_with_security.get(f"/tx/{TEST_REALM}", headers={"Authorization": token, "Accept": "application/json"})
     assert 200 == response.status_code
 
-# TODO - add test for reference authorization
\ No newline at end of file
+# TODO - add test for reference authorization
+
+def test_get_document_token_cached(cleanup, client_with_security, token_cache):
+    result = submit_inline_doc(client_with_security, ('file:sample.pdf', '1', 'd001', 'base64', 'application/pdf'), keystore_file=issuer_keystore_path(TEST_REALM), permissions={'txType': 'submit'})
+    assert (200,'ok') == result
+
+    private_key, public_key, signer_cert, signer_cn, public_keys = get_entries(issuer_keystore_path(TEST_REALM), 'docriver')
+    encoded = issue(private_key, signer_cn, 'unknown', 'docriver', 2, 'docriver', {'txType': 'get-document', 'document': '.*'})
+    token = "Bearer " + encoded[0]
+
+    hits = token_cache.stats['hit']
+    for i in range(3):
+        response = client_with_security.get('/document/' + TEST_REALM + '/d001', headers={'Authorization': token})
+        assert 200 == response.status_code
+    assert hits + 2 == token_cache.stats['hit']
+
+    # Not served from the cache once expired
+    time.sleep(3)
+    response = client_with_security.get('/document/' + TEST_REALM + '/d001', headers={'Authorization': token})
+    assert 401 == response.status_code
@@ -0,0 +1,58 @@
+import pytest
+import json
+import threading
+import time
+
+from test.functional.fixture import cleanup, client, connection_pool, minio, scanner, tracer, metrics, uploader, feed
+from test.functional.util import submit_inline_doc, delete_docs, TEST_REALM
+
+def get_feed(client, params={}, headers={}):
+    return client.get('/feed/{}'.format(TEST_REALM), query_string=params, headers={'Accept': 'application/json', **headers})
+
+def test_feed_long_poll(cleanup, client, feed):
+    # Without a cursor the feed starts from now
+    response = get_feed(client)
+    assert 200 == response.status_code
+    assert [] == response.json['events']
+    cursor = response.json['next']
+
+    assert (200, 'ok') == submit_inline_doc(client, ('Hello world', '1', 'd001', None, 'text/plain'))
+    response = get_feed(client, {'after': cursor})
+    assert [('tx', 'I'), ('document', 'I')] == [(event['source'], event['status']) for event in response.json['events']]
+    assert 'd001' == response.json['events'][1]['document']
+    assert '1' == response.json['events'][1]['tx']
+    cursor = response.json['next']
+    assert cursor == response.json['events'][-1]['cursor']
+
+    # Woken up by the delete transaction
+    threading.Timer(1, lambda: delete_docs(client.application.test_client(), '2', ['d001'])).start()
+    start = time.time()
+    response = get_feed(client, {'after': cursor, 'timeout': 10})
+    assert time.time() - start < 10
+    assert ('document', 'D') == (response.json['events'][-1]['source'], response.json['events'][-1]['status'])
+
+def test_feed_long_poll_timeout(cleanup, client, feed):
+    cursor = get_feed(client).json['next']
+    start = time.time()
+    response = get_feed(client, {'after': cursor, 'timeout': 1})
+    assert time.time() - start >= 1
+    assert [] == response.json['events']
+    assert cursor == response.json['next']
+
+def test_feed_invalid_cursor(cleanup, client, feed):
+    assert 400 == get_feed(client, {'after': 'invalid'}).status_code
+
+def test_feed_invalid_timeout(cleanup, client, feed):
+    assert 400 == get_feed(client, {'timeout': 'soon'}).status_code
+
+def test_feed_sse(cleanup, client, feed):
+    cursor = get_feed(client).json['next']
+    assert (200, 'ok') == submit_inline_doc(client, ('Hello world', '1', 'd001', None, 'text/plain'))
+    response = get_feed(client, headers={'Accept': 'text/event-stream', 'Last-Event-ID': cursor})
+    assert 200 == response.status_code
+    assert response.headers['Content-Type'].startswith('text/event-stream')
+    messages = [message for message in response.data.decode('utf-8').split('\n\n') if 'data: ' in message]
+    assert 2 == len(messages)
+    fields = dict([line.split(': ', 1) for line in messages[1].split('\n')])
+    assert 'document' == fields['event']
+    assert fields['id'] == json.loads(fields['data'])['cursor']
@@ -0,0 +1,49 @@
+import pytest
+import threading
+import time
+from mysql.connector.errors import PoolError
+
+from test.functional.fixture import metrics, small_pool
+
+def query(connection):
+    cursor = connection.cursor()
+    try:
+        cursor.execute('SELECT 1')
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+def test_pool_prewarm(small_pool):
+    assert 1 == small_pool.prewarm()
+    assert 1 == len(small_pool.idle)
+    connection = small_pool.get_connection()
+    assert 1 == query(connection)
+    connection.close()
+    # Returned and reused
+    assert 1 == len(small_pool.idle)
+    assert 1 == small_pool.opened
+
+def test_pool_wait(small_pool):
+    connection = small_pool.get_connection()
+    threading.Timer(0.5, connection.close).start()
+    start = time.time()
+    # Queued until the connection is returned instead of failing at once
+    waiter = small_pool.get_connection()
+    assert time.time() - start >= 0.5
+    assert 1 == query(waiter)
+    waiter.close()
+
+def test_pool_timeout(small_pool):
+    connection = small_pool.get_connection()
+    start = time.time()
+    with pytest.raises(PoolError):
+        small_pool.get_connection()
+    assert time.time() - start >= 1
+    connection.close()
+
+def test_pool_validate(small_pool):
+    connection = small_pool.get_connection()
+    connection.close()
+    # Validated (and kept) since the validation interval is 0
+    assert (1, 0) == small_pool.validate()
+    assert 1 == len(small_pool.idle)
@@ -0,0 +1,28 @@
+import pytest
+import urllib.request
+
+from test.functional.fixture import cleanup, client, delivery_client, connection_pool, minio, scanner, tracer, metrics, uploader
+from test.functional.util import submit_inline_doc, TEST_REALM
+
+def test_document_delivery(cleanup, delivery_client):
+    mode, client = delivery_client
+    result = submit_inline_doc(client, ('file:sample.pdf', '1', 'd001', 'base64', 'application/pdf'))
+    assert (200,'ok') == result
+    response = client.get('/document/' + TEST_REALM + '/d001')
+    # The gateway never returns the content in these modes
+    assert 0 == len(response.data)
+    if mode == 'accel':
+        assert 200 == response.status_code
+        assert response.headers['X-Accel-Redirect'].startswith('/internal/objstore/docriver/{}/d001-'.format(TEST_REALM))
+        assert 'X-Amz-Signature=' in response.headers['X-Accel-Redirect']
+        url = 'http://localhost:9000' + response.headers['X-Accel-Redirect'][len('/internal/objstore'):]
+    else:
+        assert 307 == response.status_code
+        url = response.headers['Location']
+    with urllib.request.urlopen(url) as stream:
+        assert 'application/pdf' == stream.headers['Content-Type']
+        assert len(stream.read()) > 0
+
+def test_document_delivery_not_found(cleanup, delivery_client):
+    mode, client = delivery_client
+    assert 404 == client.get('/document/' + TEST_REALM + '/unknown').status_code
@@ -0,0 +1,38 @@
+import pytest
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+
+from docriver_auth.auth_token import issue
+from docriver_auth.jwks import to_jwks, key_id
+from test.functional.fixture import cleanup, client, connection_pool, minio, scanner, tracer, metrics, uploader, jwks_server, jwks_client
+from test.functional.util import submit_inline_doc, TEST_REALM
+
+def get_document(client, private_key):
+    encoded = issue(private_key, TEST_REALM, 'unknown', 'docriver', 60, 'docriver', {'txType': 'get-document', 'document': '.*'}, key_id(private_key.public_key()))
+    return client.get('/document/' + TEST_REALM + '/d001', headers={'Authorization': 'Bearer ' + encoded[0]})
+
+def test_jwks_eddsa_es256(cleanup, client, jwks_client):
+    server, keys, secure_client = jwks_client
+    assert (200, 'ok') == submit_inline_doc(client, ('Hello world', '1', 'd001', None, 'text/plain'))
+
+    ed_key = ed25519.Ed25519PrivateKey.generate()
+    ec_key = ec.generate_private_key(ec.SECP256R1())
+    server.jwks = to_jwks([ed_key.public_key(), ec_key.public_key()])
+    assert 200 == get_document(secure_client, ed_key).status_code
+    assert 200 == get_document(secure_client, ec_key).status_code
+
+def test_jwks_rotation(cleanup, client, jwks_client):
+    server, keys, secure_client = jwks_client
+    assert (200, 'ok') == submit_inline_doc(client, ('Hello world', '1', 'd001', None, 'text/plain'))
+
+    old_key = ed25519.Ed25519PrivateKey.generate()
+    server.jwks = to_jwks([old_key.public_key()])
+    assert 200 == get_document(secure_client, old_key).status_code
+    refreshes = keys.stats['refresh']
+
+    # The new kid is fetched on first use
+    new_key = ed25519.Ed25519PrivateKey.generate()
+    server.jwks = to_jwks([new_key.public_key()])
+    assert 200 == get_document(secure_client, new_key).status_code
+    assert refreshes + 1 == keys.stats['refresh']
+    # The retired key is no longer accepted
+    assert 401 == get_document(secure_client, old_key).status_code
@@ -1,6 +1,6 @@
 import pytest
 
-from test.functional.fixture import cleanup, client, connection_pool, minio, scanner, tracer, metrics
+from test.functional.fixture import cleanup, client, connection_pool, minio, scanner, tracer, metrics, uploader
 from test.functional.util import submit_multipart_docs
 
 def test_multipart_files_submission_no_manifest(cleanup, client):
@@ -0,0 +1,70 @@
+import datetime
+import threading
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from docriver_auth.exceptions import AuthorizationException
+from docriver_auth.jwks import to_jwks, key_id
+from test.functional.fixture import jwks_server, okta_validator
+from test.functional.util import OKTA_ISSUER
+
+def okta_token(private_key, issuer=OKTA_ISSUER, audience='api://docriver', expires=60):
+    ts = datetime.datetime.now(datetime.timezone.utc)
+    payload = {'iss': issuer, 'aud': audience, 'iat': ts, 'exp': ts + datetime.timedelta(seconds=expires),
+               'sub': 'user@example.com', 'docriverPermissions': '{"realms": ["test123456"]}'}
+    return jwt.encode(payload, private_key, algorithm='RS256', headers={'kid': key_id(private_key.public_key())})
+
+def test_okta_verify(okta_validator):
+    server, validator = okta_validator
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    server.jwks = to_jwks([key.public_key()])
+
+    token = okta_token(key)
+    assert 'user@example.com' == validator.verify(token)['sub']
+    assert 'user@example.com' == validator.verify(token)['sub']
+    assert 1 == validator.cache.stats['hit']
+
+    with pytest.raises(AuthorizationException):
+        validator.verify(okta_token(key, audience='api://other'))
+    with pytest.raises(AuthorizationException):
+        validator.verify(okta_token(key, issuer='https://other.test/oauth2/default'))
+    with pytest.raises(AuthorizationException):
+        validator.verify(okta_token(key, expires=-3600))
+    with pytest.raises(AuthorizationException):
+        validator.verify(okta_token(rsa.generate_private_key(public_exponent=65537, key_size=2048)))
+
+def test_okta_verify_rotation(okta_validator):
+    server, validator = okta_validator
+    old_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    server.jwks = to_jwks([old_key.public_key()])
+    old_token = okta_token(old_key)
+    assert 'user@example.com' == validator.verify(old_token)['sub']
+
+    # The new key is fetched on its first use. The tokens of the retired key are not accepted once its key is gone, cached or not
+    new_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    server.jwks = to_jwks([new_key.public_key()])
+    assert 'user@example.com' == validator.verify(okta_token(new_key))['sub']
+    with pytest.raises(AuthorizationException):
+        validator.verify(old_token)
+
+def test_okta_verify_concurrent(okta_validator):
+    server, validator = okta_validator
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    server.jwks = to_jwks([key.public_key()])
+    tokens = [okta_token(key) for i in range(10)]
+
+    errors = []
+    def verify():
+        try:
+            for i in range(20):
+                for token in tokens:
+                    assert 'user@example.com' == validator.verify(token)['sub']
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=verify) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [] == errors
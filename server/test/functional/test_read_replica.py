@@ -0,0 +1,46 @@
+import pytest
+import time
+
+from test.functional.fixture import cleanup, client, connection_pool, minio, scanner, tracer, metrics, uploader, replica_client, location_cache
+from test.functional.util import submit_inline_doc, inline_doc_message, TEST_REALM
+
+def get_document(client):
+    return client.get('/document/' + TEST_REALM + '/d001')
+
+def test_read_your_writes(cleanup, replica_client):
+    router, client = replica_client
+    response = client.post('/tx/' + TEST_REALM, json=inline_doc_message('Hello world', '1', 'd001', None, 'text/plain', None, None, None))
+    assert 200 == response.status_code
+    assert 'drWrittenAt' in response.headers['Set-Cookie']
+
+    # Right after the write, the reads of the realm go to the primary
+    primary = router.stats['primary']
+    response = get_document(client)
+    assert 200 == response.status_code
+    assert b'Hello world' == response.data
+    assert primary + 1 == router.stats['primary']
+
+def test_read_your_writes_location_cache(cleanup, replica_client, location_cache):
+    router, client = replica_client
+    response = client.post('/tx/' + TEST_REALM, json=inline_doc_message('Hello world', '1', 'd001', None, 'text/plain', None, None, None))
+    assert 200 == response.status_code
+
+    # A location cached from a lagging replica (here, one that does not exist) is not used by the client that just wrote
+    location_cache.entries[(TEST_REALM, 'd001')] = (time.time() + 60, ('s3://docriver/' + TEST_REALM + '/stale', 'text/plain', 1, 0, None, None, None))
+    hits = location_cache.stats['hit']
+    response = get_document(client)
+    assert 200 == response.status_code
+    assert b'Hello world' == response.data
+    assert hits == location_cache.stats['hit']
+
+def test_read_from_replica(cleanup, replica_client):
+    router, client = replica_client
+    assert (200, 'ok') == submit_inline_doc(client, ('Hello world', '1', 'd001', None, 'text/plain'))
+
+    # Once the consistency window has passed (and for a client without the cookie), the reads go to the replica, or to the primary if the replica cannot be checked
+    router.written.clear()
+    reads = router.stats['replica'] + router.stats['fallback']
+    response = get_document(client.application.test_client())
+    assert 200 == response.status_code
+    assert b'Hello world' == response.data
+    assert reads + 1 == router.stats['replica'] + router.stats['fallback']
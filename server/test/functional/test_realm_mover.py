@@ -0,0 +1,102 @@
+import pytest
+
+from test.functional.fixture import cleanup, client, connection_pool, minio, scanner, tracer, metrics, uploader, shard_pool
+from test.functional.util import submit_inline_doc, delete_docs, TEST_REALM
+from shard_router import load_shard_map, save_shard_map
+from model.realm_mover import copy_realm, count_realm, move_realm
+from dao.tx import create_tx, create_tx_event
+
+# The rows of the realm without their IDs, which differ between the shards: the references are followed to the natural keys
+SNAPSHOT_QUERIES = [
+    """SELECT t.TX, t.TX_TYPE, t.PRINCIPAL, e.EVENT, e.STATUS, e.DESCRIPTION
+        FROM TX t JOIN TX_EVENT e ON e.TX_ID = t.ID
+        WHERE t.REALM = %s ORDER BY t.TX, e.ID""",
+    """SELECT c.DIGEST, c.METADATA_DIGEST, c.LOCATION_URL, c.SIZE, c.REF_COUNT
+        FROM DOC_CONTENT c WHERE c.REALM = %s ORDER BY c.LOCATION_URL""",
+    """SELECT d.DOCUMENT, d.STATUS, d.LOCATION_URL, d.MIME_TYPE, v.LOCATION_URL, e.STATUS
+        FROM DOC d LEFT JOIN DOC_VERSION v ON v.ID = d.VERSION_ID LEFT JOIN DOC_EVENT e ON e.ID = d.EVENT_ID
+        WHERE d.REALM = %s ORDER BY d.DOCUMENT""",
+    """SELECT d.DOCUMENT, v.TYPE, v.MIME_TYPE, v.LOCATION_URL, x.TX, c.DIGEST
+        FROM DOC_VERSION v JOIN DOC d ON d.ID = v.DOC_ID LEFT JOIN TX x ON x.ID = v.TX_ID LEFT JOIN DOC_CONTENT c ON c.ID = v.CONTENT_ID
+        WHERE d.REALM = %s ORDER BY d.DOCUMENT, v.ID""",
+    """SELECT d.DOCUMENT, v.LOCATION_URL, r.RESOURCE_TYPE, r.RESOURCE_ID, r.DESCRIPTION, x.TX, p.KEY_NAME, p.VALUE
+        FROM DOC_REF r JOIN DOC_VERSION v ON v.ID = r.DOC_VERSION_ID JOIN DOC d ON d.ID = v.DOC_ID
+            LEFT JOIN TX x ON x.ID = r.TX_ID LEFT JOIN DOC_REF_PROPERTY p ON p.REF_ID = r.ID
+        WHERE d.REALM = %s ORDER BY d.DOCUMENT, r.ID, p.KEY_NAME""",
+    """SELECT d.DOCUMENT, e.STATUS, e.DESCRIPTION, rd.DOCUMENT, rx.TX, v.LOCATION_URL
+        FROM DOC_EVENT e JOIN DOC d ON d.ID = e.DOC_ID LEFT JOIN DOC rd ON rd.ID = e.REF_DOC_ID
+            LEFT JOIN TX rx ON rx.ID = e.REF_TX_ID LEFT JOIN DOC_VERSION v ON v.ID = e.DOC_VERSION_ID
+        WHERE d.REALM = %s ORDER BY e.ID"""
+]
+
+def snapshot(pool):
+    connection = pool.get_connection()
+    cursor = connection.cursor()
+    try:
+        rows = []
+        for query in SNAPSHOT_QUERIES:
+            cursor.execute(query, (TEST_REALM,))
+            rows.append(cursor.fetchall())
+        return rows
+    finally:
+        cursor.close()
+        connection.close()
+
+def submit_docs(client):
+    references = [{'resourceType': 'claim', 'resourceId': 'c1', 'description': 'claim c1'}]
+    assert (200, 'ok') == submit_inline_doc(client, ('Hello world', '1', 'd001', None, 'text/plain'), tx_references=references)
+    assert (200, 'ok') == submit_inline_doc(client, ('Goodbye world', '2', 'd002', None, 'text/plain'))
+    # Same content as d001
+    assert (200, 'ok') == submit_inline_doc(client, ('Hello world', '3', 'd003', None, 'text/plain'))
+    assert (200, 'ok') == submit_inline_doc(client, ('Hello again', '4', 'd004', None, 'text/plain'), replaces='d002')
+    assert (200, 'ok') == delete_docs(client, '5', ['d003'])[0:2]
+
+def test_copy_realm(cleanup, client, connection_pool, shard_pool):
+    submit_docs(client)
+    source = connection_pool.get_connection()
+    target = shard_pool.get_connection()
+    try:
+        # Small batches, so that the copy resumes from the last ID
+        copied = copy_realm(source, target, TEST_REALM, 2)
+        assert count_realm(source, TEST_REALM) == copied
+        assert copied == count_realm(target, TEST_REALM)
+        assert all([copied[table] for table in ['TX', 'DOC_CONTENT', 'DOC', 'DOC_VERSION', 'DOC_REF', 'TX_EVENT', 'DOC_EVENT']])
+    finally:
+        source.close()
+        target.close()
+    assert snapshot(connection_pool) == snapshot(shard_pool)
+
+def test_move_realm(cleanup, client, connection_pool, shard_pool, tmp_path):
+    submit_docs(client)
+    expected = snapshot(connection_pool)
+    map_file = str(tmp_path / 'shards.json')
+    save_shard_map(map_file, {'shards': {'s1': {'host': 'localhost'}}})
+    pools = {'default': connection_pool, 's1': shard_pool}
+
+    move_realm(map_file, TEST_REALM, 's1', lambda shard: pools[shard].get_connection(), 0, 2)
+    assert {'s1': {'host': 'localhost'}} == load_shard_map(map_file)['shards']
+    assert 's1' == load_shard_map(map_file)['realms'][TEST_REALM]
+    assert not load_shard_map(map_file)['moving']
+    assert expected == snapshot(shard_pool)
+    assert [[]] * len(SNAPSHOT_QUERIES) == snapshot(connection_pool)
+
+def test_move_realm_pending(cleanup, client, connection_pool, shard_pool, tmp_path):
+    assert (200, 'ok') == submit_inline_doc(client, ('Hello world', '1', 'd001', None, 'text/plain'))
+    # Accepted in the asynchronous mode, not processed yet
+    connection = connection_pool.get_connection()
+    cursor = connection.cursor()
+    try:
+        create_tx_event(cursor, create_tx({'tx': '2', 'dr:realm': TEST_REALM, 'dr:principal': 'test'}, 'submit', cursor), 'ACCEPTED', 'P')
+        connection.commit()
+    finally:
+        cursor.close()
+        connection.close()
+
+    map_file = str(tmp_path / 'shards.json')
+    save_shard_map(map_file, {'shards': {'s1': {'host': 'localhost'}}})
+    pools = {'default': connection_pool, 's1': shard_pool}
+    with pytest.raises(ValueError):
+        move_realm(map_file, TEST_REALM, 's1', lambda shard: pools[shard].get_connection(), 0, 100)
+    assert TEST_REALM not in load_shard_map(map_file).get('realms', {})
+    assert not load_shard_map(map_file).get('moving')
+    assert [[]] * len(SNAPSHOT_QUERIES) == snapshot(shard_pool)
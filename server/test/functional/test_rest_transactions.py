@@ -2,9 +2,13 @@ import pytest
 import sys
 import os
 import time
+import threading
+import concurrent.futures
 
-from test.functional.fixture import cleanup, client, connection_pool, minio, scanner, tracer, metrics
+from test.functional.fixture import cleanup, client, connection_pool, minio, scanner, tracer, metrics, uploader, location_cache, body_cache, coalescing
 from test.functional.util import submit_inline_doc, submit_path_doc, submit_path_docs, assert_location, exec_get_events, submit_ref_doc, delete_docs, TEST_REALM
+import model.document_service as document_service
+from model.location_cache import get_location, invalidate_locations
 
 def test_health(client):
     response = client.get('/health')
@@ -87,6 +91,40 @@ def test_db_and_storage_after_submission_success(cleanup, connection_pool, minio
         if connection.is_connected():
             connection.close()
 
+def test_content_deduplication(cleanup, connection_pool, minio, client):
+    result = submit_inline_doc(client, ('file:sample.pdf', '1', 'd001', 'base64', 'application/pdf'))
+    assert (200,'ok') == result
+    result = submit_inline_doc(client, ('file:sample.pdf', '2', 'd002', 'base64', 'application/pdf'))
+    assert (200,'ok') == result
+    result = submit_inline_doc(client, ('file:sample.jpg', '3', 'd003', 'base64', 'image/jpeg'))
+    assert (200,'ok') == result
+    connection = connection_pool.get_connection()
+    cursor = None
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+                SELECT d.DOCUMENT, v.LOCATION_URL, c.REF_COUNT
+                FROM DOC d, DOC_VERSION v, DOC_CONTENT c
+                WHERE v.DOC_ID = d.ID
+                    AND v.CONTENT_ID = c.ID
+                ORDER BY d.DOCUMENT
+            """)
+        rows = cursor.fetchall()
+        assert 3 == len(rows)
+        assert rows[0][1] == rows[1][1]
+        assert (2, 2, 1) == (rows[0][2], rows[1][2], rows[2][2])
+        assert rows[0][1] != rows[2][1]
+        assert 2 == len(list(minio.list_objects('docriver', prefix=TEST_REALM, recursive=True)))
+    finally:
+        if cursor:
+            cursor.close()
+        if connection.is_connected():
+            connection.close()
+
+    response = client.get('/document/' + TEST_REALM + '/d002')
+    assert 200 == response.status_code
+    assert 'application/pdf' == response.headers['Content-Type']
+
 def test_doc_replacement(cleanup, connection_pool, client):
     result = submit_inline_doc(client, ('file:sample.pdf', '1', 'd001', 'base64', 'application/pdf'))
     assert (200,'ok') == result
@@ -414,4 +452,245 @@ def test_document_get_events_with_limits(cleanup, connection_pool, client):
     response = client.get(f"/tx/{TEST_REALM}", query_string={'from': start, 'to': end}, headers={"Accept": "application/json"})
     assert 200 == response.status_code
     json_result = response.json
-    assert 2 == len(json_result)
\ No newline at end of file
+    assert 2 == len(json_result)
+
+def test_doc_current_state(cleanup, connection_pool, client):
+    result = submit_inline_doc(client, ('file:sample.pdf', '1', 'd001', 'base64', 'application/pdf'))
+    assert (200,'ok') == result
+    result = submit_inline_doc(client, ('Hello world', '2', 'd002', None, 'text/plain'), replaces='d001')
+    assert (200,'ok') == result
+    connection = connection_pool.get_connection()
+    cursor = None
+    try:
+        cursor = connection.cursor()
+        query = """
+                SELECT d.DOCUMENT, d.STATUS, d.MIME_TYPE, d.LOCATION_URL = v.LOCATION_URL
+                FROM DOC d, DOC_VERSION v
+                WHERE v.ID = d.VERSION_ID
+                ORDER BY d.ID
+            """
+        cursor.execute(query)
+        assert [('d001', 'R', 'application/pdf', 1), ('d002', 'I', 'text/plain', 1)] == cursor.fetchall()
+
+        result = delete_docs(client, '3', ['d002'])
+        assert (200,'ok') == result[0:2]
+        connection.commit()
+        cursor.execute(query)
+        assert [('d001', 'R', 'application/pdf', 1), ('d002', 'D', 'text/plain', 1)] == cursor.fetchall()
+    finally:
+        if cursor:
+            cursor.close()
+        if connection.is_connected():
+            connection.close()
+
+def test_doc_state_not_backfilled(cleanup, connection_pool, client):
+    result = submit_inline_doc(client, ('file:sample.pdf', '1', 'd001', 'base64', 'application/pdf'))
+    assert (200,'ok') == result
+    connection = connection_pool.get_connection()
+    cursor = None
+    try:
+        cursor = connection.cursor()
+        # As written before the current state columns existed
+        cursor.execute("UPDATE DOC SET VERSION_ID = NULL, EVENT_ID = NULL, STATUS = NULL, LOCATION_URL = NULL, MIME_TYPE = NULL")
+        connection.commit()
+
+        result = submit_inline_doc(client, ('Hello world', '2', 'd001', None, 'text/plain'))
+        assert 400 == result[0]
+        assert 'The document already exists' in result[1]
+
+        result = submit_inline_doc(client, ('Hello world', '3', 'd001', None, 'text/plain'), replaces='d001')
+        assert (200,'ok') == result
+        connection.commit()
+        cursor.execute("SELECT d.DOCUMENT, d.STATUS, d.MIME_TYPE, d.VERSION_ID = (SELECT MAX(v.ID) FROM DOC_VERSION v WHERE v.DOC_ID = d.ID) FROM DOC d")
+        assert [('d001', 'I', 'text/plain', 1)] == cursor.fetchall()
+    finally:
+        if cursor:
+            cursor.close()
+        if connection.is_connected():
+            connection.close()
+
+def test_document_get_range(cleanup, client):
+    result = submit_inline_doc(client, ('file:sample.pdf', '1', 'd001', 'base64', 'application/pdf'))
+    assert (200,'ok') == result
+    response = client.get('/document/' + TEST_REALM + '/d001')
+    assert 200 == response.status_code
+    assert 'bytes' == response.headers['Accept-Ranges']
+    content = response.data
+    assert len(content) == int(response.headers['Content-Length'])
+
+    response = client.get('/document/' + TEST_REALM + '/d001', headers={'Range': 'bytes=10-99'})
+    assert 206 == response.status_code
+    assert 'bytes 10-99/{}'.format(len(content)) == response.headers['Content-Range']
+    assert content[10:100] == response.data
+
+    response = client.get('/document/' + TEST_REALM + '/d001', headers={'Range': 'bytes=0-4,-5'})
+    assert 206 == response.status_code
+    assert response.headers['Content-Type'].startswith('multipart/byteranges')
+    assert content[0:5] in response.data and content[-5:] in response.data
+
+    response = client.get('/document/' + TEST_REALM + '/d001', headers={'Range': 'bytes={}-'.format(len(content))})
+    assert 416 == response.status_code
+
+def test_document_get_conditional(cleanup, client):
+    result = submit_inline_doc(client, ('file:sample.pdf', '1', 'd001', 'base64', 'application/pdf'))
+    assert (200,'ok') == result
+    response = client.get('/document/' + TEST_REALM + '/d001')
+    assert 200 == response.status_code
+    etag = response.headers['ETag']
+    last_modified = response.headers['Last-Modified']
+
+    response = client.get('/document/' + TEST_REALM + '/d001', headers={'If-None-Match': etag})
+    assert 304 == response.status_code
+    response = client.get('/document/' + TEST_REALM + '/d001', headers={'If-Modified-Since': last_modified})
+    assert 304 == response.status_code
+
+    result = submit_inline_doc(client, ('file:sample.jpg', '2', 'd001', 'base64', 'image/jpeg'), replaces='d001')
+    assert (200,'ok') == result
+    response = client.get('/document/' + TEST_REALM + '/d001', headers={'If-None-Match': etag})
+    assert 200 == response.status_code
+    assert etag != response.headers['ETag']
+
+def test_document_get_cached_location(cleanup, client, location_cache):
+    result = submit_inline_doc(client, ('file:sample.pdf', '1', 'd001', 'base64', 'application/pdf'))
+    assert (200,'ok') == result
+    assert 200 == client.get('/document/' + TEST_REALM + '/d001').status_code
+    response = client.get('/document/' + TEST_REALM + '/d001')
+    assert 200 == response.status_code
+    assert 1 == location_cache.stats['hit']
+
+    # A new version invalidates the cached location
+    result = submit_inline_doc(client, ('file:sample.jpg', '2', 'd001', 'base64', 'image/jpeg'), replaces='d001')
+    assert (200,'ok') == result
+    assert 1 == location_cache.stats['invalidation']
+    response = client.get('/document/' + TEST_REALM + '/d001')
+    assert 'image/jpeg' == response.headers['Content-Type']
+
+    result = delete_docs(client, '3', ['d001'])
+    assert (200,'ok') == result[0:2]
+    assert 404 == client.get('/document/' + TEST_REALM + '/d001').status_code
+
+def test_location_cache_invalidated_during_lookup(location_cache):
+    # A lookup in progress when the location is invalidated is neither cached nor shared with the requests that come after the invalidation
+    started = threading.Event()
+    release = threading.Event()
+    def old_lookup():
+        started.set()
+        release.wait()
+        return ('old', None, None, None, None, None, None)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        leader = executor.submit(location_cache.get, (TEST_REALM, 'd001'), old_lookup)
+        started.wait()
+        location_cache.invalidate([(TEST_REALM, 'd001')])
+        assert 'new' == location_cache.get((TEST_REALM, 'd001'), lambda: ('new', None, None, None, None, None, None))[0]
+        release.set()
+        assert 'old' == leader.result()[0]
+    assert 'new' == location_cache.get((TEST_REALM, 'd001'), lambda: ('newer', None, None, None, None, None, None))[0]
+
+def test_location_invalidated_during_shared_lookup(coalescing):
+    # Without the cache: a lookup in progress when the location is invalidated is not shared with the requests that come after the invalidation
+    started = threading.Event()
+    release = threading.Event()
+    def old_lookup():
+        started.set()
+        release.wait()
+        return ('old', None, None, None, None, None, None)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        leader = executor.submit(get_location, TEST_REALM, 'd001', old_lookup)
+        started.wait()
+        invalidate_locations(TEST_REALM, ['d001'])
+        assert 'new' == get_location(TEST_REALM, 'd001', lambda: ('new', None, None, None, None, None, None))[0]
+        release.set()
+        assert 'old' == leader.result()[0]
+
+def test_document_get_cached_body(cleanup, client, body_cache):
+    result = submit_inline_doc(client, ('file:sample.pdf', '1', 'd001', 'base64', 'application/pdf'))
+    assert (200,'ok') == result
+    response = client.get('/document/' + TEST_REALM + '/d001')
+    assert 200 == response.status_code
+    content = response.data
+    assert 1 == body_cache.stats['fill']
+
+    response = client.get('/document/' + TEST_REALM + '/d001')
+    assert 200 == response.status_code
+    assert content == response.data
+    assert 1 == body_cache.stats['hit']
+
+    response = client.get('/document/' + TEST_REALM + '/d001', headers={'Range': 'bytes=10-99'})
+    assert 206 == response.status_code
+    assert content[10:100] == response.data
+    assert 2 == body_cache.stats['hit']
+
+def test_document_get_coalesced(cleanup, client, coalescing, monkeypatch):
+    result = submit_inline_doc(client, ('file:sample.pdf', '1', 'd001', 'base64', 'application/pdf'))
+    assert (200,'ok') == result
+    content = client.get('/document/' + TEST_REALM + '/d001').data
+
+    # A slow lookup, so that the requests overlap
+    lookup_location = document_service.lookup_location
+    def slow_lookup_location(*args):
+        time.sleep(0.5)
+        return lookup_location(*args)
+    monkeypatch.setattr(document_service, 'lookup_location', slow_lookup_location)
+
+    calls = coalescing.stats['call'] + coalescing.stats['shared']
+    shared = coalescing.stats['shared']
+    def get(i):
+        # A client per thread, the requests are concurrent
+        with client.application.test_client() as c:
+            response = c.get('/document/' + TEST_REALM + '/d001')
+            return response.status_code, response.data
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        responses = list(executor.map(get, range(8)))
+    assert all([(200, content) == response for response in responses])
+    # Each request either led or shared the location lookup and the object read
+    assert calls + 16 == coalescing.stats['call'] + coalescing.stats['shared']
+    assert coalescing.stats['shared'] > shared
+
+    response = client.get('/document/' + TEST_REALM + '/d001', headers={'Range': 'bytes=10-99'})
+    assert 206 == response.status_code
+    assert content[10:100] == response.data
+
+def test_document_get_events_paginated(cleanup, connection_pool, client):
+    for i in range(5):
+        result = submit_inline_doc(client, ('Hello world', str(i), 'd00{}'.format(i), None, 'text/plain'))
+        assert (200,'ok') == result
+
+    documents = []
+    after = None
+    while True:
+        query_string = {'limit': 2}
+        if after:
+            query_string['after'] = after
+        response = client.get(f"/tx/{TEST_REALM}", query_string=query_string, headers={"Accept": "application/json"})
+        assert 200 == response.status_code
+        page = response.json
+        assert len(page['events']) <= 2
+        documents.extend([event['document'] for event in page['events']])
+        after = page['next']
+        if not after:
+            break
+    assert ['d000', 'd001', 'd002', 'd003', 'd004'] == documents
+
+    response = client.get(f"/tx/{TEST_REALM}", query_string={'limit': 3}, headers={"Accept": "application/x-ndjson"})
+    assert 200 == response.status_code
+    assert 'application/x-ndjson' == response.headers['Content-Type']
+    lines = response.data.decode('utf-8').splitlines()
+    assert 3 == len(lines)
+
+    response = client.get(f"/tx/{TEST_REALM}", query_string={'after': 'invalid'}, headers={"Accept": "application/json"})
+    assert 400 == response.status_code
+
+def test_document_get_events_invalid_limit(cleanup, client):
+    for limit in ['abc', 0]:
+        response = client.get(f"/tx/{TEST_REALM}", query_string={'limit': limit}, headers={"Accept": "application/json"})
+        assert 400 == response.status_code
+
+def test_document_get_events_version(cleanup, connection_pool, client):
+    # Each event is reported once, with the version it refers to
+    result = submit_inline_doc(client, ('file:sample.pdf', '1', 'd001', 'base64', 'application/pdf'))
+    assert (200,'ok') == result
+    result = submit_inline_doc(client, ('file:sample.jpg', '2', 'd001', 'base64', 'image/jpeg'), replaces='d001')
+    assert (200,'ok') == result
+    response = client.get(f"/tx/{TEST_REALM}", headers={"Accept": "application/json"})
+    assert 200 == response.status_code
+    assert [('I', 'application/pdf'), ('V', 'image/jpeg'), ('I', 'image/jpeg')] == [(event['status'], event['mime']) for event in response.json]
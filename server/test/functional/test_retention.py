@@ -0,0 +1,156 @@
+import pytest
+import io
+import time
+from datetime import date
+
+from test.functional.fixture import cleanup, client, connection_pool, minio, scanner, tracer, metrics, uploader, location_cache
+from test.functional.util import inline_doc_message, submit_inline_doc, delete_docs, TEST_REALM
+from model.retention import rollover_partitions, purge_expired, partition_name
+import model.retention as retention
+from dao.partition import get_partitions
+from model.reclaimer import Reclaimer
+from job_util import RateLimiter
+
+def submit_expiring_doc(client, tx, doc, expires_at):
+    payload = inline_doc_message('Hello world', tx, doc, None, 'text/plain', None, None, None)
+    payload['documents'][0]['expiresAt'] = expires_at
+    return client.post('/tx/' + TEST_REALM, json=payload, headers={'Accept': 'application/json'})
+
+def count_docs(connection_pool, doc):
+    connection = connection_pool.get_connection()
+    cursor = connection.cursor()
+    try:
+        cursor.execute("""
+            SELECT COUNT(*), (SELECT COUNT(*) FROM DOC_EVENT e, DOC d WHERE e.DOC_ID = d.ID AND d.DOCUMENT = %(doc)s)
+            FROM DOC WHERE DOCUMENT = %(doc)s
+            """, {'doc': doc})
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+        connection.close()
+
+def test_document_expiry(cleanup, connection_pool, minio, client):
+    response = submit_expiring_doc(client, '1', 'd001', int(time.time()) + 2)
+    assert 200 == response.status_code
+    # Different content, so that the object is not shared with d001
+    assert (200, 'ok') == submit_inline_doc(client, ('Goodbye world', '2', 'd002', None, 'text/plain'))
+    assert 200 == client.get('/document/' + TEST_REALM + '/d001').status_code
+
+    time.sleep(3)
+    # Expired documents are not served even before they are purged
+    assert 404 == client.get('/document/' + TEST_REALM + '/d001').status_code
+    assert (1, 1) == count_docs(connection_pool, 'd001')
+
+    connection = connection_pool.get_connection()
+    try:
+        assert (1, 1) == purge_expired(connection, minio, 10, RateLimiter(0))
+        assert (0, 0) == purge_expired(connection, minio, 10, RateLimiter(0))
+    finally:
+        connection.close()
+    assert (0, 0) == count_docs(connection_pool, 'd001')
+    assert 1 == len(list(minio.list_objects('docriver', prefix=TEST_REALM, recursive=True)))
+    assert 200 == client.get('/document/' + TEST_REALM + '/d002').status_code
+
+def test_document_expiry_cleared(cleanup, connection_pool, minio, client):
+    assert 200 == submit_expiring_doc(client, '1', 'd001', int(time.time()) + 2).status_code
+    # A new version without an expiry does not inherit the expiry of the earlier one
+    assert (200, 'ok') == submit_inline_doc(client, ('Goodbye world', '2', 'd001', None, 'text/plain'), replaces='d001')
+
+    time.sleep(3)
+    assert 200 == client.get('/document/' + TEST_REALM + '/d001').status_code
+    connection = connection_pool.get_connection()
+    try:
+        assert (0, 0) == purge_expired(connection, minio, 10, RateLimiter(0))
+    finally:
+        connection.close()
+    assert b'Goodbye world' == client.get('/document/' + TEST_REALM + '/d001').data
+
+def test_document_expiry_cached(cleanup, client, location_cache):
+    assert 200 == submit_expiring_doc(client, '1', 'd001', int(time.time()) + 2).status_code
+    assert 200 == client.get('/document/' + TEST_REALM + '/d001').status_code
+    assert 200 == client.get('/document/' + TEST_REALM + '/d001').status_code
+    assert 1 == location_cache.stats['hit']
+
+    # The cached location is not served past the expiry of the document, however long the TTL
+    time.sleep(3)
+    assert 404 == client.get('/document/' + TEST_REALM + '/d001').status_code
+
+def test_document_expiry_invalid(cleanup, client):
+    assert 400 == submit_expiring_doc(client, '1', 'd001', int(time.time()) - 1).status_code
+    assert 400 == submit_expiring_doc(client, '2', 'd001', 'tomorrow').status_code
+
+def test_partition_rollover(connection_pool):
+    connection = connection_pool.get_connection()
+    try:
+        rollover_partitions(connection, 2)
+        cursor = connection.cursor()
+        try:
+            for table in ['TX_EVENT', 'DOC_EVENT']:
+                names = [name for name, bound in get_partitions(cursor, table)]
+                assert partition_name(date.today()) in names
+                assert 'p_future' == names[-1]
+        finally:
+            cursor.close()
+        # Nothing left to add
+        assert ([], []) == rollover_partitions(connection, 2)['DOC_EVENT']
+    finally:
+        connection.close()
+
+def test_partition_rollover_unpartitioned(connection_pool, monkeypatch):
+    # TX is not partitioned, like the event tables of a database that has not been upgraded
+    monkeypatch.setattr(retention, 'PARTITIONED_TABLES', ['DOC_EVENT', 'TX'])
+    connection = connection_pool.get_connection()
+    try:
+        with pytest.raises(Exception, match='002-partition-events.sql'):
+            rollover_partitions(connection, 2)
+    finally:
+        connection.close()
+
+def test_reclaim_deleted_versions(cleanup, connection_pool, minio, client):
+    assert (200, 'ok') == submit_inline_doc(client, ('Hello world', '1', 'd001', None, 'text/plain'))
+    assert (200, 'ok') == submit_inline_doc(client, ('Goodbye world', '2', 'd002', None, 'text/plain'))
+    # Same content as d001
+    assert (200, 'ok') == submit_inline_doc(client, ('Hello world', '3', 'd003', None, 'text/plain'))
+    assert (200, 'ok') == delete_docs(client, '4', ['d001', 'd002'])[0:2]
+    assert 2 == len(list(minio.list_objects('docriver', prefix=TEST_REALM, recursive=True)))
+
+    reclaimer = Reclaimer(connection_pool, minio, 'docriver', 0, 0)
+    reclaimer.reclaim_versions()
+    assert 2 == reclaimer.stats['versions']
+    # The object shared with d003 is kept
+    assert 1 == reclaimer.stats['objects']
+    assert len('Goodbye world') == reclaimer.stats['bytes']
+    assert 200 == client.get('/document/' + TEST_REALM + '/d003').status_code
+
+    reclaimer.reclaim_versions()
+    assert 2 == reclaimer.stats['versions']
+
+def test_reclaim_superseded_versions(cleanup, connection_pool, minio, client):
+    assert (200, 'ok') == submit_inline_doc(client, ('Hello world', '1', 'd001', None, 'text/plain'))
+    assert (200, 'ok') == submit_inline_doc(client, ('Goodbye world', '2', 'd001', None, 'text/plain'), replaces='d001')
+    assert 2 == len(list(minio.list_objects('docriver', prefix=TEST_REALM, recursive=True)))
+
+    # Within the grace period
+    reclaimer = Reclaimer(connection_pool, minio, 'docriver', 3600, 0)
+    reclaimer.reclaim_versions()
+    assert 0 == reclaimer.stats['versions']
+
+    reclaimer = Reclaimer(connection_pool, minio, 'docriver', 0, 0)
+    reclaimer.reclaim_versions()
+    # The first version only
+    assert 1 == reclaimer.stats['versions']
+    assert len('Hello world') == reclaimer.stats['bytes']
+    response = client.get('/document/' + TEST_REALM + '/d001')
+    assert 200 == response.status_code
+    assert b'Goodbye world' == response.data
+
+def test_reclaim_orphans(cleanup, connection_pool, minio, client):
+    assert (200, 'ok') == submit_inline_doc(client, ('Hello world', '1', 'd001', None, 'text/plain'))
+    minio.put_object('docriver', TEST_REALM + '/orphan', io.BytesIO(b'orphan'), 6)
+
+    reclaimer = Reclaimer(connection_pool, minio, 'docriver', 0, 0)
+    reclaimer.reclaim_orphans()
+    assert 1 == reclaimer.stats['objects']
+    assert 6 == reclaimer.stats['bytes']
+    assert None == reclaimer.scan_after
+    assert 200 == client.get('/document/' + TEST_REALM + '/d001').status_code
@@ -0,0 +1,39 @@
+import pytest
+
+from test.functional.fixture import cleanup, client, connection_pool, minio, scanner, tracer, metrics, uploader, sharded_client
+from test.functional.util import submit_inline_doc, delete_docs, TEST_REALM
+from shard_router import load_shard_map, save_shard_map
+
+def test_shard_routing(cleanup, sharded_client):
+    router, map_file, client = sharded_client
+    assert 's1' == router.shard(TEST_REALM)
+    assert 'default' == router.shard('other')
+    assert router.pools['s1'] is router.pool(TEST_REALM)
+    assert router.default_pool is router.pool('other')
+
+    assert (200, 'ok') == submit_inline_doc(client, ('Hello world', '1', 'd001', None, 'text/plain'))
+    response = client.get('/document/' + TEST_REALM + '/d001')
+    assert 200 == response.status_code
+    assert b'Hello world' == response.data
+
+def test_shard_moving(cleanup, sharded_client):
+    router, map_file, client = sharded_client
+    assert (200, 'ok') == submit_inline_doc(client, ('Hello world', '1', 'd001', None, 'text/plain'))
+
+    shard_map = load_shard_map(map_file)
+    shard_map['moving'] = {TEST_REALM: 'default'}
+    save_shard_map(map_file, shard_map)
+    # Force the reload even if the modification time did not change at the file system's resolution
+    router.modified = None
+
+    # Read-only while moving
+    assert 503 == submit_inline_doc(client, ('Hello again', '2', 'd002', None, 'text/plain'))[0]
+    assert 503 == delete_docs(client, '3', ['d001'])[0]
+    assert 200 == client.get('/document/' + TEST_REALM + '/d001').status_code
+
+    del shard_map['moving']
+    shard_map['realms'] = {}
+    save_shard_map(map_file, shard_map)
+    router.modified = None
+    assert 'default' == router.shard(TEST_REALM)
+    assert (200, 'ok') == submit_inline_doc(client, ('Hello again', '2', 'd002', None, 'text/plain'))
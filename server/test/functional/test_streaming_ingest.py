@@ -0,0 +1,50 @@
+import pytest
+
+from test.functional.fixture import cleanup, client, streaming_client, connection_pool, minio, scanner, tracer, metrics, uploader
+from test.functional.util import submit_inline_doc, submit_path_doc, submit_path_docs, submit_multipart_docs, assert_location, TEST_REALM
+
+@pytest.mark.parametrize("test_case, input, expected", [
+    ('plain text', ('Hello world', '1', 'd001', None, 'text/plain'), (200, 'ok')),
+    ('pdf', ('file:sample.pdf', '2', 'd002', 'base64', 'application/pdf'),(200, 'ok')),
+    ('jpg', ('file:sample.jpg', '3', 'd003', 'base64', 'image/jpeg'),(200, 'ok')),
+    ('m4v', ('file:sample.m4v', '4', 'd004', 'base64', 'video/mp4'),(200, 'ok'))
+    ]
+)
+def test_streamed_inline_doc_submission(cleanup, streaming_client, test_case, input, expected):
+    assert expected == submit_inline_doc(streaming_client, input), test_case
+
+def test_streamed_path_doc_submission(cleanup, streaming_client):
+    assert (200, 'ok') == submit_path_doc(streaming_client, ('sample.pdf', '1', 'p001', 'application/pdf'))
+
+def test_streamed_multipart_submission(cleanup, streaming_client):
+    result = submit_multipart_docs(streaming_client, '1', ['sample.jpg', 'sample.pdf'])
+    assert (200,'ok') == result[0:2]
+
+def test_streamed_infected_doc_submission(cleanup, streaming_client, minio):
+    result = submit_inline_doc(streaming_client, ('file:eicar.txt', '1', 'v001', None, 'text/plain'))
+    assert 400 == result[0] and result[1].startswith('Virus check failed on file')
+    # Nothing must be left behind in the object store
+    assert 0 == len(list(minio.list_objects('docriver', prefix=TEST_REALM, recursive=True)))
+
+def test_streamed_magic_mismatch(cleanup, streaming_client, minio):
+    result = submit_inline_doc(streaming_client, ('file:sample.jpg', '1', 'm001', 'base64', 'application/pdf'))
+    assert 400 == result[0]
+    assert 0 == len(list(minio.list_objects('docriver', prefix=TEST_REALM, recursive=True)))
+
+def test_streamed_db_and_storage(cleanup, connection_pool, minio, streaming_client):
+    result = submit_path_docs(streaming_client, '1', 'doc-', excludes=['eicar.txt', 'manifest.json'])
+    assert (200, 'ok') == result[0:2]
+    connection = connection_pool.get_connection()
+    cursor = None
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT LOCATION_URL FROM DOC_VERSION")
+        rows = cursor.fetchall()
+        assert len(result[2]['documents']) == len(rows)
+        for row in rows:
+            assert_location(minio, row[0])
+    finally:
+        if cursor:
+            cursor.close()
+        if connection.is_connected():
+            connection.close()
@@ -0,0 +1,46 @@
+import pytest
+
+from test.functional.fixture import cleanup, client, async_client, tx_processor, connection_pool, minio, scanner, tracer, metrics, uploader
+from test.functional.util import submit_inline_doc, delete_docs, TEST_REALM
+
+def get_tx(client, tx, headers={}, params={}):
+    return client.get('/tx/{}/{}'.format(TEST_REALM, tx), query_string=params, headers={'Accept': 'application/json', **headers})
+
+def test_tx_status(cleanup, client):
+    assert (200, 'ok') == submit_inline_doc(client, ('Hello world', '1', 'd001', None, 'text/plain'))
+    response = get_tx(client, '1')
+    assert 200 == response.status_code
+    assert 'submit' == response.json['txType']
+    assert 'I' == response.json['status']
+    assert ['I'] == [event['status'] for event in response.json['events']]
+    assert [('d001', 'INGESTION', 'I')] == [(document['document'], document['event'], document['status']) for document in response.json['documents']]
+    assert response.json['documents'][0]['location'].startswith('s3://docriver/{}/d001-'.format(TEST_REALM))
+
+    assert (200, 'ok') == delete_docs(client, '2', ['d001'])[0:2]
+    response = get_tx(client, '2')
+    assert 'delete' == response.json['txType']
+    assert [('d001', 'DELETE', 'D')] == [(document['document'], document['event'], document['status']) for document in response.json['documents']]
+
+def test_tx_status_not_found(cleanup, client):
+    assert 404 == get_tx(client, 'unknown').status_code
+
+def test_tx_status_not_modified(cleanup, client):
+    assert (200, 'ok') == submit_inline_doc(client, ('Hello world', '1', 'd001', None, 'text/plain'))
+    response = get_tx(client, '1')
+    etag = response.headers['ETag']
+    response = get_tx(client, '1', headers={'If-None-Match': etag})
+    assert 304 == response.status_code
+    assert etag == response.headers['ETag']
+    assert 200 == get_tx(client, '1', headers={'If-None-Match': '"0-0"'}).status_code
+
+def test_tx_status_long_poll(cleanup, async_client):
+    assert (202, 'accepted') == submit_inline_doc(async_client, ('Hello world', '1', 'd001', None, 'text/plain'), headers={'Prefer': 'respond-async'})
+    response = get_tx(async_client, '1', params={'waitFor': 'C,F', 'timeout': 30})
+    assert 200 == response.status_code
+    assert 'C' == response.json['status']
+    assert ['P', 'C'] == [event['status'] for event in response.json['events']]
+
+def test_tx_status_invalid_timeout(cleanup, client):
+    assert (200, 'ok') == submit_inline_doc(client, ('Hello world', '1', 'd001', None, 'text/plain'))
+    assert 400 == get_tx(client, '1', params={'waitFor': 'C', 'timeout': 'soon'}).status_code
+    assert 400 == get_tx(client, '1', params={'waitFor': 'C', 'timeout': -1}).status_code
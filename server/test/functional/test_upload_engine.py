@@ -0,0 +1,65 @@
+import threading
+import time
+import pytest
+
+from test.functional.fixture import cleanup, client, connection_pool, minio, scanner, tracer, metrics, uploader
+from test.functional.util import submit_path_docs, TEST_REALM
+from model.upload_engine import UploadEngine
+from exceptions import StorageException
+import model.tx_submit_service as tx_submit_service
+
+def test_upload_engine_parallel():
+    engine = UploadEngine(4, 2)
+    lock = threading.Lock()
+    running = [0, 0]
+    def task():
+        with lock:
+            running[0] = running[0] + 1
+            running[1] = max(running[1], running[0])
+        time.sleep(0.1)
+        with lock:
+            running[0] = running[0] - 1
+    try:
+        assert {} == engine.run([(str(i), task) for i in range(6)])
+    finally:
+        engine.shutdown()
+    # In parallel, but no more than the per-transaction limit
+    assert 2 == running[1]
+
+def test_upload_engine_errors():
+    engine = UploadEngine(4, 4)
+    def fail(name):
+        raise IOError(name)
+    try:
+        errors = engine.run([('a', lambda: None), ('b', lambda: fail('b')), ('c', lambda: fail('c'))])
+    finally:
+        engine.shutdown()
+    assert ['b', 'c'] == sorted(errors.keys())
+    assert 'c' == str(errors['c'])
+
+def test_storage_exception_errors():
+    # Each exception has its own errors
+    StorageException('failed').errors['d001'] = IOError()
+    assert {} == StorageException('failed').errors
+
+def test_upload_failure(cleanup, client, minio, monkeypatch):
+    # One of the objects of the transaction cannot be stored
+    put_object = tx_submit_service.put_object
+    lock = threading.Lock()
+    calls = [0]
+    def failing_put_object(*args, **kwargs):
+        with lock:
+            calls[0] = calls[0] + 1
+            fail = calls[0] == 2
+        if fail:
+            raise IOError('Simulated object store failure')
+        return put_object(*args, **kwargs)
+    monkeypatch.setattr(tx_submit_service, 'put_object', failing_put_object)
+
+    result = submit_path_docs(client, '1', 'doc-', excludes=['eicar.txt', 'manifest.json'])
+    assert 500 == result[0]
+    assert 'Simulated object store failure' in result[1]
+    assert calls[0] > 2
+    # The objects stored before the failure are removed, and the transaction is rolled back
+    assert [] == list(minio.list_objects('docriver', prefix=TEST_REALM, recursive=True))
+    assert 404 == client.get('/document/' + TEST_REALM + '/' + result[2]['documents'][0]['document']).status_code
@@ -1,5 +1,8 @@
 import os
 import base64
+import json
+import threading
+import http.server
 import time
 from controller.http import init_app
 from gateway import init_db, init_obj_store, init_virus_scanner
@@ -7,6 +10,7 @@ from docriver_auth.keystore import get_entries
 from docriver_auth.auth_token import issue
 from model.s3_url import parse_url
 TEST_REALM = 'test123456'
+OKTA_ISSUER = 'https://okta.test/oauth2/default'
 
 def raw_dir():
     return os.path.abspath(os.path.join(os.getenv('DOCRIVER_GW_HOME'), 'server/test/resources/documents'))
@@ -21,6 +25,27 @@ def issuer_keystore_path(issuer):
     return os.path.abspath(os.path.join(os.getenv('DOCRIVER_GW_HOME'), 
         "server/test/resources/auth/{}.p12".format(issuer)))
 
+def start_jwks_server():
+    # A stand-in for the JWKS endpoint of an issuer: serves the JSON Web Key Set in .jwks, which the caller changes to rotate the keys. Stop with shutdown()
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps(server.jwks).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.jwks = {'keys': []}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def jwks_url(server):
+    return 'http://127.0.0.1:{}/.well-known/jwks.json'.format(server.server_address[1])
+
 def delete_obj_recursively(minio, bucketname, folder):
     objs = minio.list_objects(bucketname, prefix=folder, recursive=True)
     for obj in objs:
@@ -65,7 +90,7 @@ def inline_doc_message(inline, tx, doc, encoding, mime_type, replaces, token, tx
         payload['references'] = tx_references
     return payload
 
-def submit_inline_doc(client, parameters, replaces=None, keystore_file=None, permissions=None, expires=300, delay=0, tx_references=None):
+def submit_inline_doc(client, parameters, replaces=None, keystore_file=None, permissions=None, expires=300, delay=0, tx_references=None, headers={}):
     token = None
     if keystore_file:
         private_key, public_key, signer_cert, signer_cn, public_keys = get_entries(keystore_file, 'docriver')
@@ -76,9 +101,9 @@ def submit_inline_doc(client, parameters, replaces=None, keystore_file=None, per
             time.sleep(delay)
     response = client.post('/tx/' + TEST_REALM, 
                            json=inline_doc_message(*parameters, replaces, token, tx_references),
-                           headers={'Accept': 'application/json'})
+                           headers={'Accept': 'application/json', **headers})
     # print(response.status_code, response.data)
-    return response.status_code, response.json['dr:status'] if response.status_code == 200 else response.data.decode('utf-8')
+    return response.status_code, response.json['dr:status'] if response.status_code in [200, 202] else response.data.decode('utf-8')
 
 def path_doc_message(path, tx, doc, mime_type):
     return {
@@ -204,3 +229,27 @@ def submit_multipart_docs(client, tx, filenames, accept='application/json'):
         return response.status_code, response.json['dr:status'] if response.status_code == 200 else response.data.decode('utf-8'), response.json
     else:
         return response.status_code, response.data.decode('utf-8')    
+
+def wait_for_tx_status(connection_pool, tx, statuses=['C', 'F'], timeout=30):
+    connection = connection_pool.get_connection()
+    cursor = connection.cursor()
+    try:
+        end = time.time() + timeout
+        while True:
+            cursor.execute("""
+                SELECT e.STATUS, e.DESCRIPTION
+                FROM TX t, TX_EVENT e
+                WHERE e.TX_ID = t.ID
+                    AND t.TX = %(tx)s
+                    AND t.REALM = %(realm)s
+                ORDER BY e.ID DESC
+                LIMIT 1
+                """, {'tx': tx, 'realm': TEST_REALM})
+            row = cursor.fetchone()
+            connection.commit()
+            if (row and row[0] in statuses) or time.time() > end:
+                return row
+            time.sleep(0.2)
+    finally:
+        cursor.close()
+        connection.close()